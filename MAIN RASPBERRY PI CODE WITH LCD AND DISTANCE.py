@@ -1,4 +1,8 @@
+import gc
 import time
+import random
+import errno
+import asyncio
 import wifi
 import socketpool
 import board
@@ -11,6 +15,8 @@ from adafruit_display_text import label
 import terminalio
 import pwmio
 import adafruit_vl53l0x
+from sensor_codec import FrameReader, encode_record, encode_batch_header  # Copy sensor_codec.py to CIRCUITPY
+from edge_filter import ReportFilter, oversample  # Copy edge_filter.py to CIRCUITPY
 
 # Wi-Fi Credentials
 SSID = "DIR-825"
@@ -20,6 +26,51 @@ PASSWORD = "01424959"
 SERVER_IP = "192.168.1.129"  # Replace with your laptop's IP address
 SERVER_PORT = 8081
 
+# Uplink settings
+STATION_ID = 1  # Unique per station
+BOOT_ID = random.randint(0, 65535)  # Lets the server tell a reboot from a retransmission
+RING_SIZE = 256  # Readings kept on the device while the server is unreachable
+BATCH_MAX = 32  # Readings sent per batch
+ACK_TIMEOUT = 5  # Seconds to wait for the server to acknowledge a batch
+MAX_BACKOFF = 60  # Longest wait between reconnect attempts, in seconds
+CONNECT_TIMEOUT = 2  # Seconds a connection attempt may block the other tasks
+
+# Task periods in seconds: fire sensors are sampled fastest, the uplink and display run slower
+FIRE_PERIOD = 0.2  # MQ7 and flame sensor
+CLIMATE_PERIOD = 2  # DHT11 (needs at least 1 s between reads)
+WATER_PERIOD = 0.5  # VL53L0X
+UART_PERIOD = 0.05  # Poll for records from the Pico
+REPORT_PERIOD = 1  # Queue one reading for the server
+DISPLAY_PERIOD = 1  # Redraw the LCD
+UPLINK_PERIOD = 5  # Send queued readings
+IO_POLL = 0.02  # Wait between non-blocking socket attempts
+UART_STALE = 150  # Seconds after which the Pico's last values are no longer reported (it sends all of them every 60 s)
+
+# Edge filtering: readings only carry values that changed by more than their deadband, with a
+# full reading every HEARTBEAT seconds; crossing an ALERTS threshold is reported and sent at once.
+# False reports every value every REPORT_PERIOD, as before.
+EDGE_FILTER = True
+OVERSAMPLE = 8  # ADC reads averaged per MQ7 / flame sample
+HEARTBEAT = 60  # Seconds between full readings
+DEADBANDS = {"MQ7": 300, "Flame": 200, "Temp": 1, "Humidity": 2, "Water_Level": 10, "MQ135": 300, "Soil": 500, "Rain": 500}
+ALERTS = {"Flame": ("<", 3500), "MQ135": (">", 9000)}  # Same levels as the server's hazard rules
+
+# LCD lines as (sensor, caption, unit): this station's sensors, then the ones forwarded by the
+# Pico over UART. Missing values show as N/A.
+DISPLAY_LAYOUT = (
+    ("MQ7", "MQ7", ""),
+    ("Flame", "Flame", ""),
+    ("Temp", "Temp", ""),
+    ("Humidity", "Humidity", ""),
+    ("Water_Level", "Water Level", " mm"),
+)
+UART_DISPLAY_LAYOUT = (
+    ("MQ135", "MQ135", ""),
+    ("Soil", "Soil", ""),
+    ("Rain", "Rain", ""),
+)
+DISPLAY_STATS_EVERY = 60  # Redraws between printed display timing and free memory reports
+
 # Initialize UART0 on GPIO pins 0 (TX) and 1 (RX)
 uart = busio.UART(board.GP0, board.GP1, baudrate=115200)
 
@@ -77,28 +128,56 @@ def clear_display():
     while len(splash) > 1:
         splash.pop()
 
-# Parse UART data
+# Text lines on the LCD. The labels are created once; each update only sets the text of the lines
+# whose value changed and redraws the screen if any did, so the loop allocates almost nothing.
+class TextPanel:
+    def __init__(self, layout, x=10, y=10, line_height=12):
+        self.group = displayio.Group(x=x, y=y)
+        self.lines = []
+        for i, (key, caption, unit) in enumerate(layout):
+            text_area = label.Label(terminalio.FONT, text=" ", color=0xFFFFFF, y=i * line_height)
+            self.group.append(text_area)
+            self.lines.append((key, caption, unit, text_area))
+        self.shown = [()] * len(self.lines)  # Value each line shows; () until first drawn
+        self.updates = 0
+        self.total_ms = 0
+        self.slowest_ms = 0
+
+    def update(self, values):
+        started = time.monotonic_ns()
+        changed = False
+        for i, (key, caption, unit, text_area) in enumerate(self.lines):
+            value = values.get(key)
+            if value != self.shown[i]:
+                text_area.text = f"{caption}: {value}{unit}" if value is not None else f"{caption}: N/A"
+                self.shown[i] = value
+                changed = True
+        if changed:
+            display.refresh()
+        elapsed_ms = (time.monotonic_ns() - started) / 1000000
+        self.updates += 1
+        self.total_ms += elapsed_ms
+        self.slowest_ms = max(self.slowest_ms, elapsed_ms)
+        if self.updates % DISPLAY_STATS_EVERY == 0:
+            print(f"Display: {self.total_ms / self.updates:.1f} ms average, {self.slowest_ms:.1f} ms slowest update, {gc.mem_free()} bytes free")
+
+# Reassembles binary records from the Pico; split or corrupted frames are dropped, not misparsed
+uart_frames = FrameReader()
+
+# Parse UART data into the values of the complete records in it (later records win; with edge
+# filtering on the Pico each record only carries the values that changed)
 def parse_uart_data(uart_data):
-    try:
-        uart_data_str = uart_data.decode('utf-8').strip()
-        print(f"Raw UART data: {uart_data_str}")  # Debugging line
-
-        sensor_data = {}
-        items = uart_data_str.split(',')
-
-        for item in items:
-            item = item.strip()
-            try:
-                key, value = item.split(':', 1)
-                sensor_data[key.strip()] = int(value.strip())
-            except ValueError:
-                print(f"Skipping invalid item: {item}")
-
-        print(f"Parsed UART data: {sensor_data}")  # Debugging line
-        return sensor_data
-    except Exception as e:
-        print(f"Error parsing UART data: {e}")
+    records = uart_frames.feed(uart_data)
+    if uart_frames.errors:
+        print(f"Dropped {uart_frames.errors} corrupt UART frames")
+        uart_frames.errors = 0
+    if not records:
         return {}
+    values = {}
+    for station, seq, t_ms, record_values in records:
+        values.update(record_values)
+    print(f"Parsed UART data: {values}")  # Debugging line
+    return values
 
 # Connect to Wi-Fi
 def connect_wifi():
@@ -106,74 +185,262 @@ def connect_wifi():
     wifi.radio.connect(SSID, PASSWORD)
     print(f"Connected to Wi-Fi: {wifi.radio.ipv4_address}")
 
-# Read sensor values
-def read_sensors():
-    mq7_value = mq7.value
-    flame_value = flame_sensor.value
-    try:
-        temperature = dht11.temperature
-        humidity = dht11.humidity
-    except RuntimeError:
-        temperature = None
-        humidity = None
-    return mq7_value, flame_value, temperature, humidity
-
-# Send data to server
-def send_data(data):
-    pool = socketpool.SocketPool(wifi.radio)
-    client_socket = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
-    client_socket.connect((SERVER_IP, SERVER_PORT))
-    client_socket.send(data.encode('utf-8'))
-    client_socket.close()
-    print("Data sent to server.")
-
-# Main function
-def main():
-    connect_wifi()
-    clear_display()
-    time.sleep(1)
+# Latest value of every sensor, written by the sampling tasks and read by the report and display tasks
+latest = {}
 
-    y_offset = 10
-    while True:
-        mq7_value, flame_value, temperature, humidity = read_sensors()
-        print(f"MQ7: {mq7_value}, Flame: {flame_value}, Temp: {temperature}, Humidity: {humidity}")  # Debugging line
+# Worst fire readings since the last report (highest MQ7, lowest flame sensor value), so a
+# flare between two reports still reaches the server
+fire_peaks = {}
 
-        uart_data = None
-        if uart.in_waiting > 0:
-            uart_data = uart.read(128)
-        if(uart_data == None):
-            time.sleep(2)
+# Time the last record from the Pico arrived
+uart_seen = None
 
-        uart_sensor_data = parse_uart_data(uart_data) if uart_data else {}
+# Which values are worth reporting (edge filtering)
+report_filter = ReportFilter(DEADBANDS, ALERTS, HEARTBEAT)
 
-        # Get water level from VL53L0X sensor (distance converted to water level)
-        water_level = vl53.range  # Read distance in millimeters
-        print(f"Water Level: {water_level} mm")
+# Set to report a reading / send queued readings now instead of at the next period
+report_now = asyncio.Event()
+uplink_now = asyncio.Event()
+
+# Wait until the event is set or timeout seconds have passed
+async def wait_event(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+# Fixed-size buffer of readings waiting to be sent; the oldest reading is dropped when full
+class RingBuffer:
+    def __init__(self, size):
+        self.items = [None] * size
+        self.size = size
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def append(self, item):
+        if self.count == self.size:
+            self.start = (self.start + 1) % self.size
+            self.count -= 1
+            self.dropped += 1
+        self.items[(self.start + self.count) % self.size] = item
+        self.count += 1
+
+    def peek(self, n):
+        n = min(n, self.count)
+        return [self.items[(self.start + i) % self.size] for i in range(n)]
+
+    def drop(self, n):
+        n = min(n, self.count)
+        for i in range(n):
+            self.items[(self.start + i) % self.size] = None
+        self.start = (self.start + n) % self.size
+        self.count -= n
+
+# Long-lived connection to the server that sends buffered readings in acknowledged batches
+class Uplink:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.pool = socketpool.SocketPool(wifi.radio)
+        self.sock = None
+        self.buffer = RingBuffer(RING_SIZE)
+        self.next_seq = 0
+        self.backoff = 1
+        self.retry_at = 0
+        self.rx = bytearray(64)
+
+    # Connecting blocks for up to CONNECT_TIMEOUT; afterwards the socket is non-blocking
+    def connect(self):
+        self.sock = self.pool.socket(self.pool.AF_INET, self.pool.SOCK_STREAM)
+        self.sock.settimeout(CONNECT_TIMEOUT)
+        self.sock.connect((self.host, self.port))
+        self.sock.settimeout(0)
+        self.backoff = 1
+        print("Connected to server.")
+
+    def disconnect(self, error):
+        print(f"Uplink error: {error}")
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        # Back off exponentially so an unreachable server does not stall sensing
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    # Wait for the socket without blocking the other tasks; OSError once the deadline has passed
+    async def wait(self, deadline):
+        if time.monotonic() > deadline:
+            raise OSError("timed out")
+        await asyncio.sleep(IO_POLL)
+
+    async def send_all(self, data):
+        view = memoryview(data)
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while len(view):
+            try:
+                sent = self.sock.send(view)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                sent = 0
+            view = view[sent:]
+            if len(view):
+                await self.wait(deadline)
+
+    # Wait for "ACK <station> <boot> <last_seq>"
+    async def read_ack(self):
+        line = b""
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while not line.endswith(b"\n"):
+            try:
+                n = self.sock.recv_into(self.rx)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                await self.wait(deadline)
+                continue
+            if n == 0:
+                raise OSError("connection closed")
+            line += bytes(self.rx[:n])
+        parts = line.split()
+        if len(parts) != 4 or parts[0] != b"ACK":
+            raise OSError(f"bad ack: {line}")
+        return int(parts[3])
+
+    # Queue one reading as an encoded record; it is sent with the next batch
+    def send(self, values):
+        record = encode_record(STATION_ID, self.next_seq, time.monotonic_ns() // 1000000, values)
+        self.buffer.append((self.next_seq, record))
+        self.next_seq += 1
+
+    # Send buffered readings until the buffer is empty or the link fails
+    async def flush(self):
+        while self.buffer.count:
+            if self.sock is None:
+                if time.monotonic() < self.retry_at:
+                    return
+                try:
+                    self.connect()
+                except OSError as e:
+                    self.disconnect(e)
+                    return
+
+            batch = self.buffer.peek(BATCH_MAX)
+            first_seq = batch[0][0]
+            now_ms = time.monotonic_ns() // 1000000
+            frame = encode_batch_header(STATION_ID, BOOT_ID, len(batch), now_ms)
+            frame += b"".join(record for seq, record in batch)
 
-        text_lines = [
-            f"MQ7: {mq7_value}",
-            f"Flame: {flame_value}",
-            f"Temp: {temperature if temperature is not None else 'N/A'}",
-            f"Humidity: {humidity if humidity is not None else 'N/A'}",
-            f"Water Level: {water_level} mm"  # Update distance to water level
-        ]
+            try:
+                await self.send_all(frame)
+                acked = await self.read_ack()
+            except OSError as e:
+                self.disconnect(e)
+                return
 
-        for key, value in uart_sensor_data.items():
-            text_lines.append(f"{key}: {value}")
+            self.buffer.drop(max(0, acked - first_seq + 1))
+            print(f"Sent {len(batch)} readings to server ({self.buffer.count} buffered, {self.buffer.dropped} dropped).")
 
-        while len(splash) > 1:
-            splash.pop()
+# MQ7 and flame sensor: fast, so a fire is seen within a fraction of a second
+async def sample_fire():
+    while True:
+        mq7_value = oversample(lambda: mq7.value, OVERSAMPLE)
+        flame_value = oversample(lambda: flame_sensor.value, OVERSAMPLE)
+        latest["MQ7"] = mq7_value
+        latest["Flame"] = flame_value
+        fire_peaks["MQ7"] = max(fire_peaks.get("MQ7", mq7_value), mq7_value)
+        fire_peaks["Flame"] = min(fire_peaks.get("Flame", flame_value), flame_value)
+        if EDGE_FILTER and report_filter.crossed(fire_peaks):
+            report_now.set()
+        await asyncio.sleep(FIRE_PERIOD)
+
+# DHT11 temperature and humidity
+async def sample_climate():
+    while True:
+        try:
+            latest["Temp"] = dht11.temperature
+            latest["Humidity"] = dht11.humidity
+        except RuntimeError:
+            latest["Temp"] = None
+            latest["Humidity"] = None
+        await asyncio.sleep(CLIMATE_PERIOD)
+
+# Water level from the VL53L0X (distance in millimeters)
+async def sample_water_level():
+    while True:
+        latest["Water_Level"] = vl53.range
+        await asyncio.sleep(WATER_PERIOD)
 
-        for i, line in enumerate(text_lines):
-            text_group = displayio.Group(scale=1, x=10, y=y_offset + i * 12)
-            text_area = label.Label(terminalio.FONT, text=line, color=0xFFFFFF)
-            text_group.append(text_area)
-            splash.append(text_group)
+# Records from the Pico over UART
+async def read_uart():
+    global uart_seen
+    while True:
+        if uart.in_waiting > 0:
+            uart_sensor_data = parse_uart_data(uart.read(uart.in_waiting))
+            if uart_sensor_data:
+                latest.update(uart_sensor_data)
+                uart_seen = time.monotonic()
+                if EDGE_FILTER and report_filter.crossed(uart_sensor_data):
+                    report_now.set()
+        await asyncio.sleep(UART_PERIOD)
+
+# Queue one reading with the latest values (and the fire peaks since the last one) for the uplink;
+# with edge filtering only the values that changed, and nothing if none did
+async def report(uplink):
+    while True:
+        await wait_event(report_now, REPORT_PERIOD)
+        values = dict(latest)
+        values.update(fire_peaks)
+        fire_peaks.clear()
+        if uart_seen is None or time.monotonic() - uart_seen > UART_STALE:
+            for key in ("Soil", "Rain", "MQ135"):
+                values.pop(key, None)
+        if EDGE_FILTER:
+            values, urgent = report_filter.check(values, time.monotonic())
+            if not values:
+                continue
+            if urgent:
+                uplink_now.set()
+        print(f"Reading: {values}")  # Debugging line
+        uplink.send(values)
+
+# Update the LCD with the latest values
+async def refresh_display(panel):
+    while True:
+        panel.update(latest)
+        await asyncio.sleep(DISPLAY_PERIOD)
 
-        data_payload = ', '.join(text_lines)
-        send_data(data_payload)
+# Send queued readings (at once for a hazard); a slow or unreachable server only delays this task
+async def run_uplink(uplink):
+    while True:
+        await uplink.flush()
+        await wait_event(uplink_now, UPLINK_PERIOD)
+
+# Main function: every sensor, the display and the uplink run as separate tasks at their own rates
+async def run(uplink, panel):
+    await asyncio.gather(
+        sample_fire(),
+        sample_climate(),
+        sample_water_level(),
+        read_uart(),
+        report(uplink),
+        refresh_display(panel),
+        run_uplink(uplink),
+    )
 
-        time.sleep(4)
+def main():
+    connect_wifi()
+    uplink = Uplink(SERVER_IP, SERVER_PORT)
+    clear_display()
+    panel = TextPanel(DISPLAY_LAYOUT + UART_DISPLAY_LAYOUT)
+    splash.append(panel.group)
+    display.auto_refresh = False  # The panel redraws only when a line changed
+    asyncio.run(run(uplink, panel))
 
 if __name__ == "__main__":
     main()
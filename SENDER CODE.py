@@ -1,5 +1,17 @@
 from machine import Pin, ADC, UART
 import time
+from sensor_codec import encode_record  # Copy sensor_codec.py to the Pico as well
+from edge_filter import ReportFilter, oversample  # Copy edge_filter.py to the Pico as well
+
+# Edge filtering: sample every second and send only values that changed (plus a full reading
+# every HEARTBEAT seconds, and at once when MQ135 crosses the air quality level).
+# False sends every sample, every 5 s, as before.
+EDGE_FILTER = True
+SAMPLE_PERIOD = 1 if EDGE_FILTER else 5  # Seconds between samples
+OVERSAMPLE = 16  # ADC reads averaged per sample
+HEARTBEAT = 60  # Seconds between full readings
+DEADBANDS = {"MQ135": 300, "Soil": 500, "Rain": 500}  # Smallest change sent, in ADC counts
+ALERTS = {"MQ135": (">", 9000)}  # Same level as the server's Air Quality rule
 
 # Initialize UART0
 uart = UART(0, baudrate=115200, tx=0, rx=1)  # Pin 0 for TX, Pin 1 for RX
@@ -11,21 +23,30 @@ rain_sensor = ADC(Pin(28))  # Rain sensor connected to Pin 28
 
 # Function to read sensor values
 def read_sensors():
-    mq135_value = mq135.read_u16()  # Use read_u16() to get ADC value
-    soil_moisture_value = soil_moisture.read_u16()  # Use read_u16() to get ADC value
-    rain_sensor_value = rain_sensor.read_u16()  # Use read_u16() to get ADC value
+    mq135_value = oversample(mq135.read_u16, OVERSAMPLE)  # Use read_u16() to get ADC value
+    soil_moisture_value = oversample(soil_moisture.read_u16, OVERSAMPLE)  # Use read_u16() to get ADC value
+    rain_sensor_value = oversample(rain_sensor.read_u16, OVERSAMPLE)  # Use read_u16() to get ADC value
     return mq135_value, soil_moisture_value, rain_sensor_value
 
+report_filter = ReportFilter(DEADBANDS, ALERTS, HEARTBEAT)
+
+seq = 0
 while True:
     # Read sensor values
     mq135_value, soil_moisture_value, rain_sensor_value = read_sensors()
-    
-    # Format data into a string
-    data = f"MQ-135:{mq135_value}, Soil:{soil_moisture_value}, Rain:{rain_sensor_value}\n"
-    
-    # Send data over UART
-    uart.write(data)
-    
-    # Wait before sending the next reading
-    time.sleep(5)
+    values = {"MQ135": mq135_value, "Soil": soil_moisture_value, "Rain": rain_sensor_value}
+
+    # Keep only the values worth sending; skip the reading if none are
+    if EDGE_FILTER:
+        values, urgent = report_filter.check(values, time.time())
 
+    if values:
+        # Encode the readings as one binary record (station 0: the Pico 2W stamps its own station id)
+        data = encode_record(0, seq, time.ticks_ms(), values)
+        seq += 1
+
+        # Send data over UART
+        uart.write(data)
+
+    # Wait before sending the next reading
+    time.sleep(SAMPLE_PERIOD)
@@ -0,0 +1,475 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import logging.handlers
+import smtplib
+import argparse
+import threading
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from hazard_engine import HAZARD_RULES
+from metrics import Registry
+
+# Hazard alerts: every time a hazard turns on (or clears) at a station, the dashboard's updater
+# hands the transition to an AlertDispatcher, which deduplicates it, rate limits it and queues it
+# for delivery to the configured sinks (webhook, SMTP, file, syslog) by a pool of async workers
+# with retries. Submitting never waits for a sink, so a slow or unreachable one cannot hold up
+# ingest or the dashboard. Settings are the "alerts" section of hazard_rules.json.
+# Example: python alerts.py --standins          local webhook and SMTP servers that print what they get
+#          python alerts.py --send-test         send a test alert through the configured sinks
+
+# Settings and their defaults
+#   cooldown        seconds after an alert for a station and hazard during which it is not raised
+#                   again; an onset held back this way is sent when the cooldown ends if the hazard
+#                   is still on, so a flapping sensor gives one alert per cooldown
+#   notify_cleared  also alert when a hazard clears (only for onsets that were alerted)
+#   rate, burst     token bucket over all alerts: alerts per second sustained, and the burst allowed;
+#                   alerts over the limit are sent as one summary when tokens are back
+#   max_age         transitions of readings older than this many seconds (backfill after a restart,
+#                   late buffered readings) are not alerted
+#   workers         concurrent deliveries
+#   queue_size      deliveries waiting; when full, new ones are dropped and counted
+#   retries         further attempts after a failed delivery, backoff * 2^attempt seconds apart (jittered)
+#   timeout         seconds a sink may take for one delivery
+#   sinks           [{"type": "webhook" | "smtp" | "file" | "syslog", ...}], see SINK_TYPES
+ALERT_DEFAULTS = {
+    "cooldown": 300,
+    "notify_cleared": True,
+    "rate": 0.2,
+    "burst": 10,
+    "max_age": 300,
+    "workers": 4,
+    "queue_size": 1000,
+    "retries": 5,
+    "backoff": 1.0,
+    "timeout": 10,
+    "sinks": [],
+}
+
+# Alert latency buckets in seconds: sample time to delivery, retries and held-back alerts included
+ALERT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+# Seconds between checks for held-back alerts that are due
+TICK_INTERVAL = 1
+
+
+# One hazard transition at one station. timestamp is the sample time of the reading that caused it.
+class Alert:
+    __slots__ = ("station", "hazard", "active", "timestamp", "values")
+
+    def __init__(self, station, hazard, active, timestamp, values=None):
+        self.station = station
+        self.hazard = hazard
+        self.active = active
+        self.timestamp = timestamp
+        self.values = values or {}
+
+    @classmethod
+    def from_reading(cls, reading, hazard, active):
+        values = {field: value for field, value in reading._asdict().items()
+                  if field not in ("seq", "timestamp", "station") and value == value}
+        return cls(reading.station, hazard, active, reading.timestamp, values)
+
+    def subject(self):
+        return f"{self.hazard} {'detected' if self.active else 'cleared'} at station {self.station}"
+
+    def to_dict(self):
+        return {"station": self.station, "hazard": self.hazard, "state": "on" if self.active else "off",
+                "timestamp": self.timestamp, "time": datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+                "values": self.values}
+
+    def text(self):
+        values = ", ".join(f"{field}: {value:g}" for field, value in self.values.items())
+        return f"{self.subject()} at {self.to_dict()['time']} ({values})"
+
+
+# Alerts held back by the rate limit, sent together as one
+class AlertSummary:
+    def __init__(self, alerts):
+        self.alerts = alerts
+        self.timestamp = min(alert.timestamp for alert in alerts)
+
+    def subject(self):
+        return f"{len(self.alerts)} hazard alerts held back by the rate limit"
+
+    def to_dict(self):
+        return {"summary": self.subject(), "alerts": [alert.to_dict() for alert in self.alerts]}
+
+    def text(self):
+        return self.subject() + ":\n" + "\n".join(alert.text() for alert in self.alerts)
+
+
+# Classic token bucket: burst tokens, refilled at rate per second
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def take(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+# Per station and hazard: whether the last alert sent said on or off, when an onset was last sent,
+# and an onset held back by the cooldown
+class Deduplicator:
+    def __init__(self, cooldown, notify_cleared=True):
+        self.cooldown = cooldown
+        self.notify_cleared = notify_cleared
+        self.sent = {}  # (station, hazard) -> (active, time of the last onset sent)
+        self.pending = {}  # (station, hazard) -> Alert
+
+    # True if the alert should be sent now
+    def check(self, alert, now):
+        key = (alert.station, alert.hazard)
+        last = self.sent.get(key)
+        if alert.active:
+            if last is not None and last[0]:
+                self.pending.pop(key, None)
+                return False
+            if last is not None and now - last[1] < self.cooldown:
+                self.pending[key] = alert
+                return False
+            self.pending.pop(key, None)
+            self.sent[key] = (True, now)
+            return True
+        # An onset still held back never needs sending, and neither does the clearing of one
+        self.pending.pop(key, None)
+        if last is None or not last[0]:
+            return False
+        self.sent[key] = (False, last[1])
+        return self.notify_cleared
+
+    # Held-back onsets whose cooldown has ended (the hazard is still on: a clear would have dropped them)
+    def due(self, now):
+        ready = []
+        for key, alert in list(self.pending.items()):
+            if now - self.sent[key][1] >= self.cooldown:
+                del self.pending[key]
+                self.sent[key] = (True, now)
+                ready.append(alert)
+        return ready
+
+
+# POST the alert as JSON
+class WebhookSink:
+    def __init__(self, url, headers=None, name="webhook"):
+        self.url = url
+        self.headers = headers or {}
+        self.name = name
+
+    def send(self, alert, timeout):
+        body = json.dumps(alert.to_dict()).encode('utf-8')
+        request = urllib.request.Request(self.url, body, {"Content-Type": "application/json", **self.headers})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+
+
+# Email the alert; the password is read from the environment variable named by password_env
+class SmtpSink:
+    def __init__(self, to, sender="hazard-monitor@localhost", host="localhost", port=25, username=None,
+                 password_env=None, starttls=False, name="smtp"):
+        self.to = [to] if isinstance(to, str) else list(to)
+        self.sender = sender
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password_env = password_env
+        self.starttls = starttls
+        self.name = name
+
+    def send(self, alert, timeout):
+        message = EmailMessage()
+        message["Subject"] = alert.subject()
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.to)
+        message.set_content(alert.text())
+        with smtplib.SMTP(self.host, self.port, timeout=timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, os.environ.get(self.password_env or "", ""))
+            smtp.send_message(message)
+
+
+# Append the alert to a file as one JSON line
+class FileSink:
+    def __init__(self, path="alerts.log", name="file"):
+        self.path = path
+        self.name = name
+        self.lock = threading.Lock()
+
+    def send(self, alert, timeout):
+        line = json.dumps(alert.to_dict()) + "\n"
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+# SysLogHandler that lets send errors through, so failed deliveries are retried
+class _SysLogHandler(logging.handlers.SysLogHandler):
+    def handleError(self, record):
+        raise
+
+
+# Send the alert to syslog: a Unix socket path ("/dev/log") or [host, port] over UDP
+class SyslogSink:
+    def __init__(self, address="/dev/log", facility="user", name="syslog"):
+        address = tuple(address) if isinstance(address, list) else address
+        self.handler = _SysLogHandler(address, _SysLogHandler.facility_names[facility])
+        self.handler.setFormatter(logging.Formatter("hazard-monitor: %(message)s"))
+        self.name = name
+
+    def send(self, alert, timeout):
+        if getattr(self.handler, "socket", None) is not None:
+            self.handler.socket.settimeout(timeout)
+        self.handler.emit(logging.makeLogRecord({"msg": alert.text().replace("\n", " "),
+                                                 "levelno": logging.WARNING, "levelname": "WARNING"}))
+
+
+# Sink classes by "type"; add an entry to plug in another sink (any class with name and send(alert, timeout))
+SINK_TYPES = {
+    "webhook": WebhookSink,
+    "smtp": SmtpSink,
+    "file": FileSink,
+    "syslog": SyslogSink,
+}
+
+
+def make_sink(spec):
+    spec = dict(spec)
+    kind = spec.pop("type", None)
+    if kind not in SINK_TYPES:
+        raise ValueError(f"unknown alert sink type: {kind}")
+    spec.setdefault("name", kind)
+    return SINK_TYPES[kind](**spec)
+
+
+# Deduplicates, rate limits and delivers hazard alerts; see the module comment. submit() is called
+# by the dashboard's updater; start() runs the delivery workers on their own event loop thread.
+class AlertDispatcher:
+    def __init__(self, sinks, registry=None, **settings):
+        unknown = set(settings) - set(ALERT_DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown alert settings: {', '.join(sorted(unknown))}")
+        settings = dict(ALERT_DEFAULTS, **settings)
+        self.sinks = sinks
+        self.settings = settings
+        self.dedup = Deduplicator(settings["cooldown"], settings["notify_cleared"])
+        self.bucket = TokenBucket(settings["rate"], settings["burst"])
+        self.held = []  # Alerts over the rate limit
+        self.lock = threading.Lock()
+        self.loop = None
+        self.queue = None
+        # Sinks use blocking libraries (urllib, smtplib) and run here, one thread per worker: a hung
+        # sink ties up these threads (until its own timeout), never the process's default pool
+        self.executor = ThreadPoolExecutor(settings["workers"], thread_name_prefix="alert-sink")
+
+        registry = registry or Registry()
+        self.transitions = registry.counter("alert_transitions_total", "Hazard transitions submitted for alerting")
+        self.suppressed = {reason: registry.counter("alert_suppressed_total", "Alerts not sent, by reason", reason=reason)
+                           for reason in ("stale", "duplicate", "rate_limit", "queue_full")}
+        self.deliveries = {(sink.name, result): registry.counter("alert_deliveries_total", "Alert deliveries, by sink and result",
+                                                                 sink=sink.name, result=result)
+                           for sink in sinks for result in ("sent", "retried", "failed")}
+        self.latency = {sink.name: registry.histogram("alert_latency_seconds", "Sample time of the triggering reading to delivery",
+                                                      ALERT_LATENCY_BUCKETS, sink=sink.name)
+                        for sink in sinks}
+
+    @classmethod
+    def from_file(cls, path=HAZARD_RULES, registry=None):
+        with open(path) as f:
+            settings = dict(json.load(f).get("alerts", {}))
+        sinks = [make_sink(spec) for spec in settings.pop("sinks", [])]
+        return cls(sinks, registry, **settings)
+
+    # Start the delivery workers on a daemon thread; alerts submitted before this are not delivered
+    def start(self):
+        if self.loop is not None or not self.sinks:
+            return
+        ready = threading.Event()
+        threading.Thread(target=asyncio.run, args=(self._serve(ready),), daemon=True).start()
+        ready.wait()
+
+    # Hand over the hazard transitions of one batch ([(reading, hazard, turned on)]); never blocks on a sink
+    def submit(self, transitions, now=None):
+        if not transitions or not self.sinks:
+            return
+        now = time.time() if now is None else now
+        ready = []
+        with self.lock:
+            for reading, hazard, active in transitions:
+                self.transitions.inc()
+                if now - reading.timestamp > self.settings["max_age"]:
+                    self.suppressed["stale"].inc()
+                    continue
+                alert = Alert.from_reading(reading, hazard, active)
+                if not self.dedup.check(alert, now):
+                    self.suppressed["duplicate"].inc()
+                    continue
+                ready.extend(self._admit(alert, now))
+        for alert in ready:
+            self._dispatch(alert)
+
+    # Apply the rate limit; alerts over it are kept for a summary
+    def _admit(self, alert, now):
+        if self.bucket.take(now):
+            return [alert]
+        self.suppressed["rate_limit"].inc()
+        self.held.append(alert)
+        return []
+
+    def _dispatch(self, alert):
+        if self.loop is None:
+            return
+        for sink in self.sinks:
+            self.loop.call_soon_threadsafe(self._enqueue, (alert, sink, 0))
+
+    def _enqueue(self, job):
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.suppressed["queue_full"].inc()
+
+    async def _serve(self, ready):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.settings["queue_size"])
+        ready.set()
+        workers = [asyncio.create_task(self._deliver()) for _ in range(self.settings["workers"])]
+        try:
+            while True:
+                await asyncio.sleep(TICK_INTERVAL)
+                self._tick(time.time())
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=False)
+
+    # Send held-back onsets whose cooldown ended, and a summary of rate-limited alerts once a token is back
+    def _tick(self, now):
+        ready = []
+        with self.lock:
+            for alert in self.dedup.due(now):
+                ready.extend(self._admit(alert, now))
+            if self.held and self.bucket.take(now):
+                ready.append(AlertSummary(self.held))
+                self.held = []
+        for alert in ready:
+            self._dispatch(alert)
+
+    async def _deliver(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            alert, sink, attempt = await self.queue.get()
+            timeout = self.settings["timeout"]
+            try:
+                await asyncio.wait_for(loop.run_in_executor(self.executor, sink.send, alert, timeout), timeout)
+            except Exception as e:
+                if attempt < self.settings["retries"]:
+                    self.deliveries[(sink.name, "retried")].inc()
+                    delay = self.settings["backoff"] * 2 ** attempt * random.uniform(0.5, 1.5)
+                    loop.call_later(delay, self._enqueue, (alert, sink, attempt + 1))
+                else:
+                    self.deliveries[(sink.name, "failed")].inc()
+                    print(f"Alert to {sink.name} failed after {attempt + 1} attempts: {alert.subject()}: {e!r}")
+                continue
+            self.deliveries[(sink.name, "sent")].inc()
+            self.latency[sink.name].observe(time.time() - alert.timestamp)
+
+
+# Local stand-ins for trying the sinks: a webhook receiver and an SMTP server that print what they get
+def run_standins(host="127.0.0.1", webhook_port=8090, smtp_port=8025):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            print(f"webhook: {body.decode('utf-8', 'replace')}")
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    webhook = ThreadingHTTPServer((host, webhook_port), WebhookHandler)
+    threading.Thread(target=webhook.serve_forever, daemon=True).start()
+
+    async def smtp_session(reader, writer):
+        writer.write(b"220 stand-in SMTP\r\n")
+        in_data = False
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if in_data:
+                if line.rstrip(b"\r\n") == b".":
+                    print("smtp: " + b"".join(lines).decode('utf-8', 'replace').replace("\r\n", "\n      "))
+                    lines = []
+                    in_data = False
+                    writer.write(b"250 OK\r\n")
+                else:
+                    lines.append(line)
+                continue
+            command = line[:4].upper()
+            if command == b"DATA":
+                in_data = True
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 Bye\r\n")
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def serve_smtp():
+        server = await asyncio.start_server(smtp_session, host, smtp_port)
+        print(f"Webhook stand-in on http://{host}:{webhook_port}/, SMTP stand-in on {host}:{smtp_port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve_smtp())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hazard alert sinks: local stand-ins and test alerts")
+    parser.add_argument('--rules', default=HAZARD_RULES, help="rules file with the alerts section")
+    parser.add_argument('--standins', action='store_true', help="run local webhook and SMTP stand-ins")
+    parser.add_argument('--send-test', action='store_true', help="send a test alert through the configured sinks")
+    args = parser.parse_args()
+
+    if args.standins:
+        run_standins()
+    elif args.send_test:
+        registry = Registry()
+        dispatcher = AlertDispatcher.from_file(args.rules, registry)
+        if not dispatcher.sinks:
+            raise SystemExit(f"No alert sinks configured in {args.rules}")
+        dispatcher.start()
+        dispatcher._dispatch(Alert(0, "Test", True, time.time(), {"MQ135": 0}))
+        deadline = time.time() + dispatcher.settings["timeout"] + 1
+        while time.time() < deadline:
+            done = sum(dispatcher.deliveries[(sink.name, result)].value for sink in dispatcher.sinks for result in ("sent", "failed"))
+            if done == len(dispatcher.sinks):
+                break
+            time.sleep(0.05)
+        for sink in dispatcher.sinks:
+            sent = dispatcher.deliveries[(sink.name, "sent")].value
+            latency = dispatcher.latency[sink.name]
+            print(f"{sink.name}: {'sent' if sent else 'not sent'}" +
+                  (f" in {latency.sum * 1000:.1f} ms" if sent else ""))
+    else:
+        parser.print_help()
@@ -1,140 +1,556 @@
-import openpyxl
+import os
 import time
+import json
+import gzip
+import queue
+import hashlib
+import argparse
+import signal
 import threading
-from flask import Flask, jsonify, render_template_string
+from datetime import datetime
+from flask import Flask, Response, abort, jsonify, request
+from sensor_store import SegmentStore, value_or_none
+from history import RingHistory, Rollups, local_array, query_range, DEFAULT_MAX_POINTS
+from hazard_engine import HazardEngine, HAZARD_RULES
+from trends import TrendDetector, warning_stations
+from event_bus import BusSubscriber, BUS_ADDRESS, parse_address
+from stations import StationRegistry
+from shared_state import SharedArena, StateSnapshot
+from store_query import query, iter_csv, iter_ndjson, parse_fields, parse_stations
+from alerts import AlertDispatcher
+from metrics import Registry, SamplingProfiler, read_metrics_files, merge_families, SIZE_BUCKETS, ROW_BUCKETS
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize sensor data storage
+# Fast JSON encoder when orjson is installed, compact json.dumps otherwise; both return bytes
+try:
+    import orjson
+
+    def dumps(data):
+        return orjson.dumps(data)
+except ImportError:
+    def dumps(data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+# Responses smaller than this are not worth gzipping
+GZIP_MIN_SIZE = 1024
+
+# Samples kept in memory for the charts; older samples stay in the store
+HISTORY_CAPACITY = 10000
+
+# Seconds of stored history loaded into the rollups when the dashboard starts
+ROLLUP_BACKFILL = 7 * 24 * 3600
+
+# Stations with their own history shard when the live state is in shared memory (--max-stations);
+# stations beyond it keep hazard state and alerts but are not listed
+MAX_STATIONS = 256
+
+# Hazard rules (thresholds, hysteresis, minimum durations) from hazard_rules.json
+engine = HazardEngine.from_file(HAZARD_RULES)
+
+# Early warnings for fast rises (EWMA baseline, z-score, rate of change, CUSUM) from the same file
+trends = TrendDetector.from_file(HAZARD_RULES)
+
+# Live state: a fixed-size ring of samples, 1 min/10 min/1 h rollups, every station seen (latest
+# values, history shard and hazard state per station) and a snapshot of sensor_data for readers.
+# The updater is the only writer; request handlers only read, so with allocate from a shared
+# memory arena several worker processes serve the same state (see use_shared_memory).
+def create_state(allocate=local_array, max_stations=None):
+    return (RingHistory(HISTORY_CAPACITY, allocate=allocate),
+            Rollups(allocate=allocate),
+            StationRegistry(engine.names(), allocate=allocate, max_stations=max_stations),
+            StateSnapshot(allocate=allocate))
+
+history, rollups, stations, state = create_state()
+
+# Updater metrics (store reads, hazard evaluation, whole updates) and request metrics (/data);
+# /metrics serves both plus the .prom files other processes write next to the store
+update_metrics = Registry()
+RELOAD_SECONDS = {source: update_metrics.histogram("dashboard_reload_seconds", "Reading rows back from the store", source=source)
+                  for source in ("backfill", "catch_up")}
+HAZARD_SECONDS = update_metrics.histogram("dashboard_hazard_seconds", "Hazard rule evaluation and station update for one batch")
+TREND_SECONDS = update_metrics.histogram("dashboard_trend_seconds", "Trend detection for one batch")
+UPDATE_SECONDS = update_metrics.histogram("dashboard_update_seconds", "Whole update for one batch (history, rollups, hazards, trends, events)")
+UPDATE_ROWS = update_metrics.histogram("dashboard_update_rows", "Readings per update", ROW_BUCKETS)
+PROCESSED = update_metrics.counter("dashboard_readings_total", "Readings added to the live state")
+request_metrics = Registry()
+DATA_REQUESTS = {cache: request_metrics.counter("dashboard_data_requests_total", "/data requests, by response cache outcome", cache=cache)
+                 for cache in ("hit", "miss")}
+DATA_SERIALISE_SECONDS = request_metrics.histogram("dashboard_data_serialise_seconds", "Building, encoding and compressing a /data response")
+DATA_BYTES = request_metrics.histogram("dashboard_data_bytes", "Size of /data response bodies", SIZE_BUCKETS)
+
+# Alerts for hazard transitions (dedup, rate limit, delivery to the sinks in hazard_rules.json);
+# delivery runs in whichever process runs the updater
+alerts = AlertDispatcher.from_file(HAZARD_RULES, update_metrics)
+
+# Where the updater process writes its metrics under gunicorn; None while the updater runs in this process
+UPDATER_METRICS_FILE = None
+
+# Where this gunicorn worker writes its request metrics for the other workers' /metrics; None otherwise
+WORKER_METRICS_FILE = None
+
+# Sampling profiler behind /profile; None unless the dashboard was started with --profile
+profiler = None
+
+# Rows per hazard evaluation while loading stored history
+BACKFILL_CHUNK = 10000
+
 sensor_data = {
-    "MQ7": [],
-    "Flame": [],
-    "Temp": [],
-    "Humidity": [],
-    "Water_Level": [],
-    "Soil": [],
-    "Rain": [],
-    "MQ135": [],
-    "Timestamp": [],
     "latest_values": {},
-    "warnings": []  # Store hazard warnings
 }
 
-# Read Excel file and update sensor data
-def read_excel():
-    wb = openpyxl.load_workbook('sensor_data.xlsx')
-    sheet = wb.active
-    values = []
+# Read-only view of the store written by the receiver (message recieve.py)
+store = SegmentStore("sensor_store", readonly=True)
+
+# Sensor columns charted by the dashboard
+SAMPLE_KEYS = ("MQ7", "Flame", "Temp", "Humidity", "Water_Level", "Soil", "Rain", "MQ135")
+
+# Read the readings stored after the given sequence number
+def read_new(last_seq):
+    return list(store.since(last_seq + 1))
 
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        values.append(row)
+# Load recent stored rows into the history, rollups and hazard state; returns the newest reading loaded
+def backfill():
+    latest_data = None
+    chunk = []
+    started = time.perf_counter()
+    for reading in store.scan(time.time() - ROLLUP_BACKFILL):
+        if history.append(reading):
+            rollups.add(reading)
+            chunk.append(reading)
+        if len(chunk) == BACKFILL_CHUNK:
+            update_latest(chunk)
+            latest_data = chunk[-1]
+            chunk = []
+    if chunk:
+        update_latest(chunk)
+        latest_data = chunk[-1]
+    RELOAD_SECONDS["backfill"].observe(time.perf_counter() - started)
+    return latest_data
 
-    return values
+# Format an epoch timestamp the way the dashboard shows it
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
-# Hazard prediction algorithm
-def hazard_prediction(latest_data):
+# Parse a from/to query argument: epoch seconds or "YYYY-MM-DD HH:MM:SS"
+def parse_time(value):
+    if not value:
+        return None
     try:
-        # Preprocess sensor values to extract numeric part
-        def parse_value(value):
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+# Fans server-sent events out to every /stream subscriber; each event is serialised once
+class EventBroadcaster:
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data, event_id=None):
+        message = format_event(event, data, event_id)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
             try:
-                # Remove non-numeric characters and convert to float
-                numeric_value = ''.join(filter(str.isdigit, str(value)))
-                return float(numeric_value) if numeric_value else None
-            except ValueError:
-                return None  # In case parsing fails
-        
-        rain = parse_value(latest_data[6])  # Rain Sensor Value
-        water_level = parse_value(latest_data[4])  # Water Level Sensor Value
-        soil_moisture = parse_value(latest_data[5])  # Soil Moisture Sensor Value
-        flame = parse_value(latest_data[1])  # Flame Sensor Value
-        temp = parse_value(latest_data[2])  # Temperature Sensor Value
-        air_quality_mq7 = parse_value(latest_data[0])  # MQ7 Sensor Value
-        air_quality_mq135 = parse_value(latest_data[7])  # MQ135 Sensor Value
-
-        # Log the parsed values for debugging
-        print(f"Parsed values - Rain: {rain}, Water Level: {water_level}, Soil: {soil_moisture}, Flame: {flame}, Temp: {temp}, MQ7: {air_quality_mq7}, MQ135: {air_quality_mq135}")
-
-        # Initialize hazard status
-        hazard_status = {
-            "Flood": False,
-            "Fire": False,
-            "Air Quality": False
-        }
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Too slow to keep up: end its stream; the browser reconnects and catches up
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+# Format one server-sent event
+def format_event(event, data, event_id=None):
+    message = f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message + "\n"
+
+events = EventBroadcaster()
+
+# Encoded response bodies shared by every client asking the same question between two updates.
+# Each update tick clears the cache, so a body is serialised (and gzipped) at most once per tick.
+class ResponseCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        # Held while building, so concurrent misses on the same tick build once and share it
+        self.build_lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.entries = {}
 
-        # Hazard conditions (ensure values are within a valid range before checking)
-        if rain is not None and water_level is not None and soil_moisture is not None:
-            if rain < 40000 and water_level < 200 and soil_moisture < 40000:
-                hazard_status["Flood"] = True
-
-        # Check flame sensor value for fire hazard (flame less than 4500)
-        if flame is not None:
-            if flame < 3500:
-                hazard_status["Fire"] = True
-            if temp/10 > 31:
-                hazard_status["Fire"] = True# Trigger fire warning if flame value is low
-
-        if air_quality_mq7 is not None and air_quality_mq135 is not None:
-            if air_quality_mq135 > 9000:
-                hazard_status["Air Quality"] = True
-                
-
-        return hazard_status
-    except Exception as e:
-        print(f"Error in hazard_prediction: {e}")
-        return {"Flood": False, "Fire": False, "Air Quality": False}
-
-# Update sensor data from Excel every 2 seconds
+    # Cached value for key, built with build() on a miss
+    def get(self, key, build):
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+        with self.build_lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+            version = self.version
+            entry = build()
+            with self.lock:
+                # Not cached if an update arrived while it was being built, or if the cache is full
+                if version == self.version and len(self.entries) < self.max_entries:
+                    self.entries[key] = entry
+        return entry
+
+responses = ResponseCache()
+
+# JSON response for the current request built by build(), served from the response cache
+def cached_json(build):
+    accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    cache = "hit"
+
+    def encode():
+        nonlocal cache
+        cache = "miss"
+        with DATA_SERIALISE_SECONDS.time():
+            body = dumps(build())
+            if accepts_gzip and len(body) >= GZIP_MIN_SIZE:
+                return gzip.compress(body, 5), 'gzip'
+            return body, None
+
+    body, encoding = responses.get((request.path, request.query_string, accepts_gzip), encode)
+    DATA_REQUESTS[cache].inc()
+    DATA_BYTES.observe(len(body))
+    response = Response(body, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Samples with a sequence number above since (at most the newest limit of them), from the
+# fleet-wide history or one station's shard
+def samples_since(since, limit=None, ring=None):
+    rows = (ring or history).since(since, limit)
+    payload = {key: [value_or_none(value) for value in rows[key]] for key in SAMPLE_KEYS}
+    payload["Timestamp"] = [format_timestamp(t) for t in rows["timestamp"]]
+    payload["Seq"] = rows["seq"]
+    payload["seq"] = rows["seq"][-1] if rows["seq"] else since
+    return payload
+
+# Hazard prediction: evaluate the rule set over a batch of new readings at once, update each
+# station's state, alert on the stations whose hazards turned on or off and return the fleet
+# status (a hazard is on if any station has it)
+def hazard_prediction(readings):
+    with HAZARD_SECONDS.time():
+        active = engine.update(readings)
+        transitions = stations.update(readings, active)
+        alerts.submit(transitions)
+        return stations.fleet_status()
+
+# Refresh the latest values, hazard status and trends from a batch of new readings;
+# returns True if the hazard status or the set of early warnings changed
+def update_latest(new_rows):
+    # Update latest values
+    latest_data = new_rows[-1]
+    sensor_data["latest_values"] = {key: value_or_none(getattr(latest_data, key)) for key in SAMPLE_KEYS}
+
+    # Call hazard prediction
+    hazard_status = hazard_prediction(new_rows)
+    changed = hazard_status != sensor_data.get("hazard_status")
+    sensor_data["hazard_status"] = hazard_status
+
+    # Trend state of the latest reading's station, and every sensor rising anywhere
+    with TREND_SECONDS.time():
+        trends.update(new_rows)
+    sensor_data["trends"] = trends.station(latest_data.station)
+    early_warnings = trends.warnings()
+    changed = changed or warning_stations(early_warnings) != warning_stations(sensor_data.get("early_warnings"))
+    sensor_data["early_warnings"] = early_warnings
+    state.publish(sensor_data)
+    return changed
+
+# Sequence number of the newest reading processed
+last_seq = -1
+
+# Add new readings to the history, rollups and hazard state, then push them to /stream subscribers
+def process_new_rows(new_rows):
+    global last_seq
+    started = time.perf_counter()
+    # Rows already held are skipped
+    new_rows = [reading for reading in new_rows if history.append(reading)]
+    if not new_rows:
+        return
+    for reading in new_rows:
+        rollups.add(reading)
+    last_seq = new_rows[-1].seq
+    changed = update_latest(new_rows)
+    responses.invalidate()
+
+    # Push the new samples (and any hazard change) to /stream subscribers
+    samples = samples_since(new_rows[0].seq - 1)
+    samples["latest_values"] = sensor_data["latest_values"]
+    events.publish("samples", samples, last_seq)
+    if changed:
+        events.publish("hazard", {"hazard_status": sensor_data["hazard_status"], "early_warnings": sensor_data["early_warnings"]}, last_seq)
+        print(f"Updated hazard status: {sensor_data['hazard_status']}, early warnings: {warning_stations(sensor_data['early_warnings'])}")
+    UPDATE_SECONDS.observe(time.perf_counter() - started)
+    UPDATE_ROWS.observe(len(new_rows))
+    PROCESSED.inc(len(new_rows))
+
+# Read anything stored since the last processed reading (after a reconnect or a missed frame)
+def catch_up():
+    with RELOAD_SECONDS["catch_up"].time():
+        new_rows = read_new(last_seq)
+    process_new_rows(new_rows)
+
+# Readings published by the receiver on the event bus
+def on_readings(readings):
+    if readings[0].seq > last_seq + 1:
+        catch_up()
+    process_new_rows(readings)
+
+# Update sensor data as the receiver publishes new readings (no polling of the store)
 def update_sensor_data():
-    while True:
-        try:
-            data = read_excel()
-            if data:
-                latest_data = data[-1]  # Get the latest row of data
-                timestamp = latest_data[8]  # Timestamp column index
-
-                # Append data to respective lists
-                sensor_data["MQ7"].append(latest_data[0])
-                sensor_data["Flame"].append(latest_data[1])
-                sensor_data["Temp"].append(latest_data[2])
-                sensor_data["Humidity"].append(latest_data[3])
-                sensor_data["Water_Level"].append(latest_data[4])
-                sensor_data["Soil"].append(latest_data[5])
-                sensor_data["Rain"].append(latest_data[6])
-                sensor_data["MQ135"].append(latest_data[7])
-                sensor_data["Timestamp"].append(timestamp)
-
-                # Update latest values
-                sensor_data["latest_values"] = {
-                    "MQ7": latest_data[0],
-                    "Flame": latest_data[1],
-                    "Temp": latest_data[2],
-                    "Humidity": latest_data[3],
-                    "Water_Level": latest_data[4],
-                    "Soil": latest_data[5],
-                    "Rain": latest_data[6],
-                    "MQ135": latest_data[7],
-                }
+    global last_seq
+    alerts.start()
+    latest_data = backfill()
+    last_seq = latest_data.seq if latest_data else store.next_seq() - 1
+    BusSubscriber(on_readings, BUS_ADDRESS, on_connect=catch_up).run()
 
-                # Call hazard prediction
-                hazard_status = hazard_prediction(latest_data)
-                sensor_data["hazard_status"] = hazard_status
-                print(f"Updated hazard status: {hazard_status}")
+# Seconds between checks for new state by worker processes reading shared memory
+FOLLOW_INTERVAL = 0.02
 
-            time.sleep(2)  # Update every 2 seconds
+# In a worker process reading shared memory: push what the writer process adds to this
+# worker's /stream subscribers. The writer publishes the state snapshot after the rows, so
+# a new snapshot version means the rows are already in the shared history.
+def follow_shared_state():
+    version = state.version()
+    seen = history.last_seq
+    hazard_status = state.read().get("hazard_status")
+    warnings = warning_stations(state.read().get("early_warnings"))
+    try:
+        while True:
+            time.sleep(FOLLOW_INTERVAL)
+            if state.version() == version:
+                continue
+            version = state.version()
+            responses.invalidate()
+            current = state.read()
+            samples = samples_since(seen)
+            samples["latest_values"] = current.get("latest_values", {})
+            seen = samples["seq"]
+            if samples["Seq"]:
+                events.publish("samples", samples, seen)
+            if current.get("hazard_status") != hazard_status or warning_stations(current.get("early_warnings")) != warnings:
+                hazard_status = current.get("hazard_status")
+                warnings = warning_stations(current.get("early_warnings"))
+                events.publish("hazard", {"hazard_status": hazard_status, "early_warnings": current.get("early_warnings", {})}, seen)
+    except ValueError:
+        return  # Shared memory was closed: the worker is exiting
+
+# Move the live state into one shared memory block that worker processes forked afterwards
+# inherit. Returns the arena; its creator unlinks it at shutdown.
+def use_shared_memory():
+    global history, rollups, stations, state
+    layout = lambda allocate: create_state(allocate, MAX_STATIONS)
+    arena = SharedArena.for_layout(layout)
+    history, rollups, stations, state = layout(arena.allocate)
+    return arena
 
-        except Exception as e:
-            print(f"Error in update_sensor_data: {e}")
+# from, to (default now) and max_points of a range query; bad values end the request with a 400
+def range_args():
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+    except ValueError as e:
+        abort(400, str(e))
+    max_points = request.args.get('max_points', DEFAULT_MAX_POINTS, type=int)
+    if max_points <= 0:
+        abort(400, "max_points must be positive")
+    return start, end or time.time(), max_points
 
 # Flask route to get sensor data as JSON
+#   /data?since=<seq>[&limit=<n>]       only samples newer than seq
+#   /data?from=<t>[&to=<t>][&max_points=<n>]  a time range, served from raw samples or rollups
+# Both also carry latest_values, hazard_status, trends (EWMA mean, sigma, z-score, rate per minute and
+# CUSUM of the latest reading's station) and early_warnings (sensors rising fast, per station).
+# Responses are serialised once per update and shared by every client sending the same query.
 @app.route('/data')
 def data():
-    return jsonify(sensor_data)
+    return cached_json(data_payload)
+
+def data_payload():
+    start, end, max_points = range_args()
+    if start is not None:
+        resolution, series = query_range(history, rollups, start, end, max_points)
+        for out in series.values():
+            out["x"] = [format_timestamp(t) for t in out["x"]]
+        payload = {"resolution": resolution, "series": series}
+        payload.update(state.read())
+        return payload
+
+    since = request.args.get('since', type=int)
+    payload = samples_since(-1 if since is None else since, request.args.get('limit', type=int))
+    payload.update(state.read())
+    return payload
+
+# Flask route listing stations
+#   /stations                                  every station with its latest values and hazards
+#   /stations?hazard=Flood                     only stations currently in that hazard state
+#   /stations?top=MQ135[&n=10][&window=3600]   the n stations with the highest value in the window
+@app.route('/stations')
+def station_list():
+    top = request.args.get('top')
+    if top:
+        window = request.args.get('window', type=float)
+        start = time.time() - window if window else None
+        try:
+            ranked = stations.top(top, request.args.get('n', 10, type=int), start)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"sensor": top, "window": window, "stations": [{"id": station_id, "value": value} for value, station_id in ranked]})
+
+    hazard = request.args.get('hazard')
+    listed = [stations.get(station_id) for station_id in stations.in_state(hazard)] if hazard else stations.all()
+    return jsonify({"stations": [station.summary() for station in listed]})
+
+# Flask route to get one station's data; same arguments as /data
+@app.route('/stations/<int:station_id>/data')
+def station_data(station_id):
+    station = stations.get(station_id)
+    if station is None:
+        abort(404)
+    summary = station.summary()
+    start, end, max_points = range_args()
+    if start is not None:
+        resolution, series = query_range(station.history, station.rollups, start, end, max_points)
+        for out in series.values():
+            out["x"] = [format_timestamp(t) for t in out["x"]]
+        summary.update({"resolution": resolution, "series": series})
+        return jsonify(summary)
 
-# Flask route to render the HTML page
+    since = request.args.get('since', type=int)
+    payload = samples_since(-1 if since is None else since, request.args.get('limit', type=int), station.history)
+    payload.update(summary)
+    return jsonify(payload)
+
+# Flask route streaming stored readings from the segment files (not the in-memory history), in
+# chunks, so any range can be fetched with constant memory:
+#   /history?from=<t>&to=<t>[&fields=Temp,MQ7][&station=1,2][&limit=<n>][&format=csv|ndjson]
+@app.route('/history')
+def history_export():
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+        fields = parse_fields(request.args.get('fields'))
+        stations_wanted = parse_stations(request.args.get('station'))
+    except ValueError as e:
+        abort(400, str(e))
+    output = request.args.get('format', 'csv')
+    if output not in ('csv', 'ndjson'):
+        abort(400, "format must be csv or ndjson")
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 0:
+        abort(400, "limit must not be negative")
+    chunks = query(store, start, end, fields, stations_wanted, limit)
+    if output == 'csv':
+        return Response(iter_csv(chunks, fields), mimetype='text/csv')
+    return Response(iter_ndjson(chunks, fields), mimetype='application/x-ndjson')
+
+# Flask route listing, per hazard, the stations where it is currently on and since when, and the
+# sensors rising fast enough for an early warning
+@app.route('/hazards')
+def hazards():
+    return jsonify({"hazards": stations.hazards(), "hazard_status": stations.fleet_status(),
+                    "early_warnings": state.read().get("early_warnings", {})})
+
+# Flask route streaming new samples and hazard changes as server-sent events
+@app.route('/stream')
+def stream():
+    # A reconnecting browser sends the id of the last event it saw; catch it up first
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    subscriber = events.subscribe()
+
+    def generate():
+        try:
+            yield "retry: 2000\n\n"
+            if since is not None:
+                current = state.read()
+                samples = samples_since(since)
+                samples["latest_values"] = current.get("latest_values", {})
+                yield format_event("samples", samples, samples["seq"])
+                yield format_event("hazard", {"hazard_status": current.get("hazard_status", {}), "early_warnings": current.get("early_warnings", {})})
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            events.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# Flask route exposing the metrics of this process, the updater and the receiver in the Prometheus
+# text format. Under gunicorn every worker's request metrics are served, labelled worker=<pid>,
+# whichever worker answers: its own live, the others from the files they write.
+@app.route('/metrics')
+def metrics():
+    text = request_metrics.render()
+    if UPDATER_METRICS_FILE is None:
+        text += update_metrics.render()
+    text += read_metrics_files(store.path, exclude=WORKER_METRICS_FILE and os.path.basename(WORKER_METRICS_FILE))
+    return Response(merge_families(text), mimetype='text/plain; version=0.0.4')
+
+# Flask route sampling this process's threads for a while and returning the collapsed stacks
+# (flamegraph.pl, speedscope); only when started with --profile
+#   /profile?seconds=10
+@app.route('/profile')
+def profile():
+    if profiler is None:
+        abort(404)
+    seconds = min(request.args.get('seconds', 10, type=float), 60)
+    if not profiler.start():
+        abort(409, "a profile is already being taken")
+    try:
+        time.sleep(seconds)
+    finally:
+        collapsed = profiler.stop()
+    return Response(collapsed, mimetype='text/plain')
+
+# Flask route to serve the HTML page (built once at startup, see PAGE below)
 @app.route('/')
 def index():
-    return render_template_string(open_html_template())
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = Response(PAGE_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(PAGE_ETAG + '-gz')
+    else:
+        response = Response(PAGE, mimetype='text/html')
+        response.set_etag(PAGE_ETAG)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    # Answers 304 Not Modified when the browser already has this version
+    return response.make_conditional(request)
 
 # HTML Template
 def open_html_template():
@@ -196,29 +612,94 @@ def open_html_template():
         .hazard-danger {
             color: #FF5722;
         }
+        .range-selector {
+            text-align: right;
+            margin: 10px 0;
+        }
     </style>
     <script>
-        // Function to fetch data every 2 seconds and update UI
+        // Most points kept per chart; older points scroll off
+        const MAX_POINTS = 500;
+
+        // Chart element, data key and title of each graph
+        const GRAPHS = [
+            ['mq7Graph', 'MQ7', 'MQ7 Sensor'],
+            ['flameGraph', 'Flame', 'Flame Sensor'],
+            ['tempGraph', 'Temp', 'Temperature'],
+            ['humidityGraph', 'Humidity', 'Humidity'],
+            ['waterLevelGraph', 'Water_Level', 'Water Level']
+        ];
+
+        // Sequence number of the newest sample already plotted
+        let cursor = -1;
+
+        // Selected chart range in seconds; 0 follows the live stream
+        let rangeSeconds = 0;
+
+        // Function to create the empty graphs once
+        function initGraphs() {
+            GRAPHS.forEach(function([id, key, title]) {
+                Plotly.newPlot(id, [{ x: [], y: [], type: 'scatter', mode: 'lines+markers', name: title }], { title: title });
+            });
+        }
+
+        // Function to append new samples to the graphs
+        function appendSamples(data) {
+            if (rangeSeconds !== 0) {
+                return;
+            }
+            let start = 0;
+            while (start < data.Seq.length && data.Seq[start] <= cursor) {
+                start++;
+            }
+            if (start === data.Seq.length) {
+                return;
+            }
+            const timestamps = data.Timestamp.slice(start);
+            GRAPHS.forEach(function([id, key]) {
+                Plotly.extendTraces(id, { x: [timestamps], y: [data[key].slice(start)] }, [0], MAX_POINTS);
+            });
+            cursor = data.Seq[data.Seq.length - 1];
+        }
+
+        // Function to fetch samples newer than the cursor (fallback when streaming is unavailable)
         function fetchData() {
-            $.ajax({
-                url: '/data',
-                type: 'GET',
-                success: function(data) {
-                    updateGraphs(data);
-                    updateLatestValues(data);
-                    updateHazardStatus(data);
-                }
+            $.getJSON('/data', { since: cursor, limit: MAX_POINTS }, function(data) {
+                appendSamples(data);
+                updateLatestValues(data);
+                updateHazardStatus(data);
             });
         }
 
-        // Function to update graphs
-        function updateGraphs(data) {
-            const timestamps = data.Timestamp;
-            Plotly.react('mq7Graph', [{ x: timestamps, y: data.MQ7, type: 'scatter', mode: 'lines+markers', name: 'MQ7 Sensor' }], { title: 'MQ7 Sensor' });
-            Plotly.react('flameGraph', [{ x: timestamps, y: data.Flame, type: 'scatter', mode: 'lines+markers', name: 'Flame Sensor' }], { title: 'Flame Sensor' });
-            Plotly.react('tempGraph', [{ x: timestamps, y: data.Temp, type: 'scatter', mode: 'lines+markers', name: 'Temperature' }], { title: 'Temperature' });
-            Plotly.react('humidityGraph', [{ x: timestamps, y: data.Humidity, type: 'scatter', mode: 'lines+markers', name: 'Humidity' }], { title: 'Humidity' });
-            Plotly.react('waterLevelGraph', [{ x: timestamps, y: data.Water_Level, type: 'scatter', mode: 'lines+markers', name: 'Water Level' }], { title: 'Water Level' });
+        // Function to switch between the live view and a downsampled time range
+        function loadRange() {
+            rangeSeconds = parseInt($('#range').val());
+            if (rangeSeconds === 0) {
+                cursor = -1;
+                initGraphs();
+                fetchData();
+                return;
+            }
+            const now = Date.now() / 1000;
+            $.getJSON('/data', { from: now - rangeSeconds, to: now, max_points: MAX_POINTS }, function(data) {
+                GRAPHS.forEach(function([id, key, title]) {
+                    const series = data.series[key];
+                    Plotly.react(id, [{ x: series.x, y: series.y, type: 'scatter', mode: 'lines', name: title }], { title: title });
+                });
+            });
+        }
+
+        // Function to receive new samples and hazard changes as they happen
+        function connectStream() {
+            const source = new EventSource('/stream?since=' + cursor);
+            source.addEventListener('samples', function(event) {
+                const data = JSON.parse(event.data);
+                appendSamples(data);
+                updateLatestValues(data);
+            });
+            source.addEventListener('hazard', function(event) {
+                updateHazardStatus(JSON.parse(event.data));
+            });
         }
 
         // Function to update the latest sensor values
@@ -232,7 +713,7 @@ def open_html_template():
 
         // Function to update the hazard status
         function updateHazardStatus(data) {
-            const hazardStatus = data.hazard_status;
+            const hazardStatus = data.hazard_status || {};
 
             // Flood status
             const floodElement = $('#floodStatus');
@@ -265,10 +746,19 @@ def open_html_template():
             }
         }
 
-        // Fetch data every 2 seconds
+        // Load the recent window, then follow the stream (or poll every 2 seconds without EventSource)
         $(document).ready(function() {
-            fetchData();
-            setInterval(fetchData, 2000);
+            initGraphs();
+            $.getJSON('/data', { since: -1, limit: MAX_POINTS }, function(data) {
+                appendSamples(data);
+                updateLatestValues(data);
+                updateHazardStatus(data);
+                if (window.EventSource) {
+                    connectStream();
+                } else {
+                    setInterval(fetchData, 2000);
+                }
+            });
         });
     </script>
 </head>
@@ -281,6 +771,15 @@ def open_html_template():
             <div id="airQualityStatus" class="hazard hazard-safe"><i class="fas fa-check-circle hazard-safe"></i> Good Air Quality</div>
         </div>
     </div>
+    <div class="range-selector">
+        Range:
+        <select id="range" onchange="loadRange()">
+            <option value="0">Live</option>
+            <option value="3600">Last hour</option>
+            <option value="86400">Last day</option>
+            <option value="604800">Last week</option>
+        </select>
+    </div>
     <div class="container">
         <div class="chart-container">
             <div id="mq7Graph"></div>
@@ -302,13 +801,119 @@ def open_html_template():
 </html>
     """
 
+# The page has no template variables, so it is encoded, gzipped and hashed once
+PAGE = open_html_template().encode('utf-8')
+PAGE_GZIP = gzip.compress(PAGE, 9)
+PAGE_ETAG = hashlib.sha1(PAGE).hexdigest()
+
+# Start updating the sensor data in a separate thread
+def start_updater():
+    threading.Thread(target=update_sensor_data, daemon=True).start()
+
+# In a gunicorn worker after the fork (threads do not survive it): start this worker's /stream
+# follower and label and share its request metrics, so a scrape answered by any worker has all of them
+def start_worker():
+    global WORKER_METRICS_FILE
+    threading.Thread(target=follow_shared_state, daemon=True).start()
+    request_metrics.labels = {"worker": str(os.getpid())}
+    WORKER_METRICS_FILE = os.path.join(store.path, f"dashboard-worker-{os.getpid()}.prom")
+    request_metrics.write_periodically(WORKER_METRICS_FILE)
+
+def stop_worker():
+    if WORKER_METRICS_FILE is not None:
+        try:
+            os.remove(WORKER_METRICS_FILE)
+        except OSError:
+            pass
+
+# Open connections accepted by the production servers (each live dashboard keeps one for /stream)
+MAX_CONNECTIONS = 2000
+
 # Function to start the Flask app
-def run_flask():
-    app.run(debug=False, host='0.0.0.0', port=8000)
+#   dev       Flask's development server, for debugging
+#   waitress  production server: one process with a thread pool (also runs on Windows)
+#   gunicorn  production server: several worker processes (Linux/macOS) reading the live state from
+#             shared memory, which one separate updater process writes
+def run_flask(server='dev', host='0.0.0.0', port=8000, workers=4, threads=32):
+    if server == 'dev':
+        start_updater()
+        app.run(debug=False, host=host, port=port, threaded=True)
+    elif server == 'waitress':
+        try:
+            from waitress import serve
+        except ImportError:
+            raise SystemExit("waitress is not installed (pip install waitress)")
+        start_updater()
+        # Every open /stream holds a thread, so threads bounds the number of live dashboards
+        serve(app, host=host, port=port, threads=threads, connection_limit=MAX_CONNECTIONS)
+    elif server == 'gunicorn':
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise SystemExit("gunicorn is not installed (pip install gunicorn)")
+
+        # Set up the shared state, then fork the updater before gunicorn forks the workers
+        global UPDATER_METRICS_FILE
+        UPDATER_METRICS_FILE = os.path.join(store.path, "dashboard.prom")
+        arena = use_shared_memory()
+        updater = os.fork()
+        if updater == 0:
+            try:
+                update_metrics.write_periodically(UPDATER_METRICS_FILE)
+                update_sensor_data()
+            finally:
+                os._exit(1)
+
+        class DashboardServer(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'{host}:{port}')
+                self.cfg.set('workers', workers)
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('threads', threads)
+                self.cfg.set('worker_connections', MAX_CONNECTIONS)
+                self.cfg.set('post_fork', lambda arbiter, worker: start_worker())
+                self.cfg.set('worker_exit', lambda arbiter, worker: stop_worker())
+
+            def load(self):
+                return app
+
+        master = os.getpid()
+        try:
+            DashboardServer().run()
+        finally:
+            # Workers leave through here too (gunicorn exits them with SystemExit); only the master
+            # stops the updater and removes the block
+            if os.getpid() == master:
+                try:
+                    os.kill(updater, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            arena.close()
+            if os.getpid() == master:
+                arena.unlink()
+    else:
+        raise ValueError(f"unknown server: {server}")
 
 if __name__ == "__main__":
-    # Start Flask app in a separate thread
-    threading.Thread(target=run_flask).start()
+    parser = argparse.ArgumentParser(description="Hazard monitoring dashboard")
+    parser.add_argument('--server', choices=('dev', 'waitress', 'gunicorn'), default='dev', help="HTTP server to run")
+    parser.add_argument('--host', default='0.0.0.0', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=4, help="worker processes (gunicorn)")
+    parser.add_argument('--threads', type=int, default=32, help="threads per process (waitress, gunicorn)")
+    parser.add_argument('--store', default='sensor_store', help="store directory written by the receiver")
+    parser.add_argument('--bus', default=None, help="event bus socket path or host:port")
+    parser.add_argument('--profile', action='store_true', help="enable the /profile sampling profiler route")
+    parser.add_argument('--max-stations', type=int, default=MAX_STATIONS, help="stations the shared live state has room for (gunicorn)")
+    args = parser.parse_args()
+    if args.max_stations < 1:
+        parser.error("--max-stations must be at least 1")
+    MAX_STATIONS = args.max_stations
 
-    # Start updating the sensor data in a separate thread
-    threading.Thread(target=update_sensor_data, daemon=True).start()
+    if args.profile:
+        profiler = SamplingProfiler()
+
+    store = SegmentStore(args.store, readonly=True)
+    if args.bus:
+        BUS_ADDRESS = parse_address(args.bus)
+    run_flask(args.server, args.host, args.port, args.workers, args.threads)
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import queue
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import time
+from sensor_store import SegmentStore
+from ingest_server import IngestServer
+from event_bus import BusPublisher
+
+# Latency from a reading reaching the receiver's socket to the dashboard's hazard status changing.
+# Runs the receiver (IngestServer + BusPublisher) and the dashboard pipeline (app.py) in one
+# process, connected through the real TCP ingest port and the event bus socket, then sends readings
+# that alternately raise and clear a Fire hazard and times each resulting /stream hazard event.
+# Example: python bench_latency.py --readings 500
+
+FIRE = b"MQ7: 100, Flame: 1000, Temp: 25.0, Humidity: 40.0, Water Level: 300 mm\n"
+SAFE = b"MQ7: 100, Flame: 6000, Temp: 25.0, Humidity: 40.0, Water Level: 300 mm\n"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Percentile of a sorted list (nearest rank)
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    store_path = os.path.join(workdir, "sensor_store")
+    port = free_port()
+    bus_address = os.path.join(workdir, "bus.sock") if hasattr(socket, "AF_UNIX") else ("127.0.0.1", free_port())
+
+    # Receiver side
+    server = IngestServer(SegmentStore(store_path), host="127.0.0.1", port=port, bus=BusPublisher(bus_address))
+    threading.Thread(target=asyncio.run, args=(server.serve(),), daemon=True).start()
+
+    # Dashboard side
+    import app
+    app.store = SegmentStore(store_path, readonly=True)
+    app.BUS_ADDRESS = bus_address
+    stream = app.events.subscribe()
+    threading.Thread(target=app.update_sensor_data, daemon=True).start()
+
+    # Wait for the ingest port and the bus connection
+    client = None
+    deadline = time.monotonic() + 10
+    while client is None:
+        try:
+            client = socket.create_connection(("127.0.0.1", port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    while not server.bus.connections:
+        time.sleep(0.05)
+
+    latencies = []
+    for i in range(args.readings):
+        payload = FIRE if i % 2 == 0 else SAFE
+        sent = time.perf_counter()
+        client.sendall(payload)
+        while True:
+            try:
+                message = stream.get(timeout=5)
+            except queue.Empty:
+                print(f"No hazard update for reading {i}", file=sys.stderr)
+                break
+            if message and message.startswith("id:") and "event: hazard" in message:
+                latencies.append((time.perf_counter() - sent) * 1000)
+                break
+        time.sleep(args.interval)
+    client.close()
+
+    latencies.sort()
+    result = {
+        "readings": args.readings,
+        "updates": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+    }
+    print(json.dumps(result))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure socket receive to hazard status update latency")
+    parser.add_argument('--readings', type=int, default=200, help="readings to send")
+    parser.add_argument('--interval', type=float, default=0.01, help="seconds between readings")
+    run(parser.parse_args())
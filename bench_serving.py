@@ -0,0 +1,181 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from sensor_store import SegmentStore, SENSOR_FIELDS
+from event_bus import BusPublisher
+
+# Requests/s and latency of the dashboard under many concurrent clients.
+# Starts app.py in the chosen serving mode on a temporary store, keeps feeding it readings over the
+# event bus (so cached responses are invalidated like in production), and runs N simulated
+# dashboards: each loads the page once, then polls /data?since=<cursor>&limit=500 like the
+# page's fallback loop, as fast as the server answers unless --interval is given.
+# Example: python bench_serving.py --server waitress --clients 500 --duration 20
+#          python bench_serving.py --server gunicorn --workers 4 --clients 500
+
+STATIONS = 30
+
+# Seconds before a request counts as failed
+REQUEST_TIMEOUT = 30
+
+
+def make_values(rng):
+    return {field: float(rng.randint(0, 65535)) for field in SENSOR_FIELDS}
+
+
+# Percentile of a sorted list (nearest rank)
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Minimal HTTP/1.1 keep-alive GET; returns (status, headers, body)
+async def http_get(reader, writer, path, headers=""):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n{headers}\r\n".encode('ascii'))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    status = int(lines[0].split()[1])
+    response_headers = {}
+    for line in lines[1:]:
+        key, sep, value = line.partition(":")
+        if sep:
+            response_headers[key.strip().lower()] = value.strip()
+    if "content-length" in response_headers:
+        body = await reader.readexactly(int(response_headers["content-length"]))
+    elif response_headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            body += await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        body = await reader.read()
+    return status, response_headers, body
+
+
+# One dashboard: page load, then /data polling with a moving cursor
+async def client(args, latencies, errors, deadline):
+    reader = writer = None
+    cursor = -1
+    etag = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+                started = time.perf_counter()
+                status, headers, _ = await asyncio.wait_for(http_get(reader, writer, "/", f"If-None-Match: {etag}\r\n" if etag else ""), REQUEST_TIMEOUT)
+                latencies.append(time.perf_counter() - started)
+                etag = headers.get("etag", etag)
+                if headers.get("connection", "").lower() == "close":
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+
+            started = time.perf_counter()
+            status, headers, body = await asyncio.wait_for(http_get(reader, writer, f"/data?since={cursor}&limit=500"), REQUEST_TIMEOUT)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+            else:
+                if headers.get("content-encoding") == "gzip":
+                    body = gzip.decompress(body)
+                cursor = json.loads(body)["seq"]
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                writer = None
+            if args.interval:
+                await asyncio.sleep(args.interval)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+# Append one reading per station and publish it, like the receiver does, tick times a second
+def feed(store, bus, tick, stop):
+    rng = random.Random(1)
+    while not stop.is_set():
+        now = time.time()
+        readings = store.append_many([(make_values(rng), now, station) for station in range(STATIONS)])
+        bus.publish(readings)
+        stop.wait(1.0 / tick)
+
+
+async def run_clients(args):
+    latencies, errors = [], []
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client(args, latencies, errors, deadline) for _ in range(args.clients)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def main(args):
+    workdir = tempfile.mkdtemp()
+    store_path = os.path.join(workdir, "sensor_store")
+    bus_address = os.path.join(workdir, "bus.sock") if hasattr(socket, "AF_UNIX") else f"127.0.0.1:{args.port + 1}"
+
+    # A day of history so the ring and rollups are full
+    store = SegmentStore(store_path)
+    rng = random.Random(0)
+    start = time.time() - 24 * 3600
+    store.append_many([(make_values(rng), start + i * 8.64, i % STATIONS) for i in range(10000)])
+    bus = BusPublisher(bus_address)
+
+    command = [sys.executable, "app.py", "--server", args.server, "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--threads", str(args.threads), "--store", store_path, "--bus", bus_address]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    stop = threading.Event()
+    try:
+        # Wait for the dashboard to answer and to subscribe to the bus
+        deadline = time.monotonic() + 30
+        while not bus.connections:
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise SystemExit("dashboard did not start")
+            time.sleep(0.1)
+
+        threading.Thread(target=feed, args=(store, bus, args.tick, stop), daemon=True).start()
+        latencies, errors, elapsed = asyncio.run(run_clients(args))
+    finally:
+        stop.set()
+        server.terminate()
+        server.wait()
+        bus.close()
+
+    latencies.sort()
+    result = {
+        "server": args.server,
+        "workers": args.workers if args.server == 'gunicorn' else 1,
+        "clients": args.clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+    print(json.dumps(result))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard with many concurrent clients")
+    parser.add_argument('--server', choices=('dev', 'waitress', 'gunicorn'), default='waitress', help="serving mode to test")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=32, help="server threads per process")
+    parser.add_argument('--clients', type=int, default=500, help="concurrent dashboard clients")
+    parser.add_argument('--duration', type=float, default=20, help="seconds to run")
+    parser.add_argument('--interval', type=float, default=0, help="seconds between polls per client (0 = as fast as possible)")
+    parser.add_argument('--tick', type=float, default=1, help="new readings per second per station")
+    parser.add_argument('--port', type=int, default=8090, help="port for the dashboard under test")
+    main(parser.parse_args())
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from types import SimpleNamespace
+from sensor_store import SegmentStore
+from sensor_codec import encode_record, decode_record
+from ingest_server import IngestServer, BATCH_SIZE
+from wal import DurableStore
+import load_generator
+import store_query
+
+# Offline benchmark suite for the ingest, hazard and dashboard paths; no hardware or network needed.
+# Micro-benchmarks at each size (rows):
+#   ingest_text       receiver write path for "key: value, ..." payloads as the Pico 2W send_data
+#                     builds them: parse, normalise, step-hold, write-ahead log and store append
+#   ingest_binary     the same for binary uplink records (decode included)
+#   store_scan        reading the rows back as Readings (dashboard backfill)
+#   store_query       reading them as column chunks (/history and exports)
+#   hazard_prediction hazard engine and station registry over receiver-sized batches
+#   dashboard_update  everything the dashboard does per batch (history, rollups, hazards, trends, snapshot)
+# End-to-end: ingest_e2e (simulated stations over TCP), latency (bench_latency.py) and serving
+# (bench_serving.py, /data under concurrent clients).
+# Results are written as one JSON document; with --baseline, metrics worse than the baseline by
+# more than --tolerance are listed and the exit code is 1.
+# Example: python bench_suite.py --out results.json
+#          python bench_suite.py --sizes 1000,100000 --skip serving --baseline results.json
+
+SIZES = (1000, 100000, 1000000)
+
+# Stations the synthetic rows are spread over
+STATIONS = 30
+
+# Metrics compared against a baseline, and whether higher is better
+METRICS = {
+    "rows_per_s": True,
+    "requests_per_s": True,
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Best time of repeat runs of fn(); setup() runs untimed before each and its result is passed to fn
+def timed(fn, setup=None, repeat=1):
+    best = None
+    for _ in range(repeat):
+        value = setup() if setup else None
+        started = time.perf_counter()
+        fn(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def rate(rows, seconds):
+    return {"rows": rows, "seconds": round(seconds, 4), "rows_per_s": round(rows / seconds, 1)}
+
+
+# Queue items (arrival, payload, station, done) as the receiver's batch writer gets them
+def text_items(rows):
+    rng = random.Random(rows)
+    start = time.time() - rows
+    return [(start + i, load_generator.make_payload(rng).encode('utf-8'), i % STATIONS, None) for i in range(rows)]
+
+
+def binary_frames(rows):
+    rng = random.Random(rows)
+    start = time.time() - rows
+    return [(start + i, encode_record(i % STATIONS, i, 0, load_generator.make_values(rng)), i % STATIONS) for i in range(rows)]
+
+
+# Write queue items through IngestServer.write_batch into a fresh write-ahead logged store
+def ingest(workdir, name, items):
+    path = os.path.join(workdir, name)
+    shutil.rmtree(path, ignore_errors=True)
+    server = IngestServer(DurableStore(path))
+    for offset in range(0, len(items), BATCH_SIZE):
+        server.write_batch(items[offset:offset + BATCH_SIZE])
+    server.store.close()
+    return path
+
+
+def bench_ingest_text(workdir, rows, repeat):
+    items = text_items(rows)
+    return rate(rows, timed(lambda _: ingest(workdir, "text", items), repeat=repeat))
+
+
+def bench_ingest_binary(workdir, rows, repeat):
+    frames = binary_frames(rows)
+
+    def run(_):
+        ingest(workdir, "binary", [(arrival, decode_record(frame)[3], station, None) for arrival, frame, station in frames])
+    return rate(rows, timed(run, repeat=repeat))
+
+
+def bench_store_scan(store_path, rows, repeat):
+    store = SegmentStore(store_path, readonly=True)
+    return rate(rows, timed(lambda _: sum(1 for _ in store.scan()), repeat=repeat))
+
+
+def bench_store_query(store_path, rows, repeat):
+    store = SegmentStore(store_path, readonly=True)
+    return rate(rows, timed(lambda _: sum(len(chunk) for chunk in store_query.query(store)), repeat=repeat))
+
+
+# Fresh dashboard state (app.py) holding nothing yet
+def reset_dashboard(app):
+    from hazard_engine import HazardEngine
+    from trends import TrendDetector
+    app.history, app.rollups, app.stations, app.state = app.create_state()
+    app.engine = HazardEngine.from_file(app.HAZARD_RULES)
+    app.trends = TrendDetector.from_file(app.HAZARD_RULES)
+    app.sensor_data.clear()
+    app.sensor_data.update({"latest_values": {}})
+    app.last_seq = -1
+
+
+def receiver_batches(store_path):
+    readings = list(SegmentStore(store_path, readonly=True).since(0))
+    return [readings[offset:offset + BATCH_SIZE] for offset in range(0, len(readings), BATCH_SIZE)]
+
+
+def bench_hazard_prediction(app, batches, rows, repeat):
+    def run(_):
+        for batch in batches:
+            app.hazard_prediction(batch)
+    return rate(rows, timed(run, lambda: reset_dashboard(app), repeat))
+
+
+def bench_dashboard_update(app, batches, rows, repeat):
+    def run(_):
+        for batch in batches:
+            app.process_new_rows(batch)
+    return rate(rows, timed(run, lambda: reset_dashboard(app), repeat))
+
+
+# Simulated stations sending binary batches over TCP to a receiver with a write-ahead logged store
+def bench_ingest_e2e(workdir, duration):
+    port = free_port()
+    server = IngestServer(DurableStore(os.path.join(workdir, "e2e")), host="127.0.0.1", port=port)
+    threading.Thread(target=asyncio.run, args=(server.serve(),), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    args = SimpleNamespace(host="127.0.0.1", port=port, stations=STATIONS, rate=0, duration=duration,
+                           persistent=True, binary=True, batch=32)
+    stored = server.stored
+    sent, elapsed = asyncio.run(load_generator.run(args))
+    return {"stations": STATIONS, "rows": sent, "seconds": round(elapsed, 2),
+            "rows_per_s": round((server.stored - stored) / elapsed, 1)}
+
+
+# Run one of the standalone benchmark scripts and return the JSON result it prints last
+def run_script(script, *arguments):
+    command = [sys.executable, script] + [str(argument) for argument in arguments]
+    finished = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = finished.stdout.strip().splitlines()
+    if finished.returncode != 0 or not lines:
+        return {"skipped": f"{script} exited with {finished.returncode}"}
+    return json.loads(lines[-1])
+
+
+def serving_mode():
+    try:
+        import waitress  # noqa: F401
+        return "waitress"
+    except ImportError:
+        return "dev"
+
+
+# Metrics that got worse than the baseline by more than tolerance: [(name, metric, baseline, now)]
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, before in baseline.get("results", {}).items():
+        now = results.get(name)
+        if not now:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in before or metric not in now or not before[metric]:
+                continue
+            change = (now[metric] - before[metric]) / before[metric]
+            if (-change if higher_is_better else change) > tolerance:
+                found.append((name, metric, before[metric], now[metric]))
+    return found
+
+
+def main(args):
+    skip = set(args.skip.split(",")) if args.skip else set()
+    results = {}
+    workdir = tempfile.mkdtemp()
+    try:
+        # Benchmarks print progress (server banners, hazard changes); keep stdout for the JSON result
+        with contextlib.redirect_stdout(sys.stderr):
+            import app
+            for rows in (int(size) for size in args.sizes.split(",")):
+                def record(name, bench, *arguments):
+                    if name not in skip:
+                        results[f"{name}@{rows}"] = bench(*arguments, rows, args.repeat)
+                        print(f"{name}@{rows}: {results[f'{name}@{rows}']['rows_per_s']:,.0f} rows/s", file=sys.stderr)
+
+                record("ingest_text", bench_ingest_text, workdir)
+                record("ingest_binary", bench_ingest_binary, workdir)
+                store_path = os.path.join(workdir, "text")
+                if not os.path.isdir(store_path):
+                    ingest(workdir, "text", text_items(rows))
+                record("store_scan", bench_store_scan, store_path)
+                record("store_query", bench_store_query, store_path)
+                batches = receiver_batches(store_path)
+                record("hazard_prediction", bench_hazard_prediction, app, batches)
+                record("dashboard_update", bench_dashboard_update, app, batches)
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.makedirs(workdir)
+
+            if "ingest_e2e" not in skip:
+                results["ingest_e2e"] = bench_ingest_e2e(workdir, args.duration)
+            if "latency" not in skip:
+                results["latency"] = run_script("bench_latency.py", "--readings", 200)
+            if "serving" not in skip:
+                results["serving"] = run_script("bench_serving.py", "--server", serving_mode(), "--clients", args.clients,
+                                                "--duration", args.duration)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for name, metric, before, now in found:
+            print(f"REGRESSION {name} {metric}: {before} -> {now}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ingest, hazard and dashboard paths offline")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in SIZES), help="comma-separated row counts for the micro-benchmarks")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per micro-benchmark (best is kept)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds for each end-to-end test")
+    parser.add_argument('--clients', type=int, default=100, help="concurrent dashboard clients in the serving test")
+    parser.add_argument('--skip', help="comma-separated benchmarks to skip")
+    parser.add_argument('--out', help="also write the JSON result to this file")
+    parser.add_argument('--baseline', help="earlier JSON result to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed fractional slowdown before a metric counts as a regression")
+    sys.exit(main(parser.parse_args()))
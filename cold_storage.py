@@ -0,0 +1,457 @@
+import os
+import time
+import zlib
+import struct
+import argparse
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from sensor_store import SegmentStore, SENSOR_FIELDS, SEGMENT_ROWS
+from hazard_engine import ROW_DTYPE
+from metrics import Registry
+from wal import fsync_directory
+
+# Retention and cold storage for the segment store. Raw segments hold every reading at full
+# fidelity, 82 bytes each. Once a segment is full and older than compact_after, a background
+# Compactor (running in the receiver) rewrites it as a compressed block of columns:
+#   seq, timestamp  delta-of-delta of the IEEE-754 bit patterns (exact; regular sampling gives ~0)
+#   station         delta
+#   sensors         delta of the values scaled to integers when they are quantised (ADC counts,
+#                   0.1 C), else XOR with the previous value's bits; missing values keep a bitmap
+# Each column is byte-shuffled and zlib compressed on its own, so a query decodes only the columns
+# it asks for. Blocks are lossless: the compactor checks each one against the raw segment before
+# deleting it. Hourly per-station rollups (min, max, sum, count) are written first, so they outlive
+# the raw data. After expire_after, blocks are deleted; rollups go after rollups_expire_after.
+# Readers (SegmentStore, store_query, hazard_engine) read blocks in place of missing raw segments.
+# The receiver runs the policy itself; --once is for a store no receiver is writing to.
+# Example: python cold_storage.py --store sensor_store --once
+#          python cold_storage.py --store sensor_store --rollups --from "2024-01-01 00:00:00"
+
+# Seconds after which full raw segments are compacted
+COMPACT_AFTER = 2 * 86400
+
+# Seconds after which segments are deleted (None keeps them)
+EXPIRE_AFTER = 365 * 86400
+
+# Seconds after which hourly rollups are deleted, a calendar year at a time (None keeps them)
+ROLLUP_EXPIRE_AFTER = 5 * 365 * 86400
+
+# Seconds between compactor runs
+COMPACT_INTERVAL = 600
+
+# Rollup bucket width in seconds
+ROLLUP_SECONDS = 3600
+
+BLOCK_MAGIC = b"HZBLK1"
+
+# Block header: magic | rows u32 | first seq u64 | lowest timestamp f64 | highest timestamp f64 | columns u16
+BLOCK_HEADER = struct.Struct("<6sIQddH")
+
+# Per column: name | encoding u8 | scale exponent u8 | bitmap length u32 | data length u32 | crc32 u32
+COLUMN_ENTRY = struct.Struct("<16sBBIII")
+
+# Column encodings
+DOD = 1
+DELTA = 2
+XOR = 3
+
+# Powers of ten tried to turn a sensor column into integers for delta encoding
+SCALE_EXPONENTS = (0, 1, 2)
+
+# Hourly rollup row: bucket start, station, segment it came from, then min, max, sum and count per sensor
+ROLLUP_DTYPE = np.dtype([("start", "<f8"), ("station", "<u2"), ("segment", "<u4")] +
+                        [(f"{field}_{stat}", "<u4" if stat == "count" else "<f8")
+                         for field in SENSOR_FIELDS for stat in ("min", "max", "sum", "count")])
+
+
+def _shuffle(words):
+    return words.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _unshuffle(data, rows):
+    return np.frombuffer(data, dtype=np.uint8).reshape(8, rows).T.copy().view("<u8").ravel()
+
+
+def _zigzag(words):
+    signed = words.view(np.int64)
+    return ((signed << 1) ^ (signed >> 63)).view(np.uint64)
+
+
+def _unzigzag(words):
+    return (words >> np.uint64(1)) ^ (np.uint64(0) - (words & np.uint64(1)))
+
+
+def _delta(words):
+    out = words.copy()
+    out[1:] -= words[:-1]
+    return out
+
+
+# Encode one column (1-D array); returns (encoding, scale exponent, bitmap bytes, data bytes)
+def encode_column(name, values):
+    if name in ("seq", "timestamp"):
+        words = np.ascontiguousarray(values).view("<u8")
+        return DOD, 0, b"", zlib.compress(_shuffle(_zigzag(_delta(_delta(words)))), 6)
+    if name == "station":
+        return DELTA, 0, b"", zlib.compress(_shuffle(_zigzag(_delta(values.astype("<u8")))), 6)
+
+    missing = np.isnan(values)
+    present = values[~missing]
+    # Exact to the bit (-0.0 and unusual NaNs go to XOR), as decoding restores missing values as np.nan
+    canonical = np.all(values[missing].view("<u8") == np.array(np.nan).view("<u8"))
+    for exponent in SCALE_EXPONENTS if canonical else ():
+        scaled = np.round(present * 10.0 ** exponent)
+        if not np.all(np.abs(scaled) < 2 ** 53):
+            break
+        scaled = scaled.astype(np.int64)
+        if np.array_equal((scaled / 10.0 ** exponent).view("<u8"), present.view("<u8")):
+            ints = np.zeros(len(values), dtype=np.int64)
+            ints[~missing] = scaled
+            if missing.any():
+                # Missing rows repeat the previous value, so they add nothing to the deltas
+                index = np.where(missing, 0, np.arange(len(values)))
+                ints = ints[np.maximum.accumulate(index)]
+            bitmap = zlib.compress(np.packbits(missing).tobytes(), 6) if missing.any() else b""
+            return DELTA, exponent, bitmap, zlib.compress(_shuffle(_zigzag(_delta(ints.view("<u8")))), 6)
+    words = np.ascontiguousarray(values).view("<u8")
+    xored = words.copy()
+    xored[1:] ^= words[:-1]
+    return XOR, 0, b"", zlib.compress(_shuffle(xored), 6)
+
+
+def decode_column(name, encoding, exponent, bitmap, data, rows, dtype):
+    words = _unshuffle(zlib.decompress(data), rows)
+    if encoding == DOD:
+        return np.cumsum(np.cumsum(_unzigzag(words), dtype=np.uint64), dtype=np.uint64).view(dtype)
+    if encoding == XOR:
+        return np.bitwise_xor.accumulate(words).view(dtype)
+    ints = np.cumsum(_unzigzag(words), dtype=np.uint64).view(np.int64)
+    if name == "station":
+        return ints.astype(dtype)
+    values = ints / 10.0 ** exponent
+    if bitmap:
+        missing = np.unpackbits(np.frombuffer(zlib.decompress(bitmap), dtype=np.uint8), count=rows).astype(bool)
+        values[missing] = np.nan
+    return values
+
+
+# Compressed block for the rows of one segment (a ROW_DTYPE array)
+def encode_block(rows):
+    timestamps = rows["timestamp"]
+    entries = []
+    payloads = []
+    for name in ROW_DTYPE.names:
+        encoding, exponent, bitmap, data = encode_column(name, np.ascontiguousarray(rows[name]))
+        entries.append(COLUMN_ENTRY.pack(name.encode("ascii"), encoding, exponent, len(bitmap), len(data),
+                                         zlib.crc32(data, zlib.crc32(bitmap))))
+        payloads += [bitmap, data]
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(rows), int(rows["seq"][0]) if len(rows) else 0,
+                               float(timestamps.min()) if len(rows) else 0.0,
+                               float(timestamps.max()) if len(rows) else 0.0, len(entries))
+    return header + b"".join(entries) + b"".join(payloads)
+
+
+# (rows, first seq, lowest timestamp, highest timestamp) of a block file, read from its header
+def block_info(path):
+    with open(path, "rb") as f:
+        magic, rows, first_seq, low, high, _ = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+    if magic != BLOCK_MAGIC:
+        raise ValueError(f"{path} is not a block file")
+    return rows, first_seq, low, high
+
+
+# Rows of a block file as a structured array with the given columns (default: all, as ROW_DTYPE)
+def read_block(path, columns=None):
+    with open(path, "rb") as f:
+        return decode_block(f.read(), columns, path)
+
+
+def decode_block(data, columns=None, path="block"):
+    magic, rows, _, _, _, count = BLOCK_HEADER.unpack_from(data, 0)
+    if magic != BLOCK_MAGIC:
+        raise ValueError(f"{path} is not a block file")
+    columns = list(ROW_DTYPE.names) if columns is None else list(columns)
+    out = np.empty(rows, dtype=[(name, ROW_DTYPE.fields[name][0]) for name in columns])
+    offset = BLOCK_HEADER.size + count * COLUMN_ENTRY.size
+    for i in range(count):
+        raw_name, encoding, exponent, bitmap_length, data_length, crc = COLUMN_ENTRY.unpack_from(data, BLOCK_HEADER.size + i * COLUMN_ENTRY.size)
+        name = raw_name.rstrip(b"\0").decode("ascii")
+        bitmap = data[offset:offset + bitmap_length]
+        payload = data[offset + bitmap_length:offset + bitmap_length + data_length]
+        offset += bitmap_length + data_length
+        if name not in columns:
+            continue
+        if zlib.crc32(payload, zlib.crc32(bitmap)) != crc:
+            raise ValueError(f"{path}: column {name} is corrupt")
+        out[name] = decode_column(name, encoding, exponent, bitmap, payload, rows, ROW_DTYPE.fields[name][0])
+    return out
+
+
+# Rows of one segment, raw (memory-mapped) or compacted, with the given columns; None if it is gone.
+# A block whose timestamps all lie outside [start, end] is not decoded and comes back empty.
+def segment_rows(store, index, columns=None, start=None, end=None):
+    path = store._segment_path(index)
+    try:
+        count = os.path.getsize(path) // ROW_DTYPE.itemsize
+        rows = np.memmap(path, dtype=ROW_DTYPE, mode="r", shape=(count,)) if count else np.empty(0, dtype=ROW_DTYPE)
+        return rows if columns is None else rows[list(columns)]
+    except FileNotFoundError:
+        pass  # Compacted (possibly just now)
+    block_path = store._block_path(index)
+    try:
+        _, _, low, high = block_info(block_path)
+        if (start is not None and high < start) or (end is not None and low > end):
+            return np.empty(0, dtype=ROW_DTYPE if columns is None else [(name, ROW_DTYPE.fields[name][0]) for name in columns])
+        return read_block(block_path, columns)
+    except FileNotFoundError:
+        return None
+
+
+# Hourly rollup rows for the rows of one segment
+def rollup_rows(rows, segment):
+    buckets = np.floor(rows["timestamp"] / ROLLUP_SECONDS) * ROLLUP_SECONDS
+    keys, first, inverse = np.unique(np.stack([buckets, rows["station"].astype(np.float64)]), axis=1,
+                                     return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    out = np.zeros(keys.shape[1], dtype=ROLLUP_DTYPE)
+    out["start"] = keys[0]
+    out["station"] = keys[1]
+    out["segment"] = segment
+    for field in SENSOR_FIELDS:
+        values = rows[field]
+        minimum = np.full(len(out), np.nan)
+        maximum = np.full(len(out), np.nan)
+        np.fmin.at(minimum, inverse, values)
+        np.fmax.at(maximum, inverse, values)
+        total = np.zeros(len(out))
+        np.add.at(total, inverse, np.nan_to_num(values))
+        count = np.zeros(len(out), dtype=np.uint32)
+        np.add.at(count, inverse, ~np.isnan(values))
+        out[f"{field}_min"], out[f"{field}_max"] = minimum, maximum
+        out[f"{field}_sum"], out[f"{field}_count"] = total, count
+    return out
+
+
+def _rollup_path(store, year):
+    return os.path.join(store.path, f"rollup-{year}.bin")
+
+
+def _rollup_years(store):
+    try:
+        names = os.listdir(store.path)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[7:-4]) for name in names if name.startswith("rollup-") and name.endswith(".bin"))
+
+
+def _year(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).year
+
+
+# Append the rollups of a segment to the yearly rollup files. The last row of each file says which
+# segment was written last, so a segment rolled up before a crash is not added twice.
+def write_rollups(store, rollups, segment):
+    years = np.array([_year(start) for start in rollups["start"]])
+    for year in np.unique(years):
+        path = _rollup_path(store, int(year))
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with open(path, "r+b" if size else "wb") as f:
+            size -= size % ROLLUP_DTYPE.itemsize  # Drop a row torn by a crash
+            if size:
+                f.seek(size - ROLLUP_DTYPE.itemsize)
+                if np.frombuffer(f.read(ROLLUP_DTYPE.itemsize), dtype=ROLLUP_DTYPE)["segment"][0] >= segment:
+                    continue
+            f.seek(size)
+            f.truncate()
+            f.write(rollups[years == year].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Hourly rollups in [start, end] (optionally for some stations) as a structured array of start,
+# station and, per sensor, min, max, mean and count; rows of an hour split across segments are merged
+def read_rollups(store, start=None, end=None, stations=None, fields=SENSOR_FIELDS):
+    parts = []
+    for year in _rollup_years(store):
+        if (start is not None and _year(start) > year) or (end is not None and _year(end) < year):
+            continue
+        path = _rollup_path(store, year)
+        rows = np.fromfile(path, dtype=ROLLUP_DTYPE, count=os.path.getsize(path) // ROLLUP_DTYPE.itemsize)
+        mask = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            mask &= rows["start"] >= start - ROLLUP_SECONDS + 1
+        if end is not None:
+            mask &= rows["start"] <= end
+        if stations:
+            mask &= np.isin(rows["station"], np.asarray(list(stations), dtype=np.uint16))
+        parts.append(rows[mask])
+    rows = np.concatenate(parts) if parts else np.zeros(0, dtype=ROLLUP_DTYPE)
+    keys, inverse = np.unique(np.stack([rows["start"], rows["station"].astype(np.float64)]), axis=1, return_inverse=True) \
+        if len(rows) else (np.zeros((2, 0)), np.zeros(0, dtype=np.int64))
+    inverse = inverse.ravel()
+    out = np.zeros(keys.shape[1], dtype=[("start", "<f8"), ("station", "<u2")] +
+                   [(f"{field}_{stat}", "<u4" if stat == "count" else "<f8") for field in fields for stat in ("min", "max", "mean", "count")])
+    out["start"], out["station"] = keys[0], keys[1]
+    for field in fields:
+        minimum = np.full(len(out), np.nan)
+        maximum = np.full(len(out), np.nan)
+        total = np.zeros(len(out))
+        count = np.zeros(len(out), dtype=np.uint32)
+        np.fmin.at(minimum, inverse, rows[f"{field}_min"])
+        np.fmax.at(maximum, inverse, rows[f"{field}_max"])
+        np.add.at(total, inverse, rows[f"{field}_sum"])
+        np.add.at(count, inverse, rows[f"{field}_count"])
+        out[f"{field}_min"], out[f"{field}_max"], out[f"{field}_count"] = minimum, maximum, count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"{field}_mean"] = np.where(count > 0, total / count, np.nan)
+    return out
+
+
+# Applies the retention policy to a store: compacts old full segments, expires old ones and old
+# rollups. Runs on its own thread next to the writer; it never touches the segment being written,
+# and replaces files atomically, so ingest and readers in other processes carry on meanwhile.
+class Compactor:
+    def __init__(self, store, compact_after=COMPACT_AFTER, expire_after=EXPIRE_AFTER,
+                 rollups_expire_after=ROLLUP_EXPIRE_AFTER, interval=COMPACT_INTERVAL, registry=None):
+        self.store = store
+        self.compact_after = compact_after
+        self.expire_after = expire_after
+        self.rollups_expire_after = rollups_expire_after
+        self.interval = interval
+        registry = registry or Registry()
+        self.compacted = registry.counter("store_compacted_segments_total", "Raw segments rewritten as compressed blocks")
+        self.expired = registry.counter("store_expired_segments_total", "Segments deleted by the retention policy")
+        self.compact_seconds = registry.histogram("store_compact_seconds", "Compacting one segment (rollups, encoding, check, write)")
+        self.raw_bytes = registry.counter("store_compacted_raw_bytes_total", "Bytes of raw segments compacted")
+        self.block_bytes = registry.counter("store_compacted_block_bytes_total", "Bytes of the blocks they became")
+
+    # Segments that are closed: every segment but the one being written
+    def _closed_segments(self):
+        segments = self.store.segments()
+        current = self.store.next_seq() // self.store.segment_rows
+        return [index for index in segments[:-1] if index < current]
+
+    def _segment_high(self, index):
+        if os.path.exists(self.store._segment_path(index)):
+            rows = segment_rows(self.store, index, ["timestamp"])
+            if rows is not None and len(rows):
+                return float(rows["timestamp"].max())
+        try:
+            return block_info(self.store._block_path(index))[3]
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def compact(self, index):
+        store = self.store
+        raw_path = store._segment_path(index)
+        block_path = store._block_path(index)
+        index_path = raw_path[:-4] + ".idx"  # store_query's time index of the raw segment
+        with self.compact_seconds.time():
+            if not os.path.exists(block_path):
+                rows = np.fromfile(raw_path, dtype=ROW_DTYPE)
+                write_rollups(store, rollup_rows(rows, index), index)
+                block = encode_block(rows)
+                # Lossless or nothing: compare the decoded block with the raw bytes
+                if decode_block(block).tobytes() != rows.tobytes():
+                    raise ValueError(f"segment {index} does not survive compaction; kept raw")
+                with open(block_path + ".tmp", "wb") as f:
+                    f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(block_path + ".tmp", block_path)
+                fsync_directory(store.path)
+                self.raw_bytes.inc(rows.nbytes)
+                self.block_bytes.inc(len(block))
+            # Readers that already opened the raw segment keep their mapping after the unlink
+            self._remove(raw_path)
+            self._remove(index_path)
+        self.compacted.inc()
+
+    # Delete a segment; one that was never compacted (not full, or older than the policy when it
+    # first ran) is rolled up first, so its hours are kept like those of compacted segments
+    def expire(self, index):
+        raw_path = self.store._segment_path(index)
+        if os.path.exists(raw_path) and not os.path.exists(self.store._block_path(index)):
+            rows = np.fromfile(raw_path, dtype=ROW_DTYPE, count=os.path.getsize(raw_path) // ROW_DTYPE.itemsize)
+            if len(rows):
+                write_rollups(self.store, rollup_rows(rows, index), index)
+        for path in (self.store._segment_path(index), self.store._segment_path(index)[:-4] + ".idx", self.store._block_path(index)):
+            self._remove(path)
+        self.expired.inc()
+
+    # One pass of the policy; returns the number of segments compacted and expired
+    def run_once(self, now=None):
+        now = time.time() if now is None else now
+        compacted = expired = 0
+        for index in self._closed_segments():
+            high = self._segment_high(index)
+            if high is None:
+                continue
+            if self.expire_after is not None and high < now - self.expire_after:
+                self.expire(index)
+                expired += 1
+                continue
+            raw = os.path.exists(self.store._segment_path(index))
+            full = raw and os.path.getsize(self.store._segment_path(index)) == self.store.segment_rows * ROW_DTYPE.itemsize
+            if full and high < now - self.compact_after:
+                self.compact(index)
+                compacted += 1
+        if self.rollups_expire_after is not None:
+            for year in _rollup_years(self.store):
+                if datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp() < now - self.rollups_expire_after:
+                    self._remove(_rollup_path(self.store, year))
+        return compacted, expired
+
+    def run(self):
+        while True:
+            try:
+                compacted, expired = self.run_once()
+                if compacted or expired:
+                    print(f"Retention: compacted {compacted} segments, expired {expired}")
+            except Exception as e:
+                print(f"Error applying the retention policy: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+# Parse a "YYYY-MM-DD HH:MM:SS" argument to an epoch timestamp
+def parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp() if value else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the retention policy to a store, or read its hourly rollups")
+    parser.add_argument('--store', default='sensor_store', help="store directory")
+    parser.add_argument('--compact-after', type=float, default=COMPACT_AFTER / 86400, help="days before full segments are compacted")
+    parser.add_argument('--expire-after', type=float, default=EXPIRE_AFTER / 86400, help="days before segments are deleted (0: never)")
+    parser.add_argument('--rollups-expire-after', type=float, default=ROLLUP_EXPIRE_AFTER / 86400, help="days before hourly rollups are deleted (0: never)")
+    parser.add_argument('--once', action='store_true', help="apply the policy once and exit")
+    parser.add_argument('--rollups', action='store_true', help="print hourly rollups as CSV instead")
+    parser.add_argument('--from', dest='start', help="rollups from, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument('--to', dest='end', help="rollups to, YYYY-MM-DD HH:MM:SS")
+    args = parser.parse_args()
+    if args.expire_after and args.expire_after <= args.compact_after:
+        parser.error("--expire-after must be longer than --compact-after")
+
+    store = SegmentStore(args.store, segment_rows=SEGMENT_ROWS, readonly=True)
+    if args.rollups:
+        rows = read_rollups(store, parse_time(args.start), parse_time(args.end))
+        print(",".join(rows.dtype.names))
+        for row in rows.tolist():
+            print(",".join("" if value != value else repr(value) for value in row))
+    else:
+        compactor = Compactor(store, args.compact_after * 86400, args.expire_after * 86400 or None,
+                              args.rollups_expire_after * 86400 or None)
+        if args.once:
+            compacted, expired = compactor.run_once()
+            print(f"Compacted {compacted} segments, expired {expired}")
+        else:
+            compactor.run()
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import random
+import zlib
+import shutil
+import argparse
+import tempfile
+import subprocess
+from sensor_store import SENSOR_FIELDS, ROW_SIZE
+import wal
+
+# Crash-injection harness for the write-ahead log (wal.DurableStore).
+# Each round starts a writer process that appends batches and prints "ACK <last seq>" after every
+# append returns (the point where the receiver acknowledges a batch), then crashes it:
+#   kill         SIGKILL / TerminateProcess at a random moment
+#   after-log    exit right after the log fsync, before the segment write
+#   checkpoint   exit in the middle of a checkpoint, after the segment flush
+#   torn-log     kill, then add a half-written record to the log (a batch cut off by a power loss)
+#   torn-segment kill, then cut the last segment in the middle of a row and add garbage rows
+# and then reopens the store, which replays the log, and checks that every acknowledged reading is
+# there with the values it was written with, that seqs are contiguous, and how long recovery took.
+# Example: python crash_test.py --rounds 50
+
+FAULTS = ("kill", "after-log", "checkpoint", "torn-log", "torn-segment")
+
+
+# Values derived from the seq, so any stored row can be checked on its own
+def values_for(seq):
+    return {field: float(seq * (i + 1) % 65536) for i, field in enumerate(SENSOR_FIELDS)}
+
+
+# Writer process: append batches forever (until killed or a fault point exits it)
+def writer(path, fault, seed):
+    rng = random.Random(seed)
+    store = wal.DurableStore(path, segment_rows=1000, checkpoint_bytes=64 * 1024)
+
+    if fault == "after-log":
+        original = store.write_readings
+
+        def write_readings(readings):
+            if rng.random() < 0.05:
+                os._exit(1)
+            return original(readings)
+        store.write_readings = write_readings
+    elif fault == "checkpoint":
+        original_reset = store.wal.reset
+
+        def reset():
+            if rng.random() < 0.5:
+                os._exit(1)
+            original_reset()
+        store.wal.reset = reset
+
+    while True:
+        seq = store.next_seq()
+        size = rng.randint(1, 50)
+        readings = store.append_many([(values_for(seq + i), 1.7e9 + seq + i, 1) for i in range(size)])
+        print(f"ACK {readings[-1].seq}", flush=True)
+
+
+# Simulate torn writes that a power cut (rather than a process kill) can leave behind
+def tear(path, fault, rng):
+    if fault == "torn-log":
+        # A batch cut off while being logged: header and part of its rows (never acknowledged)
+        count = rng.randint(1, 50)
+        rows = os.urandom(count * ROW_SIZE)
+        with open(os.path.join(path, wal.WAL_NAME), "ab") as f:
+            f.write((wal.RECORD_HEADER.pack(count, zlib.crc32(rows)) + rows)[:rng.randint(1, wal.RECORD_HEADER.size + len(rows) - 1)])
+    elif fault == "torn-segment":
+        # Only rows written since the last checkpoint can be torn; older ones were fsynced
+        logged = len(wal.WriteAheadLog(os.path.join(path, wal.WAL_NAME)).readings())
+        segments = sorted(name for name in os.listdir(path) if name.startswith("seg-"))
+        if segments and logged:
+            segment = os.path.join(path, segments[-1])
+            size = os.path.getsize(segment)
+            os.truncate(segment, max(0, size - rng.randint(1, min(logged, 3) * ROW_SIZE)))
+            with open(segment, "ab") as f:
+                f.write(os.urandom(rng.randint(1, 3 * ROW_SIZE)))
+
+
+# Reopen the store and check it against the acknowledged seq; returns recovery seconds
+def verify(path, acked):
+    started = time.perf_counter()
+    store = wal.DurableStore(path, segment_rows=1000)
+    elapsed = time.perf_counter() - started
+    expected = 0
+    for reading in store.since(0):
+        if reading.seq != expected:
+            raise AssertionError(f"seq {reading.seq} found where {expected} was expected")
+        values = values_for(reading.seq)
+        if any(getattr(reading, field) != values[field] for field in SENSOR_FIELDS):
+            raise AssertionError(f"reading {reading.seq} has wrong values")
+        expected += 1
+    store.close()
+    if expected <= acked:
+        raise AssertionError(f"acknowledged reading {acked} is missing (store ends at {expected - 1})")
+    return elapsed
+
+
+def run_round(path, fault, rng):
+    process = subprocess.Popen([sys.executable, __file__, "--writer", path, "--fault", fault, "--seed", str(rng.randrange(2 ** 32))],
+                               stdout=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + rng.uniform(0.05, 0.5)
+    acked = -1
+    for line in process.stdout:
+        acked = int(line.split()[1])
+        if time.monotonic() > deadline:
+            break
+    process.kill()
+    # Acknowledgements printed before the kill landed still count
+    for line in process.stdout:
+        acked = int(line.split()[1])
+    process.wait()
+    tear(path, fault, rng)
+    return acked, verify(path, acked)
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    path = tempfile.mkdtemp()
+    failures = 0
+    try:
+        for round_number in range(args.rounds):
+            fault = FAULTS[round_number % len(FAULTS)] if args.fault == "all" else args.fault
+            try:
+                acked, elapsed = run_round(path, fault, rng)
+                print(f"round {round_number:3} {fault:12} acknowledged up to {acked:7}, recovered in {elapsed * 1000:.1f} ms")
+            except AssertionError as e:
+                failures += 1
+                print(f"round {round_number:3} {fault:12} FAILED: {e}")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    print(f"{args.rounds - failures}/{args.rounds} rounds recovered every acknowledged reading")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crash-inject the write-ahead log and verify recovery")
+    parser.add_argument('--rounds', type=int, default=25, help="crash/recover rounds")
+    parser.add_argument('--fault', choices=("all",) + FAULTS, default="all", help="fault to inject")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--writer', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.writer:
+        writer(args.writer, args.fault, args.seed)
+    else:
+        sys.exit(1 if main(args) else 0)
@@ -0,0 +1,70 @@
+# On-device report filtering for the Pico and the Pico 2W. Sensors are oversampled, and a reading
+# only carries the values that moved past their deadband since they were last sent; nothing is
+# sent while nothing changed, except a full reading every heartbeat. Crossing a hazard threshold
+# is reported at once. The server holds each left-out value at its last one (step-hold), so
+# stored readings stay complete. Only plain Python is used so the same file runs on MicroPython,
+# CircuitPython and CPython; copy it next to the code on both boards.
+
+
+# Integer average of n reads (oversampling smooths ADC noise before the deadband is applied)
+def oversample(read, n):
+    total = 0
+    for _ in range(n):
+        total += read()
+    return (total + n // 2) // n
+
+
+# Decides which values of each new reading are worth sending.
+#   deadbands: {field: smallest change that is sent}; fields not listed are sent on any change
+#   alerts: {field: (op, threshold)} with op "<" or ">"; crossing the threshold either way is urgent
+#   heartbeat: seconds between full readings, so the server knows the station and its values are alive
+class ReportFilter:
+    def __init__(self, deadbands, alerts=None, heartbeat=60):
+        self.deadbands = deadbands
+        self.alerts = alerts or {}
+        self.heartbeat = heartbeat
+        self.sent = {}  # Last value sent per field
+        self.full_at = None  # Time of the last full reading
+        self.readings = 0
+        self.reports = 0
+
+    def alarmed(self, field, value):
+        op, threshold = self.alerts[field]
+        return value < threshold if op == "<" else value > threshold
+
+    # True if a value is on the other side of its hazard threshold than the last one sent
+    def crossed(self, values):
+        for field in self.alerts:
+            value = values.get(field)
+            if value is None:
+                continue
+            previous = self.sent.get(field)
+            if previous is None:
+                if self.alarmed(field, value):
+                    return True
+            elif self.alarmed(field, value) != self.alarmed(field, previous):
+                return True
+        return False
+
+    # Returns (values to send, urgent) for a new reading; values is empty when nothing is worth
+    # sending. None values (failed reads) are never sent. now is in seconds on any steady clock.
+    def check(self, values, now):
+        self.readings += 1
+        urgent = self.crossed(values)
+        if self.full_at is None or now - self.full_at >= self.heartbeat:
+            changed = {field: value for field, value in values.items() if value is not None}
+            self.full_at = now
+        else:
+            changed = {}
+            for field, value in values.items():
+                if value is None:
+                    continue
+                previous = self.sent.get(field)
+                if previous is None or abs(value - previous) >= self.deadbands.get(field, 0) or \
+                        (field in self.alerts and self.alarmed(field, value) != self.alarmed(field, previous)):
+                    if value != previous:
+                        changed[field] = value
+        if changed:
+            self.sent.update(changed)
+            self.reports += 1
+        return changed, urgent
@@ -0,0 +1,146 @@
+import os
+import socket
+import struct
+import threading
+import time
+from sensor_store import ROW, ROW_SIZE, Reading
+
+# Where the receiver publishes stored readings: a Unix socket, or localhost TCP where AF_UNIX is missing
+if hasattr(socket, "AF_UNIX"):
+    BUS_ADDRESS = "/tmp/hazard_bus.sock"
+else:
+    BUS_ADDRESS = ("127.0.0.1", 8082)
+
+# Frame: reading count (u32) followed by that many store rows
+FRAME_HEADER = struct.Struct("<I")
+
+# Seconds a subscriber may block a publish before it is disconnected
+SEND_TIMEOUT = 0.5
+
+# Seconds between reconnect attempts of a subscriber
+RECONNECT_INTERVAL = 1
+
+
+# Parse a bus address argument: "host:port" for TCP, anything else is a Unix socket path
+def parse_address(value):
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return value
+
+
+def _family(address):
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+# Encode a list of Readings as one bus frame
+def encode_frame(readings):
+    return FRAME_HEADER.pack(len(readings)) + b"".join(ROW.pack(*reading) for reading in readings)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("bus closed")
+        data += chunk
+    return bytes(data)
+
+
+# In-process publish/subscribe: callbacks receive each published list of Readings
+class EventBus:
+    def __init__(self):
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def publish(self, readings):
+        with self.lock:
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback(readings)
+            except Exception as e:
+                print(f"Error in bus subscriber: {e}")
+
+
+# Publisher side (the receiver): in-process callbacks plus every process connected to the bus socket
+class BusPublisher(EventBus):
+    def __init__(self, address=BUS_ADDRESS):
+        super().__init__()
+        self.address = address
+        self.connections = []
+        self.server = socket.socket(_family(address), socket.SOCK_STREAM)
+        if isinstance(address, tuple):
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        elif os.path.exists(address):
+            os.unlink(address)  # Left behind by a previous run
+        self.server.bind(address)
+        self.server.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            connection.settimeout(SEND_TIMEOUT)
+            with self.lock:
+                self.connections.append(connection)
+
+    def publish(self, readings):
+        super().publish(readings)
+        frame = encode_frame(readings)
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.sendall(frame)
+            except OSError:
+                # Gone or too slow; it catches up from the store when it reconnects
+                with self.lock:
+                    self.connections.remove(connection)
+                connection.close()
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+# Subscriber side (the dashboard): delivers each published list of Readings to callback.
+# on_connect runs after every (re)connect so the caller can catch up on anything it missed.
+class BusSubscriber:
+    def __init__(self, callback, address=BUS_ADDRESS, on_connect=None):
+        self.callback = callback
+        self.address = address
+        self.on_connect = on_connect
+
+    def run(self):
+        while True:
+            sock = socket.socket(_family(self.address), socket.SOCK_STREAM)
+            try:
+                sock.connect(self.address)
+                if self.on_connect:
+                    self.on_connect()
+                while True:
+                    count = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))[0]
+                    data = _recv_exactly(sock, count * ROW_SIZE)
+                    try:
+                        self.callback([Reading(*row) for row in ROW.iter_unpack(data)])
+                    except Exception as e:
+                        print(f"Error in bus subscriber: {e}")
+            except OSError:
+                pass
+            finally:
+                sock.close()
+            time.sleep(RECONNECT_INTERVAL)
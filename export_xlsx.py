@@ -0,0 +1,37 @@
+import argparse
+from datetime import datetime
+import pandas as pd
+from sensor_store import SegmentStore, SENSOR_FIELDS, value_or_none
+
+# Offline job: dump the segment store (or a time range of it) to an Excel workbook
+# Example: python export_xlsx.py --out sensor_data.xlsx --from "2024-11-01 00:00:00"
+
+
+# Parse a "YYYY-MM-DD HH:MM:SS" argument to an epoch timestamp
+def parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp() if value else None
+
+
+def export_xlsx(store_path, out_path, start=None, end=None):
+    store = SegmentStore(store_path, readonly=True)
+    rows = []
+    for reading in store.scan(start, end):
+        row = {field: value_or_none(getattr(reading, field)) for field in SENSOR_FIELDS}
+        row['Station'] = reading.station
+        row['Timestamp'] = datetime.fromtimestamp(reading.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append(row)
+
+    df = pd.DataFrame(rows, columns=list(SENSOR_FIELDS) + ['Station', 'Timestamp'])
+    df.to_excel(out_path, index=False)
+    print(f"Exported {len(df)} rows to {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the sensor store to an Excel workbook")
+    parser.add_argument('--store', default='sensor_store', help="store directory")
+    parser.add_argument('--out', default='sensor_data.xlsx', help="output workbook")
+    parser.add_argument('--from', dest='start', help="start time, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument('--to', dest='end', help="end time, YYYY-MM-DD HH:MM:SS")
+    args = parser.parse_args()
+
+    export_xlsx(args.store, args.out, parse_time(args.start), parse_time(args.end))
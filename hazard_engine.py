@@ -0,0 +1,219 @@
+import json
+import math
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+from sensor_store import SegmentStore, SENSOR_FIELDS
+
+# Rules file used by the dashboard and the replay tool
+HAZARD_RULES = "hazard_rules.json"
+
+# One store row as a NumPy record, matching sensor_store.ROW
+ROW_DTYPE = np.dtype([("seq", "<u8"), ("timestamp", "<f8"), ("station", "<u2")] + [(field, "<f8") for field in SENSOR_FIELDS])
+
+COMPARISONS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+
+# Compile a rule expression into a function of the column dict returning a bool array.
+# Leaves compare a sensor with "value"; with hold=True they use "clear" instead (hysteresis:
+# a hazard that is on stays on while the looser hold expression is still true).
+def compile_expression(node, hold=False):
+    if "all" in node:
+        parts = [compile_expression(child, hold) for child in node["all"]]
+        return lambda columns: np.logical_and.reduce([part(columns) for part in parts])
+    if "any" in node:
+        parts = [compile_expression(child, hold) for child in node["any"]]
+        return lambda columns: np.logical_or.reduce([part(columns) for part in parts])
+    if "not" in node:
+        # Negation swaps which threshold is the looser one
+        part = compile_expression(node["not"], not hold)
+        return lambda columns: ~part(columns)
+
+    sensor = node["sensor"]
+    if sensor not in SENSOR_FIELDS:
+        raise ValueError(f"unknown sensor in rule: {sensor}")
+    op = node["op"]
+    if op == "present":
+        return lambda columns: ~np.isnan(columns[sensor])
+    if op == "missing":
+        return lambda columns: np.isnan(columns[sensor])
+    if op not in COMPARISONS:
+        raise ValueError(f"unknown operator in rule: {op}")
+    compare = COMPARISONS[op]
+    threshold = node.get("clear", node["value"]) if hold else node["value"]
+    # Missing (NaN) values never satisfy a comparison
+    return lambda columns: compare(columns[sensor], threshold)
+
+
+# Forward-fill values[i] from the nearest earlier row where defined is True
+def forward_fill(values, defined):
+    index = np.where(defined, np.arange(len(values)), 0)
+    np.maximum.accumulate(index, out=index)
+    return values[index]
+
+
+# Evaluates every hazard for a batch of readings from any number of stations with column operations.
+# State (whether each hazard is on per station, and since when) is carried between batches, so the
+# same engine serves live ingest, backfill over stored history and what-if replays.
+class HazardEngine:
+    def __init__(self, rules):
+        self.hazards = []
+        for name, rule in rules["hazards"].items():
+            trigger = compile_expression(rule["when"])
+            hold = compile_expression(rule["when"], hold=True)
+            self.hazards.append((name, trigger, hold, float(rule.get("min_duration", 0))))
+        # (hazard, station) -> (raw state, time the raw state turned on)
+        self.state = {}
+
+    @classmethod
+    def from_file(cls, path=HAZARD_RULES):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def names(self):
+        return [name for name, _, _, _ in self.hazards]
+
+    # Evaluate a column dict (station, timestamp and one float array per sensor, NaN = missing).
+    # Returns {hazard: bool array} aligned with the input rows and updates the carried state.
+    def evaluate(self, columns):
+        station = np.asarray(columns["station"])
+        timestamp = np.asarray(columns["timestamp"], dtype=float)
+        n = len(timestamp)
+        if n == 0:
+            return {name: np.zeros(0, dtype=bool) for name in self.names()}
+
+        # Process each station's rows in time order
+        order = np.lexsort((timestamp, station))
+        ordered = {field: np.asarray(columns[field], dtype=float)[order] for field in SENSOR_FIELDS}
+        station = station[order]
+        timestamp = timestamp[order]
+        first = np.ones(n, dtype=bool)
+        first[1:] = station[1:] != station[:-1]
+        last = np.ones(n, dtype=bool)
+        last[:-1] = first[1:]
+        first_rows = np.flatnonzero(first)
+
+        results = {}
+        with np.errstate(invalid="ignore"):
+            for name, trigger_expr, hold_expr, min_duration in self.hazards:
+                trigger = trigger_expr(ordered)
+                hold = hold_expr(ordered)
+
+                # Carried state of each station before this batch
+                carried = [self.state.get((name, int(station[i])), (False, math.nan)) for i in first_rows]
+                carried_on = np.zeros(n, dtype=bool)
+                carried_on[first_rows] = [on for on, _ in carried]
+                carried_since = np.full(n, math.nan)
+                carried_since[first_rows] = [since for _, since in carried]
+
+                # Raw state: on when triggered, off when the hold expression fails, otherwise unchanged
+                defined = trigger | ~hold
+                raw = forward_fill(np.where(defined, trigger, carried_on), defined | first)
+
+                # When the current run of "on" started, for the minimum duration check
+                previous = np.empty(n, dtype=bool)
+                previous[1:] = raw[:-1]
+                previous[first] = carried_on[first]
+                rising = raw & ~previous
+                continuing = first & raw & previous
+                since = forward_fill(np.where(rising, timestamp, carried_since), rising | continuing | first)
+                active = raw & (timestamp - since >= min_duration)
+
+                for i in np.flatnonzero(last):
+                    self.state[(name, int(station[i]))] = (bool(raw[i]), float(since[i]) if raw[i] else math.nan)
+
+                result = np.empty(n, dtype=bool)
+                result[order] = active
+                results[name] = result
+        return results
+
+    # Evaluate a list of store Readings; returns {hazard: bool array} in the same order
+    def update(self, readings):
+        return self.evaluate(columns_from_readings(readings))
+
+
+# Column dict for a list of store Readings
+def columns_from_readings(readings):
+    columns = {field: np.array([getattr(reading, field) for reading in readings], dtype=float) for field in SENSOR_FIELDS}
+    columns["station"] = np.array([reading.station for reading in readings], dtype=np.uint16)
+    columns["timestamp"] = np.array([reading.timestamp for reading in readings], dtype=float)
+    return columns
+
+
+# Column dicts for stored rows in [start, end], one per segment file, read straight from disk
+def iter_store_columns(store, start=None, end=None):
+    from cold_storage import segment_rows
+    for index in store.segments():
+        rows = segment_rows(store, index, start=start, end=end)
+        if rows is None:
+            continue
+        if start is not None or end is not None:
+            mask = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                mask &= rows["timestamp"] >= start
+            if end is not None:
+                mask &= rows["timestamp"] <= end
+            rows = rows[mask]
+        if len(rows):
+            yield {name: rows[name] for name in ROW_DTYPE.names}
+
+
+# Replay stored history through a rule set; returns per (hazard, station) onset counts and active rows
+def replay(store, rules, start=None, end=None):
+    engine = HazardEngine(rules)
+    summary = {}
+    for columns in iter_store_columns(store, start, end):
+        order = np.lexsort((columns["timestamp"], columns["station"]))
+        station = columns["station"][order]
+        for name, active in engine.evaluate(columns).items():
+            active = active[order]
+            previous = np.empty(len(active), dtype=bool)
+            previous[1:] = active[:-1]
+            previous[0] = False
+            for value in np.unique(station):
+                rows = station == value
+                key = (name, int(value))
+                was_on = summary.get(key, {}).get("on", False)
+                station_previous = previous[rows]
+                station_previous[0] = was_on
+                onsets = int(np.count_nonzero(active[rows] & ~station_previous))
+                entry = summary.setdefault(key, {"onsets": 0, "active_rows": 0, "rows": 0, "on": False})
+                entry["onsets"] += onsets
+                entry["active_rows"] += int(np.count_nonzero(active[rows]))
+                entry["rows"] += int(np.count_nonzero(rows))
+                entry["on"] = bool(active[rows][-1])
+    return summary
+
+
+# Parse a "YYYY-MM-DD HH:MM:SS" argument to an epoch timestamp
+def parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp() if value else None
+
+
+if __name__ == "__main__":
+    # What-if replay: python hazard_engine.py --rules new_rules.json --from "2024-11-01 00:00:00"
+    parser = argparse.ArgumentParser(description="Replay stored readings through a hazard rule set")
+    parser.add_argument('--store', default='sensor_store', help="store directory")
+    parser.add_argument('--rules', default=HAZARD_RULES, help="rules file (JSON)")
+    parser.add_argument('--from', dest='start', help="start time, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument('--to', dest='end', help="end time, YYYY-MM-DD HH:MM:SS")
+    args = parser.parse_args()
+
+    with open(args.rules) as f:
+        rules = json.load(f)
+    started = time.perf_counter()
+    summary = replay(SegmentStore(args.store, readonly=True), rules, parse_time(args.start), parse_time(args.end))
+    elapsed = time.perf_counter() - started
+
+    for (name, station), entry in sorted(summary.items()):
+        share = 100 * entry["active_rows"] / entry["rows"] if entry["rows"] else 0
+        print(f"{name:12} station {station:5}: {entry['onsets']:6} onsets, active in {share:5.1f}% of {entry['rows']} readings")
+    print(f"Replayed in {elapsed:.2f}s")
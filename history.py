@@ -0,0 +1,363 @@
+import math
+import time
+import bisect
+from array import array
+from sensor_store import SENSOR_FIELDS
+
+# Rows kept in memory per history unless configured otherwise
+DEFAULT_CAPACITY = 10000
+
+
+# Allocate n items of an array typecode set to fill. The structures below take an allocate
+# function, so the same code keeps its columns in this process (this default) or in a
+# shared memory block that several processes map (shared_state.SharedArena.allocate).
+def local_array(typecode, n, fill):
+    return array(typecode, [fill]) * n
+
+
+# Sequence lock for one writer and any number of readers, which may live in other processes.
+# cell[0] is odd while the writer is changing the data; a reader copies what it needs and
+# retries until the counter was even and unchanged around the copy, so it never sees a torn write.
+class SeqLock:
+    def __init__(self, cell):
+        self.cell = cell
+
+    # Writer side: with seqlock: ...
+    def __enter__(self):
+        self.cell[0] += 1
+
+    def __exit__(self, *exc):
+        self.cell[0] += 1
+
+    # Reader side: returns copy() taken while no write was in progress
+    def read(self, copy):
+        while True:
+            before = self.cell[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            result = copy()
+            if self.cell[0] == before:
+                return result
+
+
+# Fixed-capacity in-memory history: one float column per sensor plus shared seq and timestamp columns.
+# Every column holds 2 * capacity slots and row i is written at slot i and i + capacity, so the
+# newest n <= capacity rows are always contiguous and can be handed out as memoryviews.
+# One thread or process appends; readers in any thread or process copy rows under the seqlock.
+class RingHistory:
+    def __init__(self, capacity=DEFAULT_CAPACITY, fields=SENSOR_FIELDS, allocate=local_array):
+        self.capacity = capacity
+        self.fields = fields
+        self.columns = {field: allocate('d', 2 * capacity, math.nan) for field in fields}
+        self.timestamps = allocate('d', 2 * capacity, 0.0)
+        self.seqs = allocate('q', 2 * capacity, -1)
+        # Seqlock counter, slot the next row is written to, rows held, last seq + 1, rows ever appended
+        self.header = allocate('q', 5, 0)
+        self.seqlock = SeqLock(self.header)
+
+    @property
+    def next(self):
+        return self.header[1]
+
+    @property
+    def count(self):
+        return self.header[2]
+
+    @property
+    def last_seq(self):
+        return self.header[3] - 1
+
+    @property
+    def appended(self):
+        return self.header[4]
+
+    # Append one store Reading; rows at or below the last seen seq are duplicates and are skipped
+    def append(self, reading):
+        if reading.seq <= self.last_seq:
+            return False
+        with self.seqlock:
+            slot = self.header[1]
+            mirror = slot + self.capacity
+            for field in self.fields:
+                column = self.columns[field]
+                column[slot] = column[mirror] = getattr(reading, field)
+            self.timestamps[slot] = self.timestamps[mirror] = reading.timestamp
+            self.seqs[slot] = self.seqs[mirror] = reading.seq
+            self.header[1] = (slot + 1) % self.capacity
+            self.header[2] = min(self.header[2] + 1, self.capacity)
+            self.header[3] = reading.seq + 1
+            self.header[4] += 1
+        return True
+
+    def __len__(self):
+        return self.count
+
+    # Slot range [start, end) holding the newest n rows
+    def _range(self, n):
+        n = min(n, self.count)
+        end = self.next + self.capacity
+        return end - n, end
+
+    # Zero-copy views of the newest n rows; they stay valid until capacity - n more rows are appended
+    def window(self, n):
+        start, end = self._range(n)
+        views = {field: memoryview(self.columns[field])[start:end] for field in self.fields}
+        views["timestamp"] = memoryview(self.timestamps)[start:end]
+        views["seq"] = memoryview(self.seqs)[start:end]
+        return views
+
+    # Copy of the rows with seq above since (at most the newest limit of them), as lists per column
+    def since(self, since, limit=None):
+        def copy():
+            start, end = self._range(self.count)
+            first = start + bisect.bisect_right(memoryview(self.seqs)[start:end], since)
+            if limit:
+                first = max(first, end - limit)
+            rows = {field: self.columns[field][first:end].tolist() for field in self.fields}
+            rows["timestamp"] = self.timestamps[first:end].tolist()
+            rows["seq"] = self.seqs[first:end].tolist()
+            return rows
+        return self.seqlock.read(copy)
+
+    # The newest row as {field: value, "timestamp", "seq"}, or None while empty
+    def last_row(self):
+        def copy():
+            if not self.count:
+                return None
+            slot = self.next + self.capacity - 1
+            row = {field: self.columns[field][slot] for field in self.fields}
+            row["timestamp"] = self.timestamps[slot]
+            row["seq"] = self.seqs[slot]
+            return row
+        return self.seqlock.read(copy)
+
+
+# Rollup tiers as (bucket seconds, buckets kept): 1 min for a week, 10 min for a month, 1 h for a year
+ROLLUP_TIERS = ((60, 7 * 24 * 60), (600, 30 * 24 * 6), (3600, 365 * 24))
+
+# Points returned by a range query unless the caller asks for a different number
+DEFAULT_MAX_POINTS = 1000
+
+
+# Min, max, sum and count per sensor in fixed-width time buckets. Buckets are direct-mapped
+# (slot = bucket number % capacity) and each slot remembers which bucket it holds, so a reading
+# updates its bucket in O(1) whether it is new, late, or follows a gap.
+class RollupTier:
+    def __init__(self, resolution, capacity, fields=SENSOR_FIELDS, allocate=local_array):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.fields = fields
+        self.starts = allocate('d', capacity, -1.0)
+        self.mins = {field: allocate('d', capacity, math.nan) for field in fields}
+        self.maxs = {field: allocate('d', capacity, math.nan) for field in fields}
+        self.sums = {field: allocate('d', capacity, 0.0) for field in fields}
+        self.counts = {field: allocate('q', capacity, 0) for field in fields}
+        self.newest_cell = allocate('d', 1, -math.inf)
+        self.seqlock = SeqLock(allocate('q', 1, 0))
+
+    # Start of the newest bucket written
+    @property
+    def newest(self):
+        return self.newest_cell[0]
+
+    # Start of the oldest bucket still held
+    def oldest(self):
+        return self.newest - (self.capacity - 1) * self.resolution
+
+    def add(self, reading):
+        bucket = math.floor(reading.timestamp / self.resolution)
+        start = bucket * self.resolution
+        if start < self.oldest():
+            return
+        slot = bucket % self.capacity
+        with self.seqlock:
+            if self.starts[slot] != start:
+                # The slot still holds a bucket that has aged out; reuse it
+                self.starts[slot] = start
+                for field in self.fields:
+                    self.mins[field][slot] = math.nan
+                    self.maxs[field][slot] = math.nan
+                    self.sums[field][slot] = 0.0
+                    self.counts[field][slot] = 0
+            for field in self.fields:
+                value = getattr(reading, field)
+                if value != value:
+                    continue  # NaN: sensor missing from this reading
+                if not self.counts[field][slot] or value < self.mins[field][slot]:
+                    self.mins[field][slot] = value
+                if not self.counts[field][slot] or value > self.maxs[field][slot]:
+                    self.maxs[field][slot] = value
+                self.sums[field][slot] += value
+                self.counts[field][slot] += 1
+            self.newest_cell[0] = max(self.newest, start)
+
+    # Number of bucket slots spanned by [start, end]
+    def bucket_count(self, start, end):
+        first = max(start, self.oldest())
+        last = min(end, self.newest + self.resolution)
+        if last < first:
+            return 0  # Also an empty tier, whose newest bucket is -inf
+        return int((last - first) / self.resolution) + 1
+
+    # Slot ranges [lo, hi) holding buckets first..last (at most capacity of them)
+    def _ranges(self, first, last):
+        ranges = []
+        bucket = first
+        while bucket <= last:
+            slot = bucket % self.capacity
+            n = min(last - bucket + 1, self.capacity - slot)
+            ranges.append((slot, slot + n))
+            bucket += n
+        return ranges
+
+    # First bucket number and slot ranges for buckets from start up to end (None: up to the newest)
+    def _span(self, start, end=None):
+        newest = self.newest
+        if newest == -math.inf:
+            return None
+        first = math.floor(max(start, newest - (self.capacity - 1) * self.resolution) / self.resolution)
+        last = math.floor((newest if end is None else min(end, newest)) / self.resolution)
+        return first, self._ranges(first, last)
+
+    # Per-field series of bucket start, mean, min, max and count for buckets overlapping [start, end]
+    def series(self, start, end):
+        series = {field: {"x": [], "y": [], "min": [], "max": [], "count": []} for field in self.fields}
+
+        def copy():
+            span = self._span(start, end)
+            if span is None:
+                return None
+            first, ranges = span
+            buckets = {"starts": take(self.starts, ranges)}
+            for name, columns in (("min", self.mins), ("max", self.maxs), ("sum", self.sums), ("count", self.counts)):
+                buckets[name] = {field: take(columns[field], ranges) for field in self.fields}
+            return first, buckets
+
+        copied = self.seqlock.read(copy)
+        if copied is None:
+            return series
+        first, buckets = copied
+        for i, held in enumerate(buckets["starts"]):
+            bucket_start = (first + i) * self.resolution
+            if held != bucket_start:
+                continue  # Slot holds an older bucket, or none
+            for field in self.fields:
+                count = buckets["count"][field][i]
+                if count:
+                    out = series[field]
+                    out["x"].append(bucket_start)
+                    out["y"].append(buckets["sum"][field][i] / count)
+                    out["min"].append(buckets["min"][field][i])
+                    out["max"].append(buckets["max"][field][i])
+                    out["count"].append(count)
+        return series
+
+    # Largest value of field in buckets starting at or after start (NaN if none)
+    def max_since(self, field, start):
+        def copy():
+            span = self._span(start)
+            if span is None:
+                return None
+            first, ranges = span
+            return first, take(self.starts, ranges), take(self.maxs[field], ranges), take(self.counts[field], ranges)
+
+        copied = self.seqlock.read(copy)
+        best = math.nan
+        if copied is None:
+            return best
+        first, starts, maxs, counts = copied
+        for i, bucket_start in enumerate(starts):
+            if bucket_start == (first + i) * self.resolution and counts[i] and not maxs[i] <= best:
+                best = maxs[i]
+        return best
+
+
+# Values of column in the slot ranges [lo, hi), as one list
+def take(column, ranges):
+    values = []
+    for lo, hi in ranges:
+        values.extend(column[lo:hi].tolist())
+    return values
+
+
+# All rollup tiers, updated together on ingest
+class Rollups:
+    def __init__(self, tiers=ROLLUP_TIERS, fields=SENSOR_FIELDS, allocate=local_array):
+        self.tiers = [RollupTier(resolution, capacity, fields, allocate) for resolution, capacity in tiers]
+
+    def add(self, reading):
+        for tier in self.tiers:
+            tier.add(reading)
+
+
+# Largest-Triangle-Three-Buckets: indexes of threshold points that keep the visual shape of (xs, ys)
+def lttb(xs, ys, threshold):
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        avg_start = int((i + 1) * bucket_size) + 1
+        avg_end = min(max(int((i + 2) * bucket_size) + 1, avg_start + 1), n)
+        avg_x = sum(xs[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(ys[avg_start:avg_end]) / (avg_end - avg_start)
+
+        # Point of this bucket forming the largest triangle with the previous pick and that average
+        best, best_area = -1, -1.0
+        for j in range(int(i * bucket_size) + 1, int((i + 1) * bucket_size) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+
+# Downsample every series with more than max_points points
+def downsample(series, max_points):
+    for field, out in series.items():
+        if len(out["x"]) > max_points:
+            keep = lttb(out["x"], out["y"], max_points)
+            series[field] = {key: [values[i] for i in keep] for key, values in out.items()}
+    return series
+
+
+# Serve [start, end] from the coarsest source that still has at least max_points points
+# (raw ring, then 1 min, 10 min, 1 h rollups), then LTTB it down to max_points
+def query_range(history, rollups, start, end, max_points=DEFAULT_MAX_POINTS):
+    rows = history.since(-1)
+    raw = {field: {"x": [], "y": []} for field in history.fields}
+    for i, timestamp in enumerate(rows["timestamp"]):
+        if start <= timestamp <= end:
+            for field in history.fields:
+                value = rows[field][i]
+                if value == value:
+                    raw[field]["x"].append(timestamp)
+                    raw[field]["y"].append(value)
+    raw_points = max(len(out["x"]) for out in raw.values())
+    # A full ring has dropped older rows, so it only covers the range if its oldest row is in range
+    raw_covers = len(history) < history.capacity or rows["timestamp"][0] <= start
+
+    # (resolution, points, series factory), finest first; keep those that reach back to start
+    sources = []
+    if raw_covers:
+        sources.append((0, raw_points, lambda: raw))
+    for tier in rollups.tiers:
+        if tier.oldest() <= start:
+            sources.append((tier.resolution, tier.bucket_count(start, end), lambda tier=tier: tier.series(start, end)))
+    if not sources:
+        # Nothing reaches back that far: use the longest-lived tier
+        tier = rollups.tiers[-1]
+        sources.append((tier.resolution, tier.bucket_count(start, end), lambda: tier.series(start, end)))
+
+    resolution, _, build = sources[0]
+    for candidate in sources:
+        if candidate[1] >= max_points:
+            resolution, _, build = candidate
+    return resolution, downsample(build(), max_points)
@@ -0,0 +1,343 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Registry, ROW_BUCKETS, SIZE_BUCKETS
+from sensor_store import normalise_reading, to_number
+from sensor_codec import (BATCH_MAGIC, RECORD_MAGIC, BATCH_HEADER_SIZE, RECORD_SIZE, decode_batch_header,
+                          decode_record, decode_records)
+
+# Longest accepted frame; longer lines drop the connection
+MAX_FRAME = 4096
+
+# Frames waiting to be stored; when full, readers stop reading and TCP pushes back on senders
+QUEUE_SIZE = 10000
+
+# Most readings written to the store in one append
+BATCH_SIZE = 1000
+
+# Seconds between throughput reports
+STATS_INTERVAL = 10
+
+# Largest number of records accepted in one BATCH frame
+MAX_BATCH_RECORDS = 512
+
+# Seconds a station's last value of a sensor stands in for readings that leave it out. Edge
+# filtered stations (edge_filter.py) only send values that changed, and all of them every 60 s.
+HOLD_SECONDS = 180
+
+# Receiver metrics; the receiver writes them to receiver.prom in the store directory, where the
+# dashboard's /metrics picks them up
+ingest_metrics = Registry()
+CONNECTIONS = ingest_metrics.counter("ingest_connections_total", "Station connections accepted")
+OPEN_CONNECTIONS = ingest_metrics.gauge("ingest_open_connections", "Station connections open")
+QUEUE_DEPTH = ingest_metrics.gauge("ingest_queue_depth", "Frames waiting to be stored, when the last batch was taken")
+FRAMES = {framing: ingest_metrics.counter("ingest_frames_total", "Frames received, by framing", framing=framing)
+          for framing in ("text", "text_batch", "binary", "binary_batch")}
+RECEIVED_BYTES = ingest_metrics.counter("ingest_received_bytes_total", "Bytes of frames received")
+FRAME_BYTES = ingest_metrics.histogram("ingest_frame_bytes", "Size of received frames", SIZE_BUCKETS)
+RECV_SECONDS = ingest_metrics.histogram("ingest_recv_seconds", "Time from the first byte of a frame to its last (slow or stalled senders)")
+DROPPED = ingest_metrics.counter("ingest_dropped_connections_total", "Connections dropped for malformed or oversized frames")
+INVALID_ITEMS = ingest_metrics.counter("ingest_invalid_items_total", "Payload items without a key: value separator")
+PARSE_SECONDS = ingest_metrics.histogram("ingest_parse_seconds", "Parsing, normalising and step-holding one batch of frames")
+APPEND_SECONDS = ingest_metrics.histogram("ingest_append_seconds", "Store append of one batch, write-ahead log included")
+BATCH_ROWS = ingest_metrics.histogram("ingest_batch_rows", "Readings per store append", ROW_BUCKETS)
+STORED = ingest_metrics.counter("ingest_stored_readings_total", "Readings stored")
+STORE_ERRORS = ingest_metrics.counter("ingest_store_errors_total", "Failed store appends")
+CAPTURE_ERRORS = ingest_metrics.counter("ingest_capture_errors_total", "Failed capture log writes (capture is then turned off)")
+
+
+# Split a "key: value, key: value" payload into a dict of strings
+def parse_payload(data_str):
+    # Check if the data starts with 'UART:' and remove the prefix
+    if data_str.startswith("UART:"):
+        data_str = data_str[5:].strip()
+
+    sensor_data = {}
+    for item in data_str.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, value = item.partition(':')
+        if not sep:
+            INVALID_ITEMS.inc()
+            continue
+        sensor_data[key.strip()] = value.strip()
+    return sensor_data
+
+
+# Parse a batch header: "BATCH <station> <boot> <first_seq> <count> <now_ms>"
+def parse_batch_header(frame):
+    parts = frame.split()
+    if len(parts) != 6:
+        raise ValueError(f"bad batch header: {frame!r}")
+    station, boot, first_seq, count, now_ms = (int(part) for part in parts[1:])
+    if not 0 < count <= MAX_BATCH_RECORDS:
+        raise ValueError(f"bad batch size: {count}")
+    return station, boot, first_seq, count, now_ms
+
+
+# Split a batch record "<sample_ms>|<payload>" into its device time and payload
+def parse_batch_record(frame):
+    sample_ms, sep, payload = frame.partition(b'|')
+    if not sep:
+        raise ValueError(f"bad batch record: {frame!r}")
+    return int(sample_ms), payload
+
+
+# Count one received frame of the given framing whose first byte arrived at started (perf_counter)
+def count_frame(framing, size, started):
+    RECV_SECONDS.observe(time.perf_counter() - started)
+    FRAMES[framing].inc()
+    RECEIVED_BYTES.inc(size)
+    FRAME_BYTES.observe(size)
+
+
+# Step-hold reconstruction of sparse readings: a sensor a reading leaves out (or reports as NaN)
+# takes the station's last value of it, if that is at most hold seconds older, so every stored
+# row is complete. Readings arriving older than the held value are stored as they are.
+class StepHold:
+    def __init__(self, hold=HOLD_SECONDS):
+        self.hold = hold
+        self.last = {}  # {station: {field: (value, timestamp)}}
+
+    def fill(self, station, values, timestamp):
+        last = self.last.setdefault(station, {})
+        filled = dict(values)
+        for field, (value, seen) in last.items():
+            current = filled.get(field)
+            if (current is None or current != current) and 0 <= timestamp - seen <= self.hold:
+                filled[field] = value
+        for field, value in values.items():
+            if value is not None and value == value and (field not in last or timestamp >= last[field][1]):
+                last[field] = (value, timestamp)
+        return filled
+
+
+# Asyncio receiver: many concurrent stations, batched store appends
+#
+# Several framings share the port, told apart by the first byte of each frame:
+#   - legacy single-shot: one "key: value, ..." payload per connection or per line, never acknowledged
+#   - text batch: a BATCH header followed by <count> "<sample_ms>|<payload>" lines
+#   - binary record or binary batch (see sensor_codec.py), starting with 0xA5
+# Batches are answered with "ACK <station> <boot> <last_seq>" once their records are stored.
+# Records carry the device clock, so readings buffered while the link was down keep their
+# sampling time. Sensors a reading leaves out are filled in by StepHold.
+class IngestServer:
+    def __init__(self, store, host="0.0.0.0", port=8081, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, verbose=False, bus=None,
+                 metrics_path=None, capture=None):
+        self.store = store
+        # Optional replay.CaptureLog every frame is recorded to before it is parsed
+        self.capture = capture
+        # Where serve() keeps writing the receiver metrics (None: not written)
+        self.metrics_path = metrics_path
+        # Optional event_bus publisher told about every stored reading
+        self.bus = bus
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.queue = None
+        self.connections = 0
+        self.received = 0
+        self.stored = 0
+        # Highest stored seq per (station, boot) so retransmitted batches are not stored twice
+        self.last_seq = {}
+        # Last value per station and sensor, for readings that only carry what changed
+        self.hold = StepHold()
+        # A single writer thread keeps appends ordered and off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    # Read frames from one station until it disconnects
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        CONNECTIONS.inc()
+        OPEN_CONNECTIONS.set(self.connections)
+        peer = writer.get_extra_info('peername')
+        if self.verbose:
+            print(f"Connection established with {peer}")
+        try:
+            while True:
+                head = await reader.readexactly(1)
+                started = time.perf_counter()
+                if head == BATCH_MAGIC[:1]:
+                    await self.handle_binary(head, reader, writer, started)
+                    continue
+                try:
+                    frame = head + await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    # Single-shot senders close the socket without a trailing newline
+                    frame = head + e.partial
+                    if frame.strip():
+                        count_frame("text", len(frame), started)
+                        await self.enqueue(frame)
+                    break
+                if frame.startswith(b'BATCH '):
+                    await self.handle_batch(frame, reader, writer, started)
+                elif frame.strip():
+                    count_frame("text", len(frame), started)
+                    await self.enqueue(frame)
+        except asyncio.LimitOverrunError:
+            DROPPED.inc()
+            print(f"Dropping {peer}: frame longer than {MAX_FRAME} bytes")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            DROPPED.inc()
+            print(f"Dropping {peer}: {e}")
+        finally:
+            self.connections -= 1
+            OPEN_CONNECTIONS.set(self.connections)
+            writer.close()
+
+    async def enqueue(self, payload, arrival=None, station=0, done=None):
+        self.received += 1
+        if self.verbose:
+            print(f"Received data: {payload}")
+        arrival = time.time() if arrival is None else arrival
+        # Blocks this connection (not the accept loop) while the writer catches up
+        await self.queue.put((arrival, payload, station, done))
+
+    # Read the records of one text BATCH frame, store the new ones and acknowledge the batch
+    async def handle_batch(self, header, reader, writer, started):
+        station, boot, first_seq, count, now_ms = parse_batch_header(header)
+        arrival = time.time()
+        records = []
+        size = len(header)
+        for offset in range(count):
+            line = await reader.readuntil(b'\n')
+            size += len(line)
+            sample_ms, payload = parse_batch_record(line)
+            # Shift the device sample time onto the server clock
+            records.append((first_seq + offset, arrival - (now_ms - sample_ms) / 1000, payload))
+        count_frame("text_batch", size, started)
+        await self.store_batch(station, boot, records, writer)
+
+    # Read one binary record or binary batch frame
+    async def handle_binary(self, head, reader, writer, started):
+        magic = head + await reader.readexactly(1)
+        if magic == BATCH_MAGIC:
+            header = magic + await reader.readexactly(BATCH_HEADER_SIZE - 2)
+            station, boot, count, now_ms = decode_batch_header(header)
+            if not 0 < count <= MAX_BATCH_RECORDS:
+                raise ValueError(f"bad batch size: {count}")
+            arrival = time.time()
+            body = await reader.readexactly(count * RECORD_SIZE)
+            count_frame("binary_batch", len(header) + len(body), started)
+            decoded = decode_records(body)
+            # Device clocks are u32 milliseconds, so the age survives a wrap
+            records = [(seq, arrival - ((now_ms - t_ms) & 0xFFFFFFFF) / 1000, values) for _, seq, t_ms, values in decoded]
+            await self.store_batch(station, boot, records, writer)
+        elif magic == RECORD_MAGIC:
+            rest = await reader.readexactly(2)
+            frame = magic + rest + await reader.readexactly(rest[1] + 2)
+            count_frame("binary", len(frame), started)
+            station, _, _, values = decode_record(frame)
+            await self.enqueue(values, station=station)
+        else:
+            raise ValueError(f"unknown frame type {magic!r}")
+
+    # Store the (seq, timestamp, payload) records of one batch and acknowledge it
+    async def store_batch(self, station, boot, records, writer):
+        # Skip records already stored from an earlier copy of this batch whose ACK was lost
+        key = (station, boot)
+        last_seq = max(seq for seq, _, _ in records)
+        stored_seq = self.last_seq.get(key, -1)
+        new_records = [record for record in records if record[0] > stored_seq]
+
+        if new_records:
+            # The writer stores frames in order, so the last record finishing means the batch is stored
+            done = asyncio.get_running_loop().create_future()
+            for index, (_, timestamp, payload) in enumerate(new_records):
+                await self.enqueue(payload, timestamp, station, done if index == len(new_records) - 1 else None)
+            try:
+                await done
+            except Exception as e:
+                print(f"Not acknowledging batch from station {station}: {e}")
+                return
+            self.last_seq[key] = max(last_seq, self.last_seq.get(key, -1))
+
+        writer.write(f"ACK {station} {boot} {last_seq}\n".encode('utf-8'))
+        await writer.drain()
+
+    # Parse and store a batch of queued frames; runs on the writer thread
+    def write_batch(self, batch):
+        if self.capture is not None:
+            # Capture is a side channel: a full disk there must not fail (and un-ACK) the store write
+            try:
+                self.capture.write(batch)
+            except Exception as e:
+                CAPTURE_ERRORS.inc()
+                print(f"Capture stopped: {e}")
+                capture, self.capture = self.capture, None
+                try:
+                    capture.close()
+                except Exception:
+                    pass
+        started = time.perf_counter()
+        rows = []
+        for arrival, payload, station, _ in batch:
+            if isinstance(payload, dict):
+                # Binary records arrive already decoded
+                rows.append((self.hold.fill(station, payload, arrival), arrival, station))
+            else:
+                sensor_data = parse_payload(payload.decode('utf-8', 'replace'))
+                # Text payloads may name their station ("Station: 12, MQ7: ..."); otherwise station 0
+                station_id = to_number(sensor_data.get("Station"))
+                if 0 <= station_id < 65536:
+                    station = int(station_id)
+                rows.append((self.hold.fill(station, normalise_reading(sensor_data), arrival), arrival, station))
+        parsed = time.perf_counter()
+        PARSE_SECONDS.observe(parsed - started)
+        readings = self.store.append_many(rows)
+        APPEND_SECONDS.observe(time.perf_counter() - parsed)
+        BATCH_ROWS.observe(len(rows))
+        STORED.inc(len(rows))
+        self.stored += len(rows)
+        if self.bus is not None:
+            self.bus.publish(readings)
+
+    # Coalesce whatever is queued into one append while the previous batch is being written
+    async def batch_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            QUEUE_DEPTH.set(self.queue.qsize())
+            try:
+                await loop.run_in_executor(self._executor, self.write_batch, batch)
+            except Exception as e:
+                STORE_ERRORS.inc()
+                print(f"Error storing batch of {len(batch)}: {e}")
+                for item in batch:
+                    if item[3] is not None and not item[3].done():
+                        item[3].set_exception(e)
+                continue
+            # Release the connections waiting to acknowledge these records
+            for item in batch:
+                if item[3] is not None and not item[3].done():
+                    item[3].set_result(None)
+
+    async def report_stats(self):
+        last_stored = self.stored
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            rate = (self.stored - last_stored) / STATS_INTERVAL
+            last_stored = self.stored
+            print(f"Stored {self.stored} readings ({rate:.0f}/s), {self.connections} connections, queue {self.queue.qsize()}")
+
+    async def serve(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_FRAME)
+        print(f"Server is listening on port {self.port}...")
+        if self.metrics_path:
+            ingest_metrics.write_periodically(self.metrics_path)
+        writer_task = asyncio.create_task(self.batch_writer())
+        stats_task = asyncio.create_task(self.report_stats())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            stats_task.cancel()
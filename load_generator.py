@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import random
+import time
+from sensor_codec import encode_record, encode_batch_header
+
+# Simulate N stations sending to the ingest server, either the legacy "key: value, ..." text
+# payload or the binary batches the Pico 2W uplink sends (sensor_codec.py)
+# Example: python load_generator.py --stations 50 --rate 100 --duration 30 --persistent
+#          python load_generator.py --stations 50 --rate 0 --duration 30 --binary --batch 32
+
+
+# Build one payload in the format produced by send_data on the Pico 2W
+def make_payload(rng):
+    return (
+        f"MQ7: {rng.randint(20000, 40000)}, "
+        f"Flame: {rng.randint(3000, 65535)}, "
+        f"Temp: {rng.uniform(20, 40):.1f}, "
+        f"Humidity: {rng.uniform(30, 90):.1f}, "
+        f"Water Level: {rng.randint(50, 400)} mm, "
+        f"MQ-135: {rng.randint(5000, 12000)}, "
+        f"Soil: {rng.randint(20000, 60000)}, "
+        f"Rain: {rng.randint(20000, 60000)}"
+    )
+
+
+# Build one reading in the form the Pico 2W passes to encode_record
+def make_values(rng):
+    return {
+        "MQ7": rng.randint(20000, 40000),
+        "Flame": rng.randint(3000, 65535),
+        "Temp": round(rng.uniform(20, 40), 1),
+        "Humidity": round(rng.uniform(30, 90), 1),
+        "Water_Level": rng.randint(50, 400),
+        "MQ135": rng.randint(5000, 12000),
+        "Soil": rng.randint(20000, 60000),
+        "Rain": rng.randint(20000, 60000),
+    }
+
+
+# One station speaking the binary batch uplink, waiting for each ACK like the device does
+async def binary_station(index, args, counts, deadline):
+    rng = random.Random(index)
+    station_id = index + 1
+    boot = rng.randint(0, 65535)
+    interval = args.batch / args.rate if args.rate else 0
+    next_send = time.monotonic()
+    seq = 0
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        while time.monotonic() < deadline:
+            now_ms = int(time.monotonic() * 1000)
+            records = [encode_record(station_id, seq + i, now_ms, make_values(rng)) for i in range(args.batch)]
+            writer.write(encode_batch_header(station_id, boot, args.batch, now_ms) + b"".join(records))
+            await writer.drain()
+            await reader.readuntil(b'\n')
+            seq += args.batch
+            counts[index] += args.batch
+
+            if interval:
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.monotonic()))
+    except OSError as e:
+        print(f"Station {index}: {e}")
+    finally:
+        writer.close()
+
+
+# One simulated station; rate 0 sends as fast as the server accepts
+async def station(index, args, counts, deadline):
+    rng = random.Random(index)
+    interval = 1.0 / args.rate if args.rate else 0
+    next_send = time.monotonic()
+    writer = None
+    try:
+        while time.monotonic() < deadline:
+            payload = make_payload(rng).encode('utf-8')
+            if args.persistent:
+                if writer is None:
+                    _, writer = await asyncio.open_connection(args.host, args.port)
+                writer.write(payload + b'\n')
+                await writer.drain()
+            else:
+                # Same as the current firmware: one connection per reading, no newline
+                _, one_shot = await asyncio.open_connection(args.host, args.port)
+                one_shot.write(payload)
+                await one_shot.drain()
+                one_shot.close()
+                await one_shot.wait_closed()
+            counts[index] += 1
+
+            if interval:
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.monotonic()))
+            else:
+                await asyncio.sleep(0)
+    except OSError as e:
+        print(f"Station {index}: {e}")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run(args):
+    counts = [0] * args.stations
+    start = time.monotonic()
+    deadline = start + args.duration
+    run_station = binary_station if args.binary else station
+    await asyncio.gather(*(run_station(i, args, counts, deadline) for i in range(args.stations)))
+    elapsed = time.monotonic() - start
+    total = sum(counts)
+    print(f"Sent {total} readings from {args.stations} stations in {elapsed:.1f}s ({total / elapsed:.0f}/s)")
+    return total, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate sensor stations sending to the ingest server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--stations', type=int, default=10, help="number of simulated stations")
+    parser.add_argument('--rate', type=float, default=0.25, help="readings per second per station (0 = unthrottled)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to run")
+    parser.add_argument('--persistent', action='store_true', help="keep one connection per station open")
+    parser.add_argument('--binary', action='store_true', help="send acknowledged binary batches like the Pico 2W")
+    parser.add_argument('--batch', type=int, default=1, help="readings per binary batch")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
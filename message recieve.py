@@ -1,67 +1,41 @@
-import socket
-import pandas as pd
-from datetime import datetime
-
-# Function to process and save the received data
-def process_and_save_data(data):
-    # Decode data from bytes to string
-    data_str = data.decode('utf-8')
-
-    # Check if the data starts with 'UART:' and remove the prefix
-    if data_str.startswith("UART:"):
-        data_str = data_str[5:].strip()  # Remove the UART part and strip any extra spaces
-
-    # Split the data into individual sensor readings using commas
-    items = data_str.split(',')
-
-    # Dictionary to store the sensor data
-    sensor_data = {}
-    for item in items:
-        item = item.strip()  # Strip any leading/trailing spaces
-        try:
-            key, value = item.split(':', 1)  # Use a maximum of 1 split to handle cases with extra colons
-            sensor_data[key.strip()] = value.strip()  # Ensure no extra spaces are included
-        except ValueError:
-            print(f"Skipping invalid item: {item}")
-
-    # Print the sensor data for verification
-    print(sensor_data)
-
-    # Add the timestamp for when the data was received
-    sensor_data['Timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    # Save the data to an Excel file
+import asyncio
+import argparse
+import os
+from wal import DurableStore
+from ingest_server import IngestServer, ingest_metrics
+from event_bus import BusPublisher
+from metrics import profile_on_signal
+from replay import CaptureLog
+from cold_storage import Compactor, COMPACT_AFTER, EXPIRE_AFTER
+
+# Append-only store shared with the dashboard (app.py); every batch is made durable in a
+# write-ahead log before it is acknowledged, and the log is replayed here after a crash
+store = DurableStore("sensor_store")
+
+# Function to start the server and handle incoming connections from all stations; with
+# capture, every received frame is also recorded to that capture log (see replay.py).
+# A background thread compacts old segments and expires the oldest (see cold_storage.py).
+def start_server(capture=None, compact_after=COMPACT_AFTER, expire_after=EXPIRE_AFTER):
+    # Stored readings are pushed to the dashboard (app.py) over the event bus
+    # Metrics go next to the store for the dashboard's /metrics; kill -USR1 <pid> starts and
+    # stops a sampling profile of the receiver (collapsed stacks in receiver.profile)
+    server = IngestServer(store, host="0.0.0.0", port=8081, bus=BusPublisher(),  # Listen on port 8081
+                          metrics_path=os.path.join(store.path, "receiver.prom"),
+                          capture=CaptureLog(capture) if capture else None)
+    profile_on_signal(os.path.join(store.path, "receiver.profile"))
+    Compactor(store, compact_after, expire_after, registry=ingest_metrics).start()
     try:
-        # Attempt to read the existing data from the Excel file
-        df = pd.read_excel('sensor_data.xlsx')
-    except FileNotFoundError:
-        # If the file doesn't exist, create an empty DataFrame
-        df = pd.DataFrame()
-
-    # Append the new sensor data to the DataFrame using _append
-    df = df._append(sensor_data, ignore_index=True)
-
-    # Save the updated DataFrame back to the Excel file
-    df.to_excel('sensor_data.xlsx', index=False)
-    print(f"Data saved to Excel at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
-# Function to start the server and handle incoming connections
-def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(("0.0.0.0", 8081))  # Listen on port 8081
-    server_socket.listen(1)
-    print("Server is listening on port 8081...")
-
-    while True:
-        client_socket, client_address = server_socket.accept()
-        print(f"Connection established with {client_address}")
-        data = client_socket.recv(1024)
-        print(f"Received data: {data}")
-
-        # Process the received data
-        process_and_save_data(data)
-
-        client_socket.close()
+        asyncio.run(server.serve())
+    finally:
+        if server.capture is not None:
+            server.capture.close()
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Receive sensor readings from the stations")
+    parser.add_argument('--capture', help="also record every received frame to this capture log (.gz to compress)")
+    parser.add_argument('--compact-after', type=float, default=COMPACT_AFTER / 86400, help="days before full segments are compressed")
+    parser.add_argument('--expire-after', type=float, default=EXPIRE_AFTER / 86400, help="days before segments are deleted (0: never; hourly rollups are kept)")
+    args = parser.parse_args()
+    if args.expire_after and args.expire_after <= args.compact_after:
+        parser.error("--expire-after must be longer than --compact-after")
+    start_server(args.capture, args.compact_after * 86400, args.expire_after * 86400 or None)
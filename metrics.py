@@ -0,0 +1,293 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter as StackCounter
+
+# Low-overhead counters, gauges and latency histograms, rendered in the Prometheus text format.
+# Each process keeps its own Registry; processes without an HTTP server (the receiver, the
+# gunicorn updater) write theirs to a .prom file in the store directory every WRITE_INTERVAL
+# seconds and the dashboard's /metrics serves them together with its own.
+
+# Latency buckets in seconds: 50 µs to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Size buckets in bytes: 256 B to 16 MB
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Count buckets for rows per batch
+ROW_BUCKETS = (1, 4, 16, 64, 256, 1000, 4000, 16000)
+
+# Seconds between writes of a metrics file
+WRITE_INTERVAL = 5
+
+# Metrics files not written for this many seconds belong to a process that is gone and are not served
+STALE_AFTER = 60
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+# A value that goes up and down; with fn, read from fn() whenever the metrics are rendered
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, labels, fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.labels, self.fn() if self.fn else self.value
+
+
+# Times a block into a histogram: with histogram.time(): ...
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+# Fixed buckets; an observation is one bisect and three additions
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield self.name + "_bucket", dict(self.labels, le=_format_value(float(bound))), cumulative
+        yield self.name + "_sum", self.labels, total
+        yield self.name + "_count", self.labels, cumulative
+
+
+# The metrics of one process. Metrics sharing a name (with different labels) are rendered as one family.
+# labels are added to every sample, e.g. worker=<pid> for processes serving the same metrics.
+class Registry:
+    def __init__(self, **labels):
+        self.metrics = []
+        self.labels = labels
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, fn=None, **labels):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        families = {}
+        with self.lock:
+            for metric in self.metrics:
+                families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, members in families.items():
+            lines.append(f"# HELP {name} {members[0].help}")
+            lines.append(f"# TYPE {name} {members[0].kind}")
+            for metric in members:
+                for sample, labels, value in metric.samples():
+                    if self.labels:
+                        labels = dict(self.labels, **labels)
+                    lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    # Replace path with the current metrics (errors are ignored: metrics must never stop the caller)
+    def write(self, path):
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(self.render())
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    # Write the metrics to path every interval seconds from a daemon thread
+    def write_periodically(self, path, interval=WRITE_INTERVAL):
+        def run():
+            while True:
+                self.write(path)
+                time.sleep(interval)
+        threading.Thread(target=run, daemon=True).start()
+
+
+# Contents of the fresh .prom files in a directory (but exclude, if given), for appending to a /metrics response
+def read_metrics_files(directory, stale_after=STALE_AFTER, exclude=None):
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".prom") and name != exclude)
+    except OSError:
+        return ""
+    parts = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.path.getmtime(path) > stale_after:
+                continue
+            with open(path) as f:
+                parts.append(f.read())
+        except OSError:
+            continue
+    return "".join(parts)
+
+
+# Prometheus text made of several renders (e.g. one per worker) with each family's samples gathered
+# under a single HELP and TYPE, as the format allows a family only once
+def merge_families(text):
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            family = families.setdefault(line.split(" ", 3)[2], ({}, []))
+            family[0].setdefault(line[:6], line)
+        elif line and family is not None:
+            family[1].append(line)
+    return "".join("\n".join(list(headers.values()) + samples) + "\n" for headers, samples in families.values())
+
+
+# Statistical profiler: while running, a thread samples the stack of every other thread each
+# interval seconds. The result is in the collapsed format flamegraph.pl and speedscope read
+# ("outer;inner;innermost count" per line). Costs nothing while stopped.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    # Start sampling; False (and nothing changes) if it is already running
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.stacks.clear()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            return True
+
+    # Stop sampling; returns the collapsed stacks taken, before another start() can clear them
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return ""
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            return self.collapsed()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# Toggle a profiler with a signal (SIGUSR1 by default, where the platform has it): the first
+# signal starts it, the next stops it and writes the collapsed stacks to path
+def profile_on_signal(path, signum=None, interval=0.005):
+    import signal
+    signum = signum if signum is not None else getattr(signal, "SIGUSR1", None)
+    if signum is None:
+        return None
+    profiler = SamplingProfiler(interval)
+
+    def toggle(_signum, _frame):
+        if profiler.start():
+            print(f"Profiling started; send the signal again to write {path}")
+            return
+        collapsed = profiler.stop()
+        with open(path, "w") as f:
+            f.write(collapsed)
+        print(f"Wrote {profiler.samples} profile samples to {path}")
+
+    signal.signal(signum, toggle)
+    return profiler
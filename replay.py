@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import gzip
+import socket
+import struct
+import asyncio
+import argparse
+from sensor_store import normalise_reading
+from sensor_codec import encode_record, decode_record
+from ingest_server import IngestServer, BATCH_SIZE, ingest_metrics, parse_payload
+from event_bus import BusPublisher, parse_address
+from wal import DurableStore
+
+# Record and replay of raw receiver traffic.
+# Capture: the receiver (message recieve.py --capture traffic.cap.gz) appends every frame it takes
+# off the queue, with its arrival time and station, to a capture log. Replay feeds a log back:
+#   - into the ingest path (IngestServer.write_batch: parse, step-hold, write-ahead log, store)
+#     of a fresh store, with the recorded timestamps, publishing on an event bus so a dashboard
+#     started on that store sees it as live traffic: hazard rules, trends and /data behave as they
+#     did in the field, so threshold changes can be checked against a real week in minutes
+#   - or over TCP to a running receiver (--tcp), one connection per station, for load tests
+# --speed is the acceleration (1 = real time, 1000 = a week in 10 minutes, 0 = as fast as possible);
+# --copies replays every station that many times under different ids.
+# Example: python replay.py traffic.cap.gz --store replay_store --speed 1000
+#          python app.py --store replay_store --bus /tmp/hazard_replay.sock
+#          python replay.py traffic.cap.gz --tcp 127.0.0.1:8081 --speed 0 --copies 20
+
+# First bytes of a capture log
+CAPTURE_MAGIC = b"HZCAP1\n"
+
+# Per record: arrival timestamp f64 | station u16 | kind u8 | payload length u16, then the payload
+RECORD_HEADER = struct.Struct("<dHBH")
+
+# Payload kinds: a text frame as received, or a binary record (sensor_codec.py)
+TEXT = 0
+BINARY = 1
+
+# Records due within this many seconds of each other are written as one batch
+TICK = 0.01
+
+# Seconds between flushes of a capture log, bounding what a receiver crash loses
+FLUSH_INTERVAL = 1
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+# Station id distance between the copies of a station (--copies)
+COPY_STRIDE = 1000
+
+# Event bus the replay publishes on by default, apart from the live receiver's
+if hasattr(socket, "AF_UNIX"):
+    REPLAY_BUS_ADDRESS = "/tmp/hazard_replay.sock"
+else:
+    REPLAY_BUS_ADDRESS = ("127.0.0.1", 8083)
+
+
+# Appends receiver queue items (arrival, payload, station, done) to a capture log; a path ending in
+# .gz is gzip compressed. Binary records arrive decoded and are stored re-encoded (34 bytes).
+# A log left behind by a crash is cut back to its last complete record before appending.
+class CaptureLog:
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            self._repair()
+        self.file = gzip.open(path, "ab") if path.endswith(".gz") else open(path, "ab")
+        if new:
+            self.file.write(CAPTURE_MAGIC)
+        self.records = 0
+        self.flushed = time.monotonic()
+
+    def write(self, batch):
+        parts = []
+        for arrival, payload, station, _ in batch:
+            if isinstance(payload, dict):
+                kind, data = BINARY, encode_record(station, 0, 0, payload)
+            else:
+                kind, data = TEXT, payload
+            parts.append(RECORD_HEADER.pack(arrival, station, kind, len(data)))
+            parts.append(data)
+        self.file.write(b"".join(parts))
+        self.records += len(batch)
+        if time.monotonic() - self.flushed >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.flushed = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+    # A compressed log that was not closed lacks the end of its gzip stream, and reading stops
+    # there: anything appended after it would never be read. Rewrite such a log (or truncate a plain
+    # one) to its complete records.
+    def _repair(self):
+        length, intact = _complete_length(self.path)
+        if intact:
+            return
+        print(f"Capture log {self.path} was not closed cleanly; keeping its first {length} bytes of records")
+        if not self.path.endswith(".gz"):
+            os.truncate(self.path, length)
+            return
+        with gzip.open(self.path, "rb") as source, gzip.open(self.path + ".tmp", "wb") as target:
+            while length > 0:
+                chunk = source.read(min(length, 1 << 20))
+                target.write(chunk)
+                length -= len(chunk)
+        os.replace(self.path + ".tmp", self.path)
+
+
+# Length (uncompressed, with the magic) of the complete records at the start of a capture log,
+# and whether that is the whole log
+def _complete_length(path):
+    with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture log")
+        length = len(CAPTURE_MAGIC)
+        try:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return length, True
+                if len(header) < RECORD_HEADER.size:
+                    return length, False
+                size = RECORD_HEADER.unpack(header)[3]
+                if len(f.read(size)) < size:
+                    return length, False
+                length += RECORD_HEADER.size + size
+        except EOFError:
+            return length, False
+
+
+# (timestamp, station, payload) for every record of a capture log, payload being the text frame
+# (bytes) or the decoded binary record (dict) as the receiver's batch writer gets them. A log cut
+# short by a crash ends at its last complete record.
+def read_capture(path):
+    with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture log")
+        while True:
+            try:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                timestamp, station, kind, length = RECORD_HEADER.unpack(header)
+                data = f.read(length)
+            except EOFError:
+                return  # Torn gzip member
+            if len(data) < length:
+                return
+            yield timestamp, station, decode_record(data)[3] if kind == BINARY else data
+
+
+# Values of a text payload, as the receiver would parse them
+def text_values(payload):
+    return normalise_reading(parse_payload(payload.decode('utf-8', 'replace')))
+
+
+# Every record copies times, copy k under station id station + k * COPY_STRIDE. Copies after the
+# first carry decoded values, so a "Station:" field in a text payload does not undo the renumbering.
+def multiply(records, copies):
+    for timestamp, station, payload in records:
+        yield timestamp, station, payload
+        if copies > 1:
+            values = payload if isinstance(payload, dict) else text_values(payload)
+            for k in range(1, copies):
+                yield timestamp, station + k * COPY_STRIDE, values
+
+
+# Shift record timestamps by offset seconds
+def shifted(records, offset):
+    for timestamp, station, payload in records:
+        yield timestamp + offset, station, payload
+
+
+# Batches of records as (seconds after the start they are due, [records]); records due within
+# tick of the first of a batch go together. speed 0 makes everything due at once.
+def schedule(records, speed, batch_size=BATCH_SIZE, tick=TICK):
+    first = None
+    batch = []
+    batch_due = 0
+    for record in records:
+        if first is None:
+            first = record[0]
+        due = (record[0] - first) / speed if speed else 0
+        if batch and (due - batch_due > tick or len(batch) >= batch_size):
+            yield batch_due, batch
+            batch = []
+        if not batch:
+            batch_due = due
+        batch.append(record)
+    if batch:
+        yield batch_due, batch
+
+
+# Running totals and periodic progress lines
+class Progress:
+    def __init__(self, speed):
+        self.speed = speed
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.records = 0
+        self.first = None
+        self.last = None
+
+    def add(self, batch):
+        self.records += len(batch)
+        if self.first is None:
+            self.first = batch[0][0]
+        self.last = batch[-1][0]
+        now = time.perf_counter()
+        if now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            print(f"Replayed {self.records} readings, {self.span() / 3600:.1f} h of traffic in {now - self.started:.0f} s "
+                  f"({self.span() / (now - self.started):.0f}x, {self.records / (now - self.started):.0f} readings/s)")
+
+    def span(self):
+        return (self.last - self.first) if self.first is not None else 0
+
+    def result(self, mode):
+        elapsed = time.perf_counter() - self.started
+        return {"mode": mode, "speed": self.speed, "readings": self.records, "span_s": round(self.span(), 1),
+                "elapsed_s": round(elapsed, 2), "speedup": round(self.span() / elapsed, 1) if elapsed else None,
+                "readings_per_s": round(self.records / elapsed, 1) if elapsed else None}
+
+
+# Replay into a fresh store through the receiver's write path, publishing on the event bus
+def replay_store(records, path, speed, bus_address):
+    store = DurableStore(path)
+    if store.next_seq() > 0:
+        raise SystemExit(f"{path} already holds readings; replay into an empty store directory")
+    bus = BusPublisher(bus_address) if bus_address else None
+    server = IngestServer(store, bus=bus)
+    ingest_metrics.write_periodically(os.path.join(path, "receiver.prom"))
+    progress = Progress(speed)
+    started = time.perf_counter()
+    try:
+        for due, batch in schedule(records, speed):
+            wait = started + due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            server.write_batch([(timestamp, payload, station, None) for timestamp, station, payload in batch])
+            progress.add(batch)
+    finally:
+        store.close()
+        if bus is not None:
+            bus.close()
+    return progress.result("store")
+
+
+# Replay over TCP to a running receiver: one connection per station, binary records
+async def replay_tcp(records, host, port, speed):
+    connections = {}
+    progress = Progress(speed)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    seq = 0
+    try:
+        for due, batch in schedule(records, speed):
+            wait = started + due - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            frames = {}
+            for timestamp, station, payload in batch:
+                values = payload if isinstance(payload, dict) else text_values(payload)
+                frames.setdefault(station, []).append(encode_record(station, seq, 0, values))
+                seq += 1
+            for station, station_frames in frames.items():
+                if station not in connections:
+                    connections[station] = (await asyncio.open_connection(host, port))[1]
+                connections[station].write(b"".join(station_frames))
+            await asyncio.gather(*(connections[station].drain() for station in frames))
+            progress.add(batch)
+    finally:
+        for writer in connections.values():
+            writer.close()
+    return progress.result("tcp")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a receiver capture log, in real time or accelerated")
+    parser.add_argument('capture', help="capture log written by message recieve.py --capture")
+    parser.add_argument('--speed', type=float, default=1000, help="acceleration: 1 = real time, 0 = as fast as possible")
+    parser.add_argument('--store', default='replay_store', help="empty store directory to replay into")
+    parser.add_argument('--bus', default=None, help="event bus socket path or host:port to publish on (default: a replay bus)")
+    parser.add_argument('--no-bus', action='store_true', help="do not publish on an event bus")
+    parser.add_argument('--tcp', help="send to a running receiver at host:port instead")
+    parser.add_argument('--copies', type=int, default=1, help=f"replay every station this many times (ids {COPY_STRIDE} apart)")
+    parser.add_argument('--shift-to-now', action='store_true', help="shift timestamps so the log ends now")
+    parser.add_argument('--limit', type=int, help="replay at most this many records")
+    args = parser.parse_args()
+
+    if args.speed < 0:
+        parser.error("--speed must be 0 or more")
+    records = read_capture(args.capture)
+    if args.shift_to_now:
+        last = None
+        for last, _, _ in read_capture(args.capture):
+            pass
+        if last is not None:
+            records = shifted(records, time.time() - last)
+    if args.limit:
+        records = (record for _, record in zip(range(args.limit), records))
+    records = multiply(records, args.copies)
+
+    if args.tcp:
+        address = parse_address(args.tcp)
+        if not isinstance(address, tuple):
+            parser.error("--tcp must be host:port")
+        result = asyncio.run(replay_tcp(records, *address, args.speed))
+    else:
+        bus = None if args.no_bus else (parse_address(args.bus) if args.bus else REPLAY_BUS_ADDRESS)
+        result = replay_store(records, args.store, args.speed, bus)
+    print(json.dumps(result))
@@ -0,0 +1,168 @@
+import struct
+
+# Binary wire format for sensor records, shared by the Pico (UART), the Pico 2W (UART and
+# TCP uplink) and the server. Only struct and plain bytes are used so the same file runs on
+# MicroPython, CircuitPython and CPython; copy it next to the code on both boards.
+#
+# Record frame (34 bytes, little-endian):
+#   magic "\xa5\x5a" | version u8 | body length u8 | body | crc16 u16 (over version..body)
+# Body (version 1):
+#   station u16 | seq u32 | t_ms u32 (device clock) | present u16 (bit i set = FIELDS[i] valid)
+#   | MQ7 u16 | Flame u16 | Temp i16 (0.1 C) | Humidity u16 (0.1 %) | Water_Level u16 (mm)
+#   | Soil u16 | Rain u16 | MQ135 u16
+# Batch frame (TCP uplink): batch header followed by <count> record frames
+#   magic "\xa5\x5b" | version u8 | station u16 | boot u16 | count u16 | now_ms u32 | crc16 u16
+
+VERSION = 1
+RECORD_MAGIC = b"\xa5\x5a"
+BATCH_MAGIC = b"\xa5\x5b"
+
+FIELDS = ("MQ7", "Flame", "Temp", "Humidity", "Water_Level", "Soil", "Rain", "MQ135")
+SCALES = (1, 1, 10, 10, 1, 1, 1, 1)
+
+HEAD_FORMAT = "<2sBB"
+BODY_FORMAT = "<HIIHHHhHHHHH"
+BODY_SIZE = struct.calcsize(BODY_FORMAT)
+RECORD_FORMAT = "<2sBBHIIHHHhHHHHHH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+BATCH_HEADER_FORMAT = "<2sBHHHIH"
+BATCH_HEADER_SIZE = struct.calcsize(BATCH_HEADER_FORMAT)
+
+# CPython has CRC-16/CCITT in C; the boards fall back to the bitwise version below
+try:
+    from binascii import crc_hqx
+except ImportError:
+    crc_hqx = None
+
+
+# CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)
+def crc16(data, crc=0xFFFF):
+    if crc_hqx is not None:
+        return crc_hqx(data, crc)
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+# Encode one reading; values maps FIELDS names to numbers, missing or None fields are left out
+def encode_record(station, seq, t_ms, values):
+    present = 0
+    slots = []
+    for i, field in enumerate(FIELDS):
+        value = values.get(field)
+        if value is None:
+            slots.append(0)
+            continue
+        present |= 1 << i
+        value = int(round(value * SCALES[i]))
+        if field == "Temp":
+            value = min(max(value, -32768), 32767)
+        else:
+            value = min(max(value, 0), 65535)
+        slots.append(value)
+
+    body = struct.pack(BODY_FORMAT, station & 0xFFFF, seq & 0xFFFFFFFF, t_ms & 0xFFFFFFFF, present, *slots)
+    head = struct.pack(HEAD_FORMAT, RECORD_MAGIC, VERSION, BODY_SIZE)
+    crc = crc16(body, crc16(head[2:]))
+    return head + body + struct.pack("<H", crc)
+
+
+def _values(present, slots):
+    values = {}
+    for i, field in enumerate(FIELDS):
+        if present & (1 << i):
+            values[field] = slots[i] / SCALES[i] if SCALES[i] != 1 else slots[i]
+    return values
+
+
+# Decode one record frame to (station, seq, t_ms, values); raises ValueError if it is corrupt
+def decode_record(frame):
+    magic, version, length = struct.unpack_from(HEAD_FORMAT, frame, 0)
+    if magic != RECORD_MAGIC or length < BODY_SIZE or len(frame) != 4 + length + 2:
+        raise ValueError("bad record header")
+    crc = struct.unpack_from("<H", frame, 4 + length)[0]
+    if crc16(frame[2:4 + length]) != crc:
+        raise ValueError("bad record crc")
+    # Newer versions may append fields; the version 1 prefix is always readable
+    fields = struct.unpack_from(BODY_FORMAT, frame, 4)
+    station, seq, t_ms, present = fields[:4]
+    return station, seq, t_ms, _values(present, fields[4:])
+
+
+# Batch header for count records that follow it
+def encode_batch_header(station, boot, count, now_ms):
+    header = struct.pack(BATCH_HEADER_FORMAT, BATCH_MAGIC, VERSION, station & 0xFFFF, boot & 0xFFFF, count, now_ms & 0xFFFFFFFF, 0)
+    crc = crc16(header[2:-2])
+    return header[:-2] + struct.pack("<H", crc)
+
+
+# Decode a batch header to (station, boot, count, now_ms); raises ValueError if it is corrupt
+def decode_batch_header(header):
+    magic, version, station, boot, count, now_ms, crc = struct.unpack(BATCH_HEADER_FORMAT, header)
+    if magic != BATCH_MAGIC or version != VERSION:
+        raise ValueError("bad batch header")
+    if crc16(header[2:-2]) != crc:
+        raise ValueError("bad batch crc")
+    return station, boot, count, now_ms
+
+
+# Decode a block of fixed-size version 1 records in one pass (CPython only: uses iter_unpack)
+def decode_records(block):
+    if len(block) % RECORD_SIZE:
+        raise ValueError("truncated record block")
+    view = memoryview(block)
+    records = []
+    for i, row in enumerate(struct.iter_unpack(RECORD_FORMAT, block)):
+        offset = i * RECORD_SIZE
+        if row[0] != RECORD_MAGIC or row[1] != VERSION or row[2] != BODY_SIZE:
+            raise ValueError("bad record header")
+        if crc16(view[offset + 2:offset + RECORD_SIZE - 2]) != row[-1]:
+            raise ValueError("bad record crc")
+        records.append((row[3], row[4], row[5], _values(row[6], row[7:-1])))
+    return records
+
+
+# Reassemble record frames from a byte stream (UART) that may split or corrupt frames
+class FrameReader:
+    def __init__(self, max_buffer=512):
+        self.buf = b""
+        self.max_buffer = max_buffer
+        self.errors = 0
+
+    # Add received bytes and return the records completed by them
+    def feed(self, data):
+        self.buf = self.buf + bytes(data)
+        records = []
+        while True:
+            start = self.buf.find(RECORD_MAGIC)
+            if start < 0:
+                # Keep the last byte in case it is the first half of a magic
+                self.buf = self.buf[-1:]
+                break
+            if len(self.buf) - start < 4:
+                self.buf = self.buf[start:]
+                break
+            length = self.buf[start + 3]
+            end = start + 4 + length + 2
+            if length < BODY_SIZE:
+                self.errors += 1
+                self.buf = self.buf[start + 1:]
+                continue
+            if len(self.buf) < end:
+                self.buf = self.buf[start:]
+                break
+            try:
+                records.append(decode_record(self.buf[start:end]))
+                self.buf = self.buf[end:]
+            except ValueError:
+                # Resynchronise on the next magic
+                self.errors += 1
+                self.buf = self.buf[start + 1:]
+        if len(self.buf) > self.max_buffer:
+            self.buf = self.buf[-self.max_buffer:]
+        return records
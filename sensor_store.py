@@ -0,0 +1,376 @@
+import os
+import re
+import math
+import mmap
+import struct
+import time
+from collections import namedtuple
+
+# Sensor columns kept by the store, in the order the dashboard uses them
+SENSOR_FIELDS = ("MQ7", "Flame", "Temp", "Humidity", "Water_Level", "Soil", "Rain", "MQ135")
+
+# Payload keys sent by the Pico 2W (including the ones forwarded from the Pico over UART)
+FIELD_ALIASES = {
+    "MQ7": "MQ7",
+    "Flame": "Flame",
+    "Temp": "Temp",
+    "Humidity": "Humidity",
+    "Water Level": "Water_Level",
+    "Water_Level": "Water_Level",
+    "Soil": "Soil",
+    "Rain": "Rain",
+    "MQ-135": "MQ135",
+    "MQ135": "MQ135",
+}
+
+# One stored reading; missing sensor values are NaN
+Reading = namedtuple("Reading", ("seq", "timestamp", "station") + SENSOR_FIELDS)
+
+# Fixed-width row: seq (u64), epoch timestamp (f64), station (u16), one f64 per sensor
+ROW = struct.Struct("<QdH" + "d" * len(SENSOR_FIELDS))
+ROW_SIZE = ROW.size
+TIMESTAMP_OFFSET = 8
+
+# Rows per segment file; seq N always lives in segment N // SEGMENT_ROWS
+SEGMENT_ROWS = 65536
+
+# Rows are stored in arrival order, but buffered uplink batches carry older sample times.
+# A row may be at most this many seconds older than the newest row before it (older ones
+# are clamped), which keeps binary-searched range scans exact.
+MAX_LATENESS = 3600
+
+NUMBER_PATTERN = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+# Convert a raw sensor value ("80 mm", "31.0", "N/A", 123, None) to a float, NaN if missing
+def to_number(value):
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_PATTERN.search(str(value))
+    return float(match.group()) if match else math.nan
+
+
+# Map a parsed payload dict onto the store columns
+def normalise_reading(raw):
+    values = {}
+    for key, value in raw.items():
+        field = FIELD_ALIASES.get(key.strip())
+        if field is not None:
+            values[field] = to_number(value)
+    return values
+
+
+# Return None for missing (NaN) values so readings can be JSON encoded
+def value_or_none(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+# Interface every storage backend implements
+class StorageBackend:
+    # Append one reading (dict keyed by SENSOR_FIELDS) and return the stored Reading
+    def append(self, values, timestamp=None, station=0):
+        raise NotImplementedError
+
+    # Append a list of (values, timestamp, station) rows and return the stored Readings
+    def append_many(self, rows):
+        return [self.append(values, timestamp, station) for values, timestamp, station in rows]
+
+    # Most recent Reading, or None when the store is empty
+    def latest(self):
+        raise NotImplementedError
+
+    # Iterate Readings with start <= timestamp <= end in arrival order
+    def scan(self, start=None, end=None):
+        raise NotImplementedError
+
+    # Iterate Readings with seq >= the given seq in seq order
+    def since(self, seq):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# Append-only store made of fixed-width binary segment files
+class SegmentStore(StorageBackend):
+    def __init__(self, path="sensor_store", segment_rows=SEGMENT_ROWS, readonly=False):
+        self.path = path
+        self.segment_rows = segment_rows
+        self.readonly = readonly
+        self._file = None
+        self._latest = None
+        self._max_timestamp = -math.inf
+
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+
+        segments = self.segments()
+        self._segment_index = segments[-1] if segments else 0
+        self._rows_in_segment = self._row_count(self._segment_index)
+
+        if not readonly:
+            self._open_writer()
+            self._load_latest()
+
+    # Latest row and the newest timestamp near it, after opening or truncating
+    def _load_latest(self):
+        self._latest = self._read_last()
+        self._max_timestamp = -math.inf
+        if self._latest is not None:
+            self._max_timestamp = max(reading.timestamp for reading in self.scan(self._latest.timestamp - MAX_LATENESS))
+
+    def _segment_path(self, index):
+        return os.path.join(self.path, f"seg-{index:08d}.bin")
+
+    # Compressed block a closed segment is compacted into (cold_storage.py)
+    def _block_path(self, index):
+        return os.path.join(self.path, f"blk-{index:08d}.bin")
+
+    # Sorted segment indexes present on disk, raw or compacted
+    def segments(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted({int(name[4:-4]) for name in names
+                       if (name.startswith("seg-") or name.startswith("blk-")) and name.endswith(".bin")})
+
+    # Rows of a compacted segment (a numpy array of hazard_engine.ROW_DTYPE), or None if there is none
+    def _read_block(self, index):
+        from cold_storage import read_block
+        try:
+            return read_block(self._block_path(index))
+        except FileNotFoundError:
+            return None
+
+    def _row_count(self, index):
+        try:
+            return os.path.getsize(self._segment_path(index)) // ROW_SIZE
+        except FileNotFoundError:
+            pass
+        from cold_storage import block_info
+        try:
+            return block_info(self._block_path(index))[0]
+        except FileNotFoundError:
+            return 0
+
+    def _open_writer(self):
+        path = self._segment_path(self._segment_index)
+        # Drop a partially written row left behind by a crash
+        if os.path.exists(path):
+            size = self._rows_in_segment * ROW_SIZE
+            if os.path.getsize(path) != size:
+                os.truncate(path, size)
+        # Unbuffered so readers in other processes see every row as soon as it is written
+        self._file = open(path, "ab", buffering=0)
+
+    def _read_row(self, index, row):
+        try:
+            with open(self._segment_path(index), "rb") as f:
+                f.seek(row * ROW_SIZE)
+                return Reading(*ROW.unpack(f.read(ROW_SIZE)))
+        except FileNotFoundError:
+            return Reading(*self._read_block(index)[row].tolist())
+
+    def _read_last(self):
+        if self._rows_in_segment:
+            return self._read_row(self._segment_index, self._rows_in_segment - 1)
+        previous = [index for index in self.segments() if index < self._segment_index]
+        if previous and self._row_count(previous[-1]):
+            return self._read_row(previous[-1], self._row_count(previous[-1]) - 1)
+        return None
+
+    # Pick up rows (and new segments) written by another process
+    def _refresh(self):
+        while True:
+            self._rows_in_segment = self._row_count(self._segment_index)
+            if self._rows_in_segment < self.segment_rows:
+                break
+            if not os.path.exists(self._segment_path(self._segment_index + 1)):
+                break
+            self._segment_index += 1
+
+    # Sequence number the next appended reading will get
+    def next_seq(self):
+        if self.readonly:
+            self._refresh()
+        return self._segment_index * self.segment_rows + self._rows_in_segment
+
+    def _roll_segment(self):
+        # A full segment is never written again; make it durable before moving on
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment_index += 1
+        self._rows_in_segment = 0
+        self._open_writer()
+
+    def append(self, values, timestamp=None, station=0):
+        return self.append_many([(values, timestamp, station)])[0]
+
+    # Append a batch of (values, timestamp, station) rows with one write per segment
+    def append_many(self, rows):
+        return self.write_readings(self.make_readings(rows))
+
+    # Number a batch of (values, timestamp, station) rows as the next Readings, without writing them.
+    # They must be passed to write_readings before any other rows are made.
+    def make_readings(self, rows):
+        if self.readonly:
+            raise IOError("store is opened read-only")
+
+        readings = []
+        seq = self.next_seq()
+        for values, timestamp, station in rows:
+            timestamp = time.time() if timestamp is None else max(timestamp, self._max_timestamp - MAX_LATENESS)
+            self._max_timestamp = max(self._max_timestamp, timestamp)
+            row = [values.get(field, math.nan) for field in SENSOR_FIELDS]
+            readings.append(Reading(seq, timestamp, station, *row))
+            seq += 1
+        return readings
+
+    # Write Readings that continue the store (from make_readings, or replayed from a log)
+    def write_readings(self, readings):
+        if self.readonly:
+            raise IOError("store is opened read-only")
+
+        chunk = bytearray()
+        for reading in readings:
+            if self._rows_in_segment >= self.segment_rows:
+                self._file.write(chunk)
+                chunk = bytearray()
+                self._roll_segment()
+            if reading.seq != self.next_seq():
+                raise ValueError(f"reading {reading.seq} does not continue the store at {self.next_seq()}")
+            chunk += ROW.pack(*reading)
+            self._rows_in_segment += 1
+
+        if chunk:
+            self._file.write(chunk)
+        if readings:
+            self._latest = readings[-1]
+        return readings
+
+    # Flush the open segment to disk
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    # Drop every row with seq >= the given seq
+    def truncate(self, seq):
+        if self.readonly:
+            raise IOError("store is opened read-only")
+        index, row = divmod(seq, self.segment_rows)
+        self._file.close()
+        for later in self.segments():
+            if later > index:
+                for path in (self._segment_path(later), self._block_path(later)):
+                    if os.path.exists(path):
+                        os.remove(path)
+        if os.path.exists(self._segment_path(index)):
+            os.truncate(self._segment_path(index), min(os.path.getsize(self._segment_path(index)), row * ROW_SIZE))
+        self._segment_index = index
+        self._rows_in_segment = self._row_count(index)
+        self._open_writer()
+        self._load_latest()
+
+    def latest(self):
+        if not self.readonly:
+            return self._latest
+        self._refresh()
+        return self._read_last()
+
+    def scan(self, start=None, end=None):
+        for index in self.segments():
+            try:
+                f = open(self._segment_path(index), "rb")
+            except FileNotFoundError:
+                # Compacted: decode the block and search its timestamp column
+                block = self._read_block(index)
+                if block is None or len(block) == 0:
+                    continue
+                timestamps = block["timestamp"]
+                if start is not None and timestamps[-1] < start - MAX_LATENESS:
+                    continue
+                if end is not None and timestamps[0] > end + MAX_LATENESS:
+                    return
+                row = int(timestamps.searchsorted(start - MAX_LATENESS)) if start is not None else 0
+                if (yield from self._in_range(map(Reading._make, block[row:].tolist()), start, end)):
+                    return
+                continue
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                rows = size // ROW_SIZE
+                if rows == 0:
+                    continue
+                with mmap.mmap(f.fileno(), rows * ROW_SIZE, access=mmap.ACCESS_READ) as mm:
+                    if start is not None and self._timestamp_at(mm, rows - 1) < start - MAX_LATENESS:
+                        continue
+                    if end is not None and self._timestamp_at(mm, 0) > end + MAX_LATENESS:
+                        return
+                    row = self._first_row_at_or_after(mm, rows, start - MAX_LATENESS) if start is not None else 0
+                    readings = (Reading(*ROW.unpack_from(mm, offset)) for offset in range(row * ROW_SIZE, rows * ROW_SIZE, ROW_SIZE))
+                    if (yield from self._in_range(readings, start, end)):
+                        return
+
+    # Yield the readings within [start, end]; returns True once one is past end + MAX_LATENESS,
+    # after which no later reading can be in range
+    @staticmethod
+    def _in_range(readings, start, end):
+        for reading in readings:
+            if end is not None and reading.timestamp > end:
+                if reading.timestamp > end + MAX_LATENESS:
+                    return True
+                continue
+            if start is not None and reading.timestamp < start:
+                continue
+            yield reading
+        return False
+
+    # Iterate Readings with seq >= the given seq; seq N sits at a fixed offset, so no search is needed
+    def since(self, seq):
+        end = self.next_seq()
+        seq = max(seq, 0)
+        while seq < end:
+            index, row = divmod(seq, self.segment_rows)
+            try:
+                f = open(self._segment_path(index), "rb")
+            except FileNotFoundError:
+                # Compacted, or removed (or never written), in which case continue with the next one
+                block = self._read_block(index)
+                if block is not None:
+                    for values in block[row:end - index * self.segment_rows].tolist():
+                        yield Reading(*values)
+                seq = (index + 1) * self.segment_rows
+                continue
+            with f:
+                rows = min(os.fstat(f.fileno()).st_size // ROW_SIZE, end - index * self.segment_rows)
+                if row >= rows:
+                    seq = (index + 1) * self.segment_rows
+                    continue
+                with mmap.mmap(f.fileno(), rows * ROW_SIZE, access=mmap.ACCESS_READ) as mm:
+                    for offset in range(row * ROW_SIZE, rows * ROW_SIZE, ROW_SIZE):
+                        yield Reading(*ROW.unpack_from(mm, offset))
+            seq = index * self.segment_rows + rows
+
+    @staticmethod
+    def _timestamp_at(mm, row):
+        return struct.unpack_from("<d", mm, row * ROW_SIZE + TIMESTAMP_OFFSET)[0]
+
+    # Binary search on the timestamp column (sorted to within MAX_LATENESS)
+    def _first_row_at_or_after(self, mm, rows, timestamp):
+        low, high = 0, rows
+        while low < high:
+            mid = (low + high) // 2
+            if self._timestamp_at(mm, mid) < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,99 @@
+import json
+import struct
+from array import array
+from multiprocessing import shared_memory
+from history import SeqLock, local_array
+
+# Bytes reserved for the JSON state snapshot (latest values, hazard status)
+SNAPSHOT_SIZE = 256 * 1024
+
+# Every array in the arena starts on a multiple of this many bytes
+ALIGNMENT = 8
+
+
+# Bytes needed by the arrays a layout function allocates. layout(allocate) builds the
+# structures; here they get throwaway one-item arrays and only the sizes are added up.
+def arena_size(layout):
+    total = 0
+
+    def allocate(typecode, n, fill):
+        nonlocal total
+        total += -(-n * struct.calcsize(typecode) // ALIGNMENT) * ALIGNMENT
+        return local_array(typecode, 1, fill)
+
+    layout(allocate)
+    return total
+
+
+# Typed arrays carved out of one shared memory block. Calling the same layout function with
+# allocate in every process gives each of them views of the same bytes: the process that
+# created the block (create=True) fills the arrays, processes attaching by name only map them.
+# Processes forked after the block was set up inherit the mapping and need not attach at all.
+class SharedArena:
+    def __init__(self, size=0, name=None, create=True):
+        self.created = create
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.offset = 0
+        self.views = []
+
+    @classmethod
+    def for_layout(cls, layout, name=None):
+        return cls(arena_size(layout), name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def allocate(self, typecode, n, fill):
+        size = n * struct.calcsize(typecode)
+        if self.offset + size > self.shm.size:
+            raise ValueError("shared memory block is smaller than the layout")
+        view = self.shm.buf[self.offset:self.offset + size].cast(typecode)
+        if self.created:
+            view[:] = array(typecode, [fill]) * n
+        self.offset += -(-size // ALIGNMENT) * ALIGNMENT
+        self.views.append(view)
+        return view
+
+    # Unmap the block in this process; the structures built on it must not be used afterwards
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.shm.close()
+
+    # Remove the block (creator only, at shutdown); processes still mapping it keep working
+    def unlink(self):
+        if self.created:
+            self.shm.unlink()
+
+
+# The latest state dict (sensor_data) published by the one writer and read by everyone else.
+# Stored as JSON under a seqlock; readers decode it again only when the version changed.
+class StateSnapshot:
+    def __init__(self, size=SNAPSHOT_SIZE, allocate=local_array):
+        self.header = allocate('q', 2, 0)  # Seqlock counter, length of the JSON body
+        self.seqlock = SeqLock(self.header)
+        self.data = allocate('B', size, 0)
+        self.cached = (0, {})
+
+    # Changes every time a new state is published
+    def version(self):
+        return self.header[0]
+
+    def publish(self, state):
+        body = json.dumps(state, separators=(',', ':')).encode('utf-8')
+        if len(body) > len(self.data):
+            raise ValueError(f"state snapshot of {len(body)} bytes does not fit in {len(self.data)}")
+        with self.seqlock:
+            memoryview(self.data)[:len(body)] = body
+            self.header[1] = len(body)
+
+    def read(self):
+        version, state = self.cached
+        if version == self.header[0]:
+            return state
+        version, body = self.seqlock.read(lambda: (self.header[0], bytes(memoryview(self.data)[:self.header[1]])))
+        state = json.loads(body) if body else {}
+        self.cached = (version, state)
+        return state
@@ -0,0 +1,229 @@
+import heapq
+import math
+import time
+import threading
+from history import RingHistory, Rollups, local_array
+from sensor_store import SENSOR_FIELDS, value_or_none
+
+# Rows kept in memory per station (hundreds of stations share one process, so this is small)
+STATION_HISTORY_CAPACITY = 500
+
+# Per-station rollups as (bucket seconds, buckets kept): 1 min for 3 hours, used by fleet top-N queries
+STATION_ROLLUP_TIERS = ((60, 3 * 60),)
+
+# Longest window top() answers: as far back as every station's minute rollups reach
+MAX_TOP_WINDOW = STATION_ROLLUP_TIERS[0][0] * (STATION_ROLLUP_TIERS[0][1] - 1)
+
+
+# One station: its own history shard, minute rollups and the time each hazard turned on
+class Station:
+    def __init__(self, station_id, hazard_names, capacity=STATION_HISTORY_CAPACITY, allocate=local_array):
+        self.id = station_id
+        self.hazard_names = hazard_names
+        self.history = RingHistory(capacity, allocate=allocate)
+        self.rollups = Rollups(STATION_ROLLUP_TIERS, allocate=allocate)
+        # Per hazard: time it turned on, NaN while it is off
+        self.hazard_since = allocate('d', len(hazard_names), math.nan)
+
+    def add(self, reading):
+        if not self.history.append(reading):
+            return False
+        self.rollups.add(reading)
+        return True
+
+    # {hazard: time it turned on} for the hazards currently on
+    @property
+    def hazards(self):
+        return {name: since for name, since in zip(self.hazard_names, self.hazard_since) if since == since}
+
+    def latest_values(self):
+        row = self.history.last_row()
+        if row is None:
+            return {}
+        return {field: value_or_none(row[field]) for field in SENSOR_FIELDS}
+
+    # Largest value of field seen since start, from the minute rollups (NaN if none)
+    def max_since(self, field, start):
+        return self.rollups.tiers[0].max_since(field, start)
+
+    def summary(self):
+        row = self.history.last_row()
+        return {
+            "id": self.id,
+            "last_seen": row["timestamp"] if row else None,
+            "readings": self.history.appended,
+            "latest_values": {field: value_or_none(row[field]) for field in SENSOR_FIELDS} if row else {},
+            "hazards": sorted(self.hazards),
+        }
+
+
+# Every station seen so far, with in-memory indexes for fleet queries: stations by id (latest
+# values, history shard, rollups), per station which hazards are on and since when, and per
+# hazard how many and which stations have it, so fleet queries do not visit every station.
+# With max_stations, all stations are allocated up front (e.g. in shared memory) and a slot
+# table maps slots to station ids; without it stations are created as they first report.
+# Stations reporting once the pool is full get no history shard, but their hazard state is
+# still tracked, counted in the fleet status and alerted on.
+class StationRegistry:
+    def __init__(self, hazard_names, capacity=STATION_HISTORY_CAPACITY, allocate=local_array, max_stations=None):
+        self.hazard_names = list(hazard_names)
+        self.hazard_index = {name: k for k, name in enumerate(self.hazard_names)}
+        self.capacity = capacity
+        self.stations = {}
+        self.lock = threading.Lock()
+        self.slots = None
+        # Per hazard: number of stations where it is on
+        self.active_counts = allocate('q', len(self.hazard_names), 0)
+        if max_stations:
+            self.slots = allocate('q', max_stations, -1)  # Station id held by each slot, -1 if free
+            self.pool = [Station(None, self.hazard_names, capacity, allocate) for _ in range(max_stations)]
+            # Per hazard and slot (hazard-major): 1 while the hazard is on at the slot's station
+            self.active_slots = allocate('b', len(self.hazard_names) * max_stations, 0)
+            self.slot_of = {}  # Station id -> slot (writer only)
+            self.overflow = {}  # Station id -> hazard onset times of stations past the pool (writer only)
+        else:
+            # Per hazard: ids of the stations where it is on
+            self.active = [set() for _ in self.hazard_names]
+
+    # Pick up stations the writer assigned to slots since the last look (pooled registries)
+    def _sync(self):
+        if self.slots is None or len(self.stations) == len(self.pool):
+            return
+        for slot, station_id in enumerate(self.slots):
+            if station_id < 0:
+                break
+            if station_id not in self.stations:
+                station = self.pool[slot]
+                station.id = station_id
+                self.stations[station_id] = station
+
+    # Station for a reading, created on first sight (writer only); None if the pool is full
+    def _station(self, station_id):
+        station = self.stations.get(station_id)
+        if station is not None:
+            return station
+        if self.slots is None:
+            station = self.stations[station_id] = Station(station_id, self.hazard_names, self.capacity)
+            return station
+        slot = len(self.stations)
+        if slot == len(self.pool):
+            if station_id not in self.overflow:
+                print(f"ERROR: station registry is full ({slot} stations, raise --max-stations); station {station_id} "
+                      f"has no history shard and is left out of /stations and /hazards listings")
+                self.overflow[station_id] = local_array('d', len(self.hazard_names), math.nan)
+            return None
+        station = self.pool[slot]
+        station.id = station_id
+        self.stations[station_id] = station
+        self.slots[slot] = station_id
+        self.slot_of[station_id] = slot
+        return station
+
+    # Record that hazard k turned on or off at a station in the per-hazard indexes (writer only)
+    def _set_active(self, station_id, k, on):
+        self.active_counts[k] += 1 if on else -1
+        if self.slots is None:
+            if on:
+                self.active[k].add(station_id)
+            else:
+                self.active[k].discard(station_id)
+        elif station_id in self.slot_of:
+            self.active_slots[k * len(self.pool) + self.slot_of[station_id]] = 1 if on else 0
+
+    # Sorted ids of the stations where hazard k is on
+    def _active_ids(self, k):
+        with self.lock:
+            if self.slots is None:
+                return sorted(self.active[k])
+            self._sync()
+            remaining = self.active_counts[k]
+            ids = []
+            base = k * len(self.pool)
+            for slot in range(len(self.pool)):
+                if remaining <= 0 or self.slots[slot] < 0:
+                    break
+                if self.active_slots[base + slot]:
+                    ids.append(self.slots[slot])
+                    remaining -= 1
+            return sorted(ids)
+
+    def get(self, station_id):
+        with self.lock:
+            self._sync()
+            return self.stations.get(station_id)
+
+    def all(self):
+        with self.lock:
+            self._sync()
+            return [self.stations[station_id] for station_id in sorted(self.stations)]
+
+    # Add a batch of readings and the hazard engine's result for it ({hazard: bool array} in the
+    # same order); each station's hazard state is taken from its newest reading in the batch.
+    # Returns the hazard transitions as [(reading, hazard, turned on)].
+    def update(self, readings, active):
+        newest = {}
+        transitions = []
+        with self.lock:
+            for i, reading in enumerate(readings):
+                station = self._station(reading.station)
+                if station is not None:
+                    station.add(reading)
+                if reading.station not in newest or reading.timestamp >= readings[newest[reading.station]].timestamp:
+                    newest[reading.station] = i
+
+            for station_id, i in newest.items():
+                station = self.stations.get(station_id)
+                since = station.hazard_since if station is not None else self.overflow[station_id]
+                for k, name in enumerate(self.hazard_names):
+                    if name in active and active[name][i]:
+                        if since[k] != since[k]:
+                            since[k] = readings[i].timestamp
+                            self._set_active(station_id, k, True)
+                            transitions.append((readings[i], name, True))
+                    elif since[k] == since[k]:
+                        since[k] = math.nan
+                        self._set_active(station_id, k, False)
+                        transitions.append((readings[i], name, False))
+        return transitions
+
+    # {hazard: True if any station has it}
+    def fleet_status(self):
+        return {name: self.active_counts[k] > 0 for k, name in enumerate(self.hazard_names)}
+
+    # Ids of the stations currently in the given hazard state
+    def in_state(self, hazard):
+        k = self.hazard_index.get(hazard)
+        if k is None or self.active_counts[k] <= 0:
+            return []
+        return self._active_ids(k)
+
+    # {hazard: [{"station", "since"}, ...]} listing the stations where each hazard is on
+    def hazards(self):
+        listing = {}
+        for k, name in enumerate(self.hazard_names):
+            listing[name] = []
+            if self.active_counts[k] <= 0:
+                continue
+            for station_id in self._active_ids(k):
+                since = self.stations[station_id].hazard_since[k]
+                if since == since:  # May have turned off meanwhile (writer in another process)
+                    listing[name].append({"station": station_id, "since": since})
+        return listing
+
+    # The n stations with the highest value of field since start (latest value if start is None):
+    # [(value, station id), ...]. Windows longer than MAX_TOP_WINDOW are refused, not cut short.
+    def top(self, field, n=10, start=None):
+        if field not in SENSOR_FIELDS:
+            raise ValueError(f"unknown sensor: {field}")
+        if start is not None and start < time.time() - MAX_TOP_WINDOW:
+            raise ValueError(f"window is longer than the {MAX_TOP_WINDOW} s the station rollups cover")
+        values = []
+        for station in self.all():
+            if start is None:
+                row = station.history.last_row()
+                value = row[field] if row else math.nan
+            else:
+                value = station.max_since(field, start)
+            if value == value:
+                values.append((value, station.id))
+        return heapq.nlargest(n, values)
@@ -0,0 +1,251 @@
+import os
+import sys
+import argparse
+from datetime import datetime
+import numpy as np
+from sensor_store import SegmentStore, SENSOR_FIELDS, MAX_LATENESS
+from hazard_engine import ROW_DTYPE
+from cold_storage import segment_rows
+
+# Historical queries straight from the segment files: time range, sensors and stations, streamed
+# in fixed-size chunks so memory use does not depend on the range. Used by the dashboard's /history
+# route and as a CLI (CSV, NDJSON or Parquet).
+# Example: python store_query.py --from "2024-11-01 00:00:00" --to "2024-12-01 00:00:00" --fields Temp,MQ7 --station 1
+#          python store_query.py --format parquet --out history.parquet
+
+# Every INDEX_STRIDE-th row of a segment gets an index mark
+INDEX_STRIDE = 1024
+
+# Rows read, filtered and formatted at a time
+CHUNK_ROWS = 16384
+
+FORMATS = ("csv", "ndjson", "parquet")
+
+
+# Sparse timestamp index of one segment file: its lowest and highest timestamp and, every
+# INDEX_STRIDE rows, the highest timestamp up to that row. Rows are in arrival order, at most
+# MAX_LATENESS older than any row before them, so the marks bound where a time range can start
+# and end. Full segments never change; their index is saved next to them as seg-XXXXXXXX.idx.
+class SegmentIndex:
+    def __init__(self, rows, low, high, marks):
+        self.rows = rows
+        self.low = low
+        self.high = high
+        self.marks = marks
+
+    @classmethod
+    def build(cls, rows):
+        timestamps = rows["timestamp"]
+        return cls(len(rows), float(timestamps.min()), float(timestamps.max()),
+                   np.maximum.accumulate(timestamps)[::INDEX_STRIDE].copy())
+
+    # [first, last) rows that can hold timestamps in [start, end]
+    def row_range(self, start=None, end=None):
+        first, last = 0, self.rows
+        if start is not None:
+            # The running maximum reaches start somewhere after the previous mark
+            first = max(0, int(np.searchsorted(self.marks, start, "left")) - 1) * INDEX_STRIDE
+        if end is not None:
+            # Once the running maximum is past end + MAX_LATENESS, no later row is <= end
+            mark = int(np.searchsorted(self.marks, end + MAX_LATENESS, "right"))
+            if mark < len(self.marks):
+                last = min(self.rows, mark * INDEX_STRIDE + 1)
+        return first, last
+
+
+# Indexes of a store's segments, loaded from disk or built on first use and kept in memory
+class TimeIndex:
+    def __init__(self, store):
+        self.store = store
+        self.segments = {}
+
+    def _index_path(self, index):
+        return self.store._segment_path(index)[:-4] + ".idx"
+
+    def segment(self, index, rows):
+        cached = self.segments.get(index)
+        if cached is not None and cached.rows == len(rows):
+            return cached
+        full = len(rows) == self.store.segment_rows
+        segment = None
+        if full:
+            segment = self._load(index)
+        if segment is None:
+            segment = SegmentIndex.build(rows)
+            if full:
+                self._save(index, segment)
+        self.segments[index] = segment
+        return segment
+
+    def _load(self, index):
+        try:
+            values = np.fromfile(self._index_path(index), dtype="<f8")
+        except OSError:
+            return None
+        marks = -(-self.store.segment_rows // INDEX_STRIDE)
+        if len(values) != 2 + marks:
+            return None
+        return SegmentIndex(self.store.segment_rows, float(values[0]), float(values[1]), values[2:])
+
+    def _save(self, index, segment):
+        path = self._index_path(index)
+        try:
+            np.concatenate(([segment.low, segment.high], segment.marks)).astype("<f8").tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass  # Read-only store directory: keep the index in memory only
+
+
+# Indexes shared by every query on the same store directory
+_indexes = {}
+
+
+def time_index(store):
+    index = _indexes.get(store.path)
+    if index is None or index.store.segment_rows != store.segment_rows:
+        index = _indexes[store.path] = TimeIndex(store)
+    return index
+
+
+# Stored rows with start <= timestamp <= end, optionally only some stations, as structured arrays
+# of seq, timestamp, station and the chosen fields, at most CHUNK_ROWS rows each
+def query(store, start=None, end=None, fields=SENSOR_FIELDS, stations=None, limit=None):
+    # Checked here rather than in the generator, so callers see it before streaming anything
+    if limit is not None and limit < 0:
+        raise ValueError("limit must not be negative")
+    return _query(store, start, end, fields, stations, limit)
+
+
+def _query(store, start, end, fields, stations, limit):
+    index = time_index(store)
+    columns = ["seq", "timestamp", "station"] + list(fields)
+    stations = np.asarray(sorted(stations), dtype=np.uint16) if stations else None
+    remaining = limit
+    for number in store.segments():
+        path = store._segment_path(number)
+        try:
+            count = os.path.getsize(path) // ROW_DTYPE.itemsize
+            rows = np.memmap(path, dtype=ROW_DTYPE, mode="r", shape=(count,)) if count else None
+        except FileNotFoundError:
+            # Compacted (possibly just now): decode only the wanted columns, if the block overlaps the range at all
+            rows = segment_rows(store, number, columns, start, end)
+            if rows is None:
+                continue
+            first, last = 0, len(rows)
+        else:
+            if rows is None:
+                continue
+            segment = index.segment(number, rows)
+            if (start is not None and segment.high < start) or (end is not None and segment.low > end):
+                continue
+            first, last = segment.row_range(start, end)
+        for offset in range(first, last, CHUNK_ROWS):
+            chunk = rows[offset:min(last, offset + CHUNK_ROWS)]
+            mask = np.ones(len(chunk), dtype=bool)
+            if start is not None:
+                mask &= chunk["timestamp"] >= start
+            if end is not None:
+                mask &= chunk["timestamp"] <= end
+            if stations is not None:
+                mask &= np.isin(chunk["station"], stations)
+            selected = chunk[columns][mask]
+            if remaining is not None:
+                selected = selected[:remaining]
+                remaining -= len(selected)
+            if len(selected):
+                yield np.array(selected)
+            if remaining == 0:
+                return
+        del rows
+
+
+# CSV lines (header first) for query chunks; missing values are empty
+def iter_csv(chunks, fields=SENSOR_FIELDS):
+    yield ",".join(["seq", "timestamp", "station"] + list(fields)) + "\n"
+    line = "%d,%r,%d" + ",%r" * len(fields) + "\n"
+    for chunk in chunks:
+        yield "".join([line % row for row in chunk.tolist()]).replace("nan", "")
+
+
+# Newline-delimited JSON, one object per row; missing values are null
+def iter_ndjson(chunks, fields=SENSOR_FIELDS):
+    line = '{"seq":%d,"timestamp":%r,"station":%d' + "".join(f',"{field}":%r' for field in fields) + "}\n"
+    for chunk in chunks:
+        yield "".join([line % row for row in chunk.tolist()]).replace("nan", "null")
+
+
+# Write query chunks to a Parquet file, one row group per chunk; returns the number of rows
+def write_parquet(chunks, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+    writer = None
+    count = 0
+    try:
+        for chunk in chunks:
+            table = pa.table({name: chunk[name] for name in chunk.dtype.names})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# Parse a "YYYY-MM-DD HH:MM:SS" argument to an epoch timestamp
+def parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp() if value else None
+
+
+# Parse a comma-separated list of sensors; raises ValueError for unknown ones
+def parse_fields(value):
+    if not value:
+        return SENSOR_FIELDS
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    for field in fields:
+        if field not in SENSOR_FIELDS:
+            raise ValueError(f"unknown sensor: {field}")
+    return fields
+
+
+# Parse a comma-separated list of station ids
+def parse_stations(value):
+    if not value:
+        return None
+    return [int(station) for station in value.split(",") if station.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or export stored readings by time range, sensor and station")
+    parser.add_argument('--store', default='sensor_store', help="store directory")
+    parser.add_argument('--from', dest='start', help="start time, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument('--to', dest='end', help="end time, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument('--fields', help="comma-separated sensors (default: all)")
+    parser.add_argument('--station', help="comma-separated station ids (default: all)")
+    parser.add_argument('--limit', type=int, help="at most this many rows")
+    parser.add_argument('--format', choices=FORMATS, default='csv', help="output format")
+    parser.add_argument('--out', help="output file (default: standard output; required for parquet)")
+    args = parser.parse_args()
+    if args.limit is not None and args.limit < 0:
+        parser.error("--limit must not be negative")
+
+    fields = parse_fields(args.fields)
+    chunks = query(SegmentStore(args.store, readonly=True), parse_time(args.start), parse_time(args.end),
+                   fields, parse_stations(args.station), args.limit)
+    if args.format == 'parquet':
+        if not args.out:
+            parser.error("--out is required for parquet")
+        print(f"Exported {write_parquet(chunks, args.out)} rows to {args.out}")
+    else:
+        lines = iter_csv(chunks, fields) if args.format == 'csv' else iter_ndjson(chunks, fields)
+        out = open(args.out, "w", newline="") if args.out else sys.stdout
+        try:
+            for text in lines:
+                out.write(text)
+        finally:
+            if args.out:
+                out.close()
@@ -0,0 +1,133 @@
+import json
+import math
+from sensor_store import SENSOR_FIELDS
+from hazard_engine import HAZARD_RULES
+
+# Parameters of a trend rule and their defaults
+#   direction        "up" or "down": which way is dangerous (Water_Level is a distance, so "down")
+#   half_life        seconds for the EWMA baseline (mean and variance) to halve an old sample's weight
+#   rate_half_life   seconds, same for the smoothed level and slope the rate of change is taken from
+#   min_sigma        noise floor for the z-score, in sensor units (quantised sensors report 0 variance)
+#   rise_per_minute  smoothed rate of change, in sensor units per minute, that raises a warning
+#   drift            CUSUM slack per sample, in standard deviations
+#   threshold        CUSUM level, in standard deviations, that raises a warning
+TREND_DEFAULTS = {
+    "direction": "up",
+    "half_life": 300,
+    "rate_half_life": 30,
+    "min_sigma": 1.0,
+    "rise_per_minute": math.inf,
+    "drift": 0.5,
+    "threshold": 10.0,
+}
+
+
+# Rolling state of one sensor at one station: a fixed handful of numbers, updated in O(1) per sample
+class SensorTrend:
+    __slots__ = ("mean", "var", "level", "slope", "started", "time", "z", "cusum", "rising", "since")
+
+    def __init__(self, value, timestamp):
+        self.mean = value
+        self.var = 0.0
+        self.level = value
+        self.slope = 0.0  # Units per second
+        self.started = timestamp
+        self.time = timestamp
+        self.z = 0.0
+        self.cusum = 0.0
+        self.rising = False
+        self.since = None
+
+    def summary(self):
+        return {
+            "mean": round(self.mean, 3),
+            "sigma": round(math.sqrt(self.var), 3),
+            "z": round(self.z, 2),
+            "rate_per_minute": round(self.slope * 60, 3),
+            "cusum": round(self.cusum, 2),
+            "rising": self.rising,
+        }
+
+
+# Streaming early-warning stage: per station and sensor, a time-weighted EWMA/EWMV baseline, the
+# z-score of each sample against it, a rate of change (Holt's linear trend: a faster EWMA level
+# and its smoothed slope) and a one-sided CUSUM of the z-scores.
+# A sensor is "rising" while the CUSUM or the rate is past its rule's level, which catches a fast
+# climb (fire heating up, water coming in) before the absolute hazard thresholds trip. Readings
+# must arrive in time order per station, as they do from the store; older ones are ignored.
+class TrendDetector:
+    def __init__(self, rules):
+        self.rules = {}
+        for sensor, rule in rules.items():
+            if sensor not in SENSOR_FIELDS:
+                raise ValueError(f"unknown sensor in trend rule: {sensor}")
+            params = dict(TREND_DEFAULTS, **rule)
+            if params["direction"] not in ("up", "down"):
+                raise ValueError(f"bad trend direction for {sensor}: {params['direction']}")
+            params["sign"] = 1 if params["direction"] == "up" else -1
+            self.rules[sensor] = params
+        # (station, sensor) -> SensorTrend
+        self.state = {}
+
+    @classmethod
+    def from_file(cls, path=HAZARD_RULES):
+        with open(path) as f:
+            return cls(json.load(f).get("trends", {}))
+
+    def update(self, readings):
+        for reading in readings:
+            for sensor, rule in self.rules.items():
+                value = getattr(reading, sensor)
+                if value == value:
+                    self.add(reading.station, sensor, rule, value, reading.timestamp)
+
+    def add(self, station, sensor, rule, value, timestamp):
+        trend = self.state.get((station, sensor))
+        if trend is None:
+            self.state[(station, sensor)] = SensorTrend(value, timestamp)
+            return
+        dt = timestamp - trend.time
+        if dt <= 0:
+            return
+        # Weights depend on the time since the last sample, so sparse (edge filtered) stations
+        # and fast ones get the same baseline
+        alpha = 1 - 0.5 ** (dt / rule["half_life"])
+        rate_alpha = 1 - 0.5 ** (dt / rule["rate_half_life"])
+        residual = value - trend.mean
+        trend.z = residual / max(math.sqrt(trend.var), rule["min_sigma"])
+        trend.mean += alpha * residual
+        trend.var = (1 - alpha) * (trend.var + alpha * residual * residual)
+        predicted = trend.level + trend.slope * dt
+        level = predicted + rate_alpha * (value - predicted)
+        trend.slope += rate_alpha * ((level - trend.level) / dt - trend.slope)
+        trend.level = level
+        trend.cusum = max(0.0, trend.cusum + rule["sign"] * trend.z - rule["drift"])
+        trend.time = timestamp
+
+        # No warnings until the baseline has seen a half-life of samples
+        if timestamp - trend.started < rule["half_life"]:
+            trend.cusum = 0.0
+            return
+        rising = trend.cusum > rule["threshold"] or rule["sign"] * trend.slope * 60 >= rule["rise_per_minute"]
+        if rising and not trend.rising:
+            trend.since = timestamp
+        trend.rising = rising
+
+    # {sensor: summary} for one station
+    def station(self, station_id):
+        return {sensor: self.state[(station_id, sensor)].summary()
+                for sensor in self.rules if (station_id, sensor) in self.state}
+
+    # {sensor: [{"station", "since", "rate_per_minute", "z"}, ...]} for every sensor rising anywhere
+    def warnings(self):
+        listing = {sensor: [] for sensor in self.rules}
+        for (station_id, sensor), trend in self.state.items():
+            if trend.rising:
+                listing[sensor].append({"station": station_id, "since": trend.since,
+                                        "rate_per_minute": round(trend.slope * 60, 3), "z": round(trend.z, 2)})
+        return listing
+
+
+# {sensor: [station ids]} of a warnings() listing, to tell whether the set of warnings changed
+def warning_stations(warnings):
+    return {sensor: [warning["station"] for warning in listing] for sensor, listing in (warnings or {}).items()}
@@ -0,0 +1,132 @@
+import os
+import time
+import struct
+import zlib
+from sensor_store import SegmentStore, SEGMENT_ROWS, ROW, ROW_SIZE, Reading
+
+# Log file kept in the store directory
+WAL_NAME = "wal.log"
+
+# Checkpoint (flush the segment files, empty the log) when the log grows past this many
+# bytes or this many seconds after the previous checkpoint, whichever comes first
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+CHECKPOINT_INTERVAL = 60
+
+# Log record: row count (u32) and CRC-32 of the rows, followed by that many store rows
+RECORD_HEADER = struct.Struct("<II")
+
+
+# Append-only log of store rows. Each append is one sequential write; commit() makes every
+# record appended so far durable with a single fsync, so a whole batch shares one fsync.
+class WriteAheadLog:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab", buffering=0)
+        self.size = self.file.seek(0, os.SEEK_END)
+
+    def append(self, readings):
+        rows = b"".join(ROW.pack(*reading) for reading in readings)
+        self.file.write(RECORD_HEADER.pack(len(readings), zlib.crc32(rows)) + rows)
+        self.size += RECORD_HEADER.size + len(rows)
+
+    def commit(self):
+        os.fsync(self.file.fileno())
+
+    # Readings of every complete record, stopping at the first torn or corrupt one
+    def readings(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        readings = []
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            count, crc = RECORD_HEADER.unpack_from(data, offset)
+            rows = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + count * ROW_SIZE]
+            if len(rows) != count * ROW_SIZE or zlib.crc32(rows) != crc:
+                print(f"Write-ahead log ends with a torn record at byte {offset}; ignoring the rest")
+                break
+            readings.extend(Reading(*row) for row in ROW.iter_unpack(rows))
+            offset += RECORD_HEADER.size + len(rows)
+        return readings
+
+    # Empty the log (after a checkpoint)
+    def reset(self):
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+        self.size = 0
+
+    def close(self):
+        self.file.close()
+
+
+# Make a directory entry change (a new segment file) durable where the platform allows it
+def fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Windows: directories cannot be opened
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Segment store whose appends go through a write-ahead log: a batch is numbered, logged and
+# fsynced (group commit) before it is written to the segment files, which are only flushed at
+# checkpoints. After a crash, startup rewrites the logged rows over whatever the segment files
+# hold from the first logged seq on, so recovery reads only the log, never the whole history.
+class DurableStore(SegmentStore):
+    def __init__(self, path="sensor_store", segment_rows=SEGMENT_ROWS, checkpoint_bytes=CHECKPOINT_BYTES,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        super().__init__(path, segment_rows)
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_interval = checkpoint_interval
+        self.wal = WriteAheadLog(os.path.join(path, WAL_NAME))
+        self.recover()
+        self.last_checkpoint = time.monotonic()
+
+    # Replay the log into the segment files; returns the number of readings recovered
+    def recover(self):
+        readings = self.wal.readings()
+        if readings:
+            started = time.perf_counter()
+            # A batch whose segment write failed was logged but not acknowledged, and its seqs were
+            # given to the next batch: the last logged row for each seq wins
+            by_seq = {reading.seq: reading for reading in readings}
+            first = min(by_seq)
+            readings = [by_seq[seq] for seq in range(first, first + len(by_seq)) if seq in by_seq]
+            if len(readings) != len(by_seq):
+                raise IOError("write-ahead log has a gap in its sequence numbers")
+            if first > self.next_seq():
+                raise IOError(f"store ends at {self.next_seq()} but the write-ahead log starts at {first}")
+            # Rows from the first logged one on may be missing or torn in the segment files
+            self.truncate(first)
+            self.write_readings(readings)
+            print(f"Recovered {len(readings)} readings from the write-ahead log in {time.perf_counter() - started:.3f}s")
+        if readings or self.wal.size:
+            self.checkpoint()
+        return len(readings)
+
+    def append_many(self, rows):
+        readings = self.make_readings(rows)
+        if not readings:
+            return readings
+        self.wal.append(readings)
+        self.wal.commit()
+        self.write_readings(readings)
+        if self.wal.size >= self.checkpoint_bytes or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+        return readings
+
+    # Flush the segment files, then empty the log: everything logged so far is in the store
+    def checkpoint(self):
+        self.sync()
+        fsync_directory(self.path)
+        self.wal.reset()
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        self.checkpoint()
+        self.wal.close()
+        super().close()